@@ -0,0 +1,292 @@
+"""
+准入控制
+
+按路由类别限制同时进行的数据库操作数，超出部分在进程内排队：
+- ingest: 追加、创建、结束会话等写入接口，优先级最高
+- read: 单个会话的查询接口
+- export: 跨会话的扫描类接口（会话列表、检索、统计分析、数据清理）
+
+排队已满时立即返回429，排队超过 ADMISSION_QUEUE_TIMEOUT 秒仍未轮到时返回503，均带 Retry-After。
+数据库初始化和连接池预热完成之前，/api/v1 下的请求直接返回503（ReadinessMiddleware，不受 ADMISSION_ENABLED 影响）。
+有更高优先级的请求在排队时，低优先级的请求不会被放行。
+数据库变慢时请求在这里快速失败，而不是在连接池上等待 DB_POOL_TIMEOUT 后一起超时。
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api/v1"
+
+# 跨会话扫描类接口（GET）
+EXPORT_PATHS = ("/search", "/analytics/", "/stats", "/retention/")
+
+# 响应开始前已读取全部数据、之后只从内存输出的流式接口，响应开始发送时即释放名额
+RELEASE_ON_START_SUFFIXES = ("/replay",)
+
+# 平均耗时的平滑系数
+LATENCY_SMOOTHING = 0.2
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """请求所属的路由类别，不受准入控制的请求（健康检查、文档等）返回None"""
+    if not path.startswith(API_PREFIX + "/"):
+        return None
+    path = path[len(API_PREFIX):]
+    if path == "/sessions" and method == "GET" or path.startswith(EXPORT_PATHS):
+        return "export"
+    if method in ("GET", "HEAD"):
+        return "read"
+    return "ingest"
+
+
+class RouteClass:
+    """一个路由类别的并发限制、排队和统计"""
+
+    def __init__(self, name: str, limit: int, priority: int):
+        self.name = name
+        self.limit = max(limit, 1)
+        self.priority = priority
+        self.in_flight = 0
+        self.waiters: "deque[asyncio.Future]" = deque()
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+        self.avg_latency = 0.0
+
+    def record_latency(self, seconds: float):
+        if self.avg_latency == 0.0:
+            self.avg_latency = seconds
+        else:
+            self.avg_latency += LATENCY_SMOOTHING * (seconds - self.avg_latency)
+
+    def retry_after(self) -> int:
+        """按排队长度和平均耗时估算排到所需的秒数"""
+        return max(1, math.ceil((len(self.waiters) + 1) * self.avg_latency / self.limit))
+
+
+class AdmissionController:
+    """按路由类别的准入控制（在事件循环中使用，不跨线程）"""
+
+    def __init__(
+        self,
+        limits: Dict[str, int],
+        max_in_flight: int,
+        queue_limit: int,
+        queue_timeout: float
+    ):
+        # 字典顺序即优先级顺序
+        self.classes = {
+            name: RouteClass(name, limit, priority) for priority, (name, limit) in enumerate(limits.items())
+        }
+        self.max_in_flight = max(max_in_flight, 1)
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        return cls(
+            {
+                "ingest": settings.ADMISSION_INGEST_LIMIT,
+                "read": settings.ADMISSION_READ_LIMIT,
+                "export": settings.ADMISSION_EXPORT_LIMIT,
+            },
+            max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+            queue_limit=settings.ADMISSION_QUEUE_LIMIT,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+        )
+
+    def _has_capacity(self, route: RouteClass) -> bool:
+        return route.in_flight < route.limit and self.in_flight < self.max_in_flight
+
+    def _higher_priority_waiting(self, route: RouteClass) -> bool:
+        """是否有更高优先级的请求在等待全局名额（只受自身类别限制的排队不影响其他类别）"""
+        return any(
+            other.waiters and other.in_flight < other.limit
+            for other in self.classes.values() if other.priority < route.priority
+        )
+
+    def _admit(self, route: RouteClass):
+        route.in_flight += 1
+        route.admitted += 1
+        self.in_flight += 1
+
+    def _wake(self):
+        """按优先级放行排队的请求"""
+        for route in sorted(self.classes.values(), key=lambda item: item.priority):
+            while route.waiters and self._has_capacity(route):
+                waiter = route.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._admit(route)
+                waiter.set_result(None)
+            if route.waiters and route.in_flight < route.limit:
+                # 全局名额已满，高优先级仍在排队时不放行低优先级
+                return
+
+    async def acquire(self, name: str) -> Optional[Tuple[int, int, str]]:
+        """
+        获取执行名额
+
+        放行时返回None，拒绝时返回 (状态码, Retry-After秒数, 原因)
+        """
+        route = self.classes[name]
+        if not route.waiters and self._has_capacity(route) and not self._higher_priority_waiting(route):
+            self._admit(route)
+            return None
+
+        if len(route.waiters) >= self.queue_limit:
+            route.rejected["queue_full"] += 1
+            return 429, route.retry_after(), "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        route.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+            return None
+        except asyncio.TimeoutError:
+            if waiter not in route.waiters and waiter.done() and not waiter.cancelled():
+                # 超时的同时已被放行
+                return None
+            route.waiters.remove(waiter)
+            route.rejected["timeout"] += 1
+            return 503, route.retry_after(), "timeout"
+        except asyncio.CancelledError:
+            # 客户端断开
+            if waiter in route.waiters:
+                route.waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                self.release(name, 0.0)
+            raise
+
+    def release(self, name: str, elapsed: float):
+        route = self.classes[name]
+        route.in_flight -= 1
+        self.in_flight -= 1
+        if elapsed > 0:
+            route.record_latency(elapsed)
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        """各类别的并发数、排队长度和拒绝数"""
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "classes": {
+                name: {
+                    "in_flight": route.in_flight,
+                    "limit": route.limit,
+                    "queued": len(route.waiters),
+                    "admitted": route.admitted,
+                    "rejected": dict(route.rejected),
+                    "avg_latency_ms": round(route.avg_latency * 1000, 2),
+                }
+                for name, route in self.classes.items()
+            }
+        }
+
+    def metrics(self) -> str:
+        """Prometheus文本格式的指标"""
+        gauges = [
+            ("admission_in_flight", "gauge", lambda route: route.in_flight),
+            ("admission_queue_depth", "gauge", lambda route: len(route.waiters)),
+            ("admission_admitted_total", "counter", lambda route: route.admitted),
+        ]
+        lines = []
+        for metric, kind, value in gauges:
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(f'{metric}{{class="{name}"}} {value(route)}' for name, route in self.classes.items())
+        lines.append("# TYPE admission_rejected_total counter")
+        for name, route in self.classes.items():
+            for reason, count in route.rejected.items():
+                lines.append(f'admission_rejected_total{{class="{name}",reason="{reason}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class AdmissionMiddleware:
+    """
+    准入控制中间件，名额保持到响应（含流式响应）的最后一段响应体发送完毕，不包括之后的后台任务；
+    RELEASE_ON_START_SUFFIXES 中的接口在响应开始发送时释放
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        rejection = await self.controller.acquire(name)
+        if rejection is not None:
+            status_code, retry_after, reason = rejection
+            logger.warning(f"{name} 类请求被拒绝({reason}): {scope['method']} {scope['path']}")
+            response = JSONResponse(
+                {"detail": "服务繁忙，请稍后重试", "reason": reason},
+                status_code=status_code,
+                headers={"Retry-After": str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(name, time.monotonic() - started)
+
+        release_on_start = scope["path"].endswith(RELEASE_ON_START_SUFFIXES)
+
+        async def send_message(message):
+            if release_on_start and message["type"] == "http.response.start":
+                release()
+            await send(message)
+            # 响应体发送完毕即释放，不等待响应后执行的后台任务（压缩、数据清理）
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                release()
+
+        try:
+            await self.app(scope, receive, send_message)
+        finally:
+            release()
+
+
+class ReadinessMiddleware:
+    """启动预热完成之前拒绝 /api/v1 下的请求（503和Retry-After），/health、/ready 等不受影响"""
+
+    def __init__(self, app, state):
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.state.ready or not scope["path"].startswith(API_PREFIX + "/"):
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(
+            {"detail": "服务启动中，请稍后重试", "reason": "starting"},
+            status_code=503,
+            headers={"Retry-After": str(max(1, math.ceil(settings.STARTUP_RETRY_INTERVAL)))}
+        )
+        await response(scope, receive, send)
+
+
+# 全局准入控制器
+admission_controller = AdmissionController.from_settings()
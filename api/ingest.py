@@ -0,0 +1,117 @@
+"""
+紧凑的事件写入格式
+
+- 单个事件: POST /sessions/{session_id}/events，请求体为msgpack（Content-Type: application/msgpack）或JSON，
+  session_id只在URL中出现
+- 帧流: POST /events/stream，请求体为连续的帧，每帧为4字节大端长度 + 一个msgpack编码的事件，
+  一个请求中可以包含任意多个会话的事件，边接收边解码
+
+事件字段固定且简单，解码后直接做类型检查，不经过Pydantic校验。
+"""
+import json
+import struct
+from typing import Any, AsyncIterator, Dict, Optional
+
+from config.settings import settings
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+EVENT_TYPES = ("user_input", "system_marker", "llm_output", "observation")
+
+FRAME_HEADER = struct.Struct(">I")
+
+
+class IngestFormatError(ValueError):
+    """请求体格式错误"""
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split(";")[0].strip().lower() in MSGPACK_CONTENT_TYPES
+
+
+def decode_body(body: bytes, content_type: Optional[str]) -> Any:
+    """按Content-Type解码请求体（msgpack或JSON）"""
+    try:
+        if is_msgpack(content_type):
+            if msgpack is None:
+                raise IngestFormatError("服务端未安装msgpack")
+            return msgpack.unpackb(body, raw=False)
+        return orjson.loads(body) if orjson is not None else json.loads(body)
+    except IngestFormatError:
+        raise
+    except Exception as e:
+        raise IngestFormatError(f"请求体解码失败: {e}")
+
+
+def parse_event(data: Any, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    检查并规范化一个事件，字段与批量接口的事件一致
+
+    session_id由URL给出时事件中可以省略
+    """
+    if not isinstance(data, dict):
+        raise IngestFormatError("事件必须是对象")
+    event_type = data.get("type")
+    if event_type not in EVENT_TYPES:
+        raise IngestFormatError(f"不支持的事件类型: {event_type}")
+    event_session_id = data.get("session_id", session_id)
+    if not isinstance(event_session_id, str) or not event_session_id:
+        raise IngestFormatError("缺少session_id")
+    if session_id is not None and event_session_id != session_id:
+        raise IngestFormatError("URL中的session_id与事件中的不一致")
+    content = data.get("content")
+    if not isinstance(content, str):
+        raise IngestFormatError("content必须是字符串")
+    event_id = data.get("event_id")
+    if event_id is not None and (not isinstance(event_id, str) or len(event_id) > 128):
+        raise IngestFormatError("event_id必须是不超过128个字符的字符串")
+    tool_name = data.get("tool_name")
+    if tool_name is not None and not isinstance(tool_name, str):
+        raise IngestFormatError("tool_name必须是字符串")
+    tool_call_id = data.get("tool_call_id")
+    if tool_call_id is not None and (not isinstance(tool_call_id, int) or isinstance(tool_call_id, bool)):
+        raise IngestFormatError("tool_call_id必须是整数")
+    return {
+        "type": event_type,
+        "session_id": event_session_id,
+        "content": content,
+        "event_id": event_id,
+        "tool_name": tool_name,
+        "tool_call_id": tool_call_id,
+    }
+
+
+async def iter_frames(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """从请求体的字节流中逐帧解码msgpack对象"""
+    if msgpack is None:
+        raise IngestFormatError("服务端未安装msgpack")
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        offset = 0
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(buffer, offset)
+            if length > settings.INGEST_MAX_FRAME_BYTES:
+                raise IngestFormatError(f"帧长度 {length} 超过上限 {settings.INGEST_MAX_FRAME_BYTES}")
+            end = offset + FRAME_HEADER.size + length
+            if len(buffer) < end:
+                break
+            try:
+                data = msgpack.unpackb(bytes(buffer[offset + FRAME_HEADER.size:end]), raw=False)
+            except Exception as e:
+                raise IngestFormatError(f"帧解码失败: {e}")
+            offset = end
+            yield data
+        del buffer[:offset]
+    if buffer:
+        raise IngestFormatError("请求体以不完整的帧结束")
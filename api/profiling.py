@@ -0,0 +1,273 @@
+"""
+请求剖析（可选开启）
+
+按 PROFILE_SAMPLE_RATE 抽样，或请求头带 PROFILE_HEADER 时，记录该请求的耗时分解：
+- parse: 读取请求体、依赖注入和Pydantic校验（路由处理开始到接口函数开始）
+- endpoint: 接口函数（PromptTracker逻辑 + SQL）
+- sql: 每条SQL语句的耗时，超过 PROFILE_EXPLAIN_MS 的SELECT/UPDATE/DELETE附带执行计划
+- logic: endpoint中除SQL以外的耗时
+- serialize: 响应校验和序列化（接口函数返回到路由处理结束）
+
+总耗时超过 PROFILE_SLOW_MS 的请求保存在内存环形缓冲区中，由 /debug/slow-requests 查看。
+跨分片并行查询在线程池中执行，其SQL不计入请求的剖析结果。
+"""
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# 记录执行计划的语句类型
+EXPLAIN_PREFIXES = ("SELECT", "UPDATE", "DELETE")
+
+# 记录的SQL语句最大长度
+MAX_STATEMENT_CHARS = 2000
+
+
+class RequestProfile:
+    """一次请求的耗时分解"""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.handler_start: Optional[float] = None
+        self.handler_end: Optional[float] = None
+        self.endpoint_start: Optional[float] = None
+        self.endpoint_end: Optional[float] = None
+        self.statements: List[Dict[str, Any]] = []
+        self.statement_count = 0
+        self.sql_seconds = 0.0
+        self.explain_seconds = 0.0
+        self.status_code: Optional[int] = None
+        self.total: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.total is not None
+
+    def add_statement(self, statement: str, seconds: float, explain: Optional[List[Any]] = None):
+        self.statement_count += 1
+        self.sql_seconds += seconds
+        if len(self.statements) >= settings.PROFILE_MAX_STATEMENTS:
+            return
+        entry = {"statement": statement[:MAX_STATEMENT_CHARS], "ms": round(seconds * 1000, 3)}
+        if explain is not None:
+            entry["explain"] = explain
+        self.statements.append(entry)
+
+    def to_dict(self) -> Dict[str, Any]:
+        def ms(seconds: Optional[float]) -> Optional[float]:
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        parse = serialize = endpoint = logic = None
+        if self.handler_start is not None and self.endpoint_start is not None:
+            parse = self.endpoint_start - self.handler_start
+        if self.endpoint_start is not None and self.endpoint_end is not None:
+            endpoint = self.endpoint_end - self.endpoint_start
+            # 获取执行计划的时间是剖析本身的开销，不计入逻辑耗时
+            logic = max(endpoint - self.sql_seconds - self.explain_seconds, 0.0)
+        if self.endpoint_end is not None and self.handler_end is not None:
+            serialize = self.handler_end - self.endpoint_end
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "total_ms": ms(self.total),
+            "parse_ms": ms(parse),
+            "endpoint_ms": ms(endpoint),
+            "logic_ms": ms(logic),
+            "sql_ms": ms(self.sql_seconds),
+            "serialize_ms": ms(serialize),
+            "explain_ms": ms(self.explain_seconds),
+            "sql_count": self.statement_count,
+            "sql": self.statements,
+        }
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+class SlowRequestLog:
+    """慢请求环形缓冲区"""
+
+    def __init__(self, size: int):
+        self._entries: "deque[Dict[str, Any]]" = deque(maxlen=max(size, 1))
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._entries.append(profile.to_dict())
+
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        """最近的慢请求，最新的在前"""
+        with self._lock:
+            entries = list(self._entries)
+        return entries[::-1][:limit]
+
+
+slow_requests = SlowRequestLog(settings.PROFILE_RING_SIZE)
+
+
+class ProfiledRoute(APIRoute):
+    """记录路由处理和接口函数起止时间的路由类，用于分解出解析和序列化耗时"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            profile = current_profile.get()
+            if profile is None:
+                return await handler(request)
+            profile.handler_start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                profile.handler_end = time.perf_counter()
+
+        return profiled_handler
+
+
+def _timed_endpoint(endpoint):
+    """包装接口函数记录起止时间（保留签名，FastAPI据此解析参数）"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            profile = current_profile.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            profile.endpoint_start = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.endpoint_end = time.perf_counter()
+        return timed
+
+    @functools.wraps(endpoint)
+    def timed_sync(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        profile.endpoint_start = time.perf_counter()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.endpoint_end = time.perf_counter()
+    return timed_sync
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is None or profile.finished:
+        return
+    starts = conn.info.get("profile_start")
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    explain = None
+    if (
+        not executemany
+        and seconds * 1000 >= settings.PROFILE_EXPLAIN_MS
+        and statement.lstrip().upper().startswith(EXPLAIN_PREFIXES)
+    ):
+        explain_start = time.perf_counter()
+        explain = _explain(conn, cursor, statement, parameters)
+        profile.explain_seconds += time.perf_counter() - explain_start
+    profile.add_statement(statement, seconds, explain)
+
+
+def _explain(conn, cursor, statement, parameters) -> Optional[List[Any]]:
+    """在同一个DBAPI连接上获取执行计划（不经过SQLAlchemy事件）"""
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    try:
+        explain_cursor = cursor.connection.cursor()
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            columns = [column[0] for column in explain_cursor.description or ()]
+            return [dict(zip(columns, row)) for row in explain_cursor.fetchall()]
+        finally:
+            explain_cursor.close()
+    except Exception as e:
+        return [{"error": str(e)}]
+
+
+def install_sql_hooks():
+    """注册SQL计时（开启剖析时在应用启动时调用一次）"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class ProfilingMiddleware:
+    """抽样剖析请求，慢请求写入环形缓冲区"""
+
+    def __init__(self, app):
+        self.app = app
+        self.header = settings.PROFILE_HEADER.lower().encode("latin-1")
+
+    def _sample_reason(self, scope) -> Optional[str]:
+        for name, value in scope.get("headers", []):
+            if name == self.header and value not in (b"", b"0", b"false"):
+                return "header"
+        if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        reason = self._sample_reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], reason)
+        token = current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # 响应发送完毕即结束计时，之后的后台任务不计入
+                profile.total = time.perf_counter() - profile.start
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(token)
+            if profile.total is None:
+                profile.total = time.perf_counter() - profile.start
+            if profile.total * 1000 >= settings.PROFILE_SLOW_MS:
+                slow_requests.add(profile)
+                logger.warning(
+                    f"慢请求 {profile.method} {profile.path}: {profile.total * 1000:.1f}ms，"
+                    f"SQL {profile.statement_count} 条 {profile.sql_seconds * 1000:.1f}ms"
+                )
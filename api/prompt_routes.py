@@ -1,25 +1,120 @@
 """
 提示词追踪系统的API路由 - 重新设计版本
 """
+import asyncio
+import heapq
 import logging
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import datetime, timezone
+from typing import List, Literal, Optional, Union
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, func
 
-from database import get_db
+from config.settings import settings
+from database import shard_router, get_session_db, get_session_read_db
 from core.prompt_tracker import PromptTracker
+from core.lifecycle import SessionLifecycle
+from core.retention import RetentionManager
+from core.invalidation import invalidation_bus
+from core.event_rollups import TimeseriesError, parse_step
+from api.admission import admission_controller
+from api.profiling import ProfiledRoute
+from api.ingest import IngestFormatError, decode_body, parse_event, iter_frames, is_msgpack
+from api.responses import (
+    FastJSONResponse, NDJSON_MEDIA_TYPE, ndjson_line, row_to_dict, serialize_row, serialize_rows
+)
 from models.prompt_models import (
-    SessionModel, PromptModel, ToolCallModel,
+    SessionModel, PromptModel, ToolCallModel, SessionSummaryModel,
     SessionResponse, PromptResponse, ToolCallResponse,
-    PromptType
+    SessionSummaryResponse, PromptSummaryResponse, SearchResultResponse,
+    PromptType, SessionStatus
 )
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+# 开启请求剖析时使用记录接口函数起止时间的路由类
+router = APIRouter(route_class=ProfiledRoute if settings.PROFILING_ENABLED else APIRoute)
 prompt_tracker = PromptTracker()
+session_lifecycle = SessionLifecycle(prompt_tracker)
+retention_manager = RetentionManager()
+
+# 快速序列化路径使用的字段列表，与响应模型保持一致
+SESSION_FIELDS = tuple(SessionResponse.model_fields)
+PROMPT_FIELDS = tuple(PromptResponse.model_fields)
+TOOL_CALL_FIELDS = tuple(ToolCallResponse.model_fields)
+SESSION_SUMMARY_FIELDS = tuple(SessionSummaryResponse.model_fields)
+PROMPT_SUMMARY_FIELDS = tuple(PromptSummaryResponse.model_fields)
+# 还原提示词内容所需的列（见 PromptChain.materialize）
+PROMPT_RENDER_COLUMNS = ("session_id", "is_delta", "prompt_length")
+
+# 会话列表可选择的列（摘要列来自session_summaries）
+SESSION_COLUMNS = {
+    **{field: getattr(SessionModel, field) for field in SESSION_FIELDS},
+    "last_prompt_id": SessionSummaryModel.last_prompt_id,
+    "event_count": (
+        SessionSummaryModel.init_count + SessionSummaryModel.user_input_count
+        + SessionSummaryModel.system_marker_count + SessionSummaryModel.llm_output_count
+        + SessionSummaryModel.observation_count
+    ),
+    "prompt_length": func.coalesce(SessionSummaryModel.content_length, SessionSummaryModel.prompt_length),
+    "total_tokens": SessionSummaryModel.total_tokens,
+    "tool_call_count": SessionSummaryModel.tool_call_count,
+    "last_activity_at": SessionSummaryModel.last_activity_at,
+}
+
+def _resolve_fields(
+    fields: Optional[str],
+    view: str,
+    full_fields: tuple,
+    summary_fields: tuple,
+    allowed_fields: Optional[tuple] = None
+) -> tuple:
+    """
+    解析列表接口的字段投影
+
+    fields优先于view；只允许选择allowed_fields（默认为响应模型）中的字段，返回值总是包含id
+    """
+    allowed_fields = allowed_fields or full_fields
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in requested if field not in allowed_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知字段: {', '.join(unknown)}")
+        if "id" not in requested:
+            requested.insert(0, "id")
+        return tuple(dict.fromkeys(requested))
+    
+    return summary_fields if view == "summary" else full_fields
+
+def _projected_response(rows, columns: Optional[tuple]):
+    """
+    返回投影后的列表；columns为None时rows已是字典
+
+    投影结果无法套用固定的response_model，相关接口声明response_model=None：启用快速路径时直接渲染，
+    否则返回字典列表交给FastAPI编码
+    """
+    if columns is not None:
+        rows = [row_to_dict(row, columns) for row in rows]
+    if not settings.API_FAST_JSON:
+        return rows
+    return FastJSONResponse(rows)
+
+async def _replay_lines(replay: dict, speed: float):
+    """逐行输出回放数据；speed大于0时按原始时间间隔的1/speed等待（单次不超过 REPLAY_MAX_DELAY 秒）"""
+    yield ndjson_line({"kind": "initial", "session_id": replay["session_id"], **replay["initial"]})
+    previous = replay["initial"]["timestamp"]
+    for event in replay["events"]:
+        if speed > 0 and previous and event["timestamp"]:
+            delay = min((event["timestamp"] - previous).total_seconds() / speed, settings.REPLAY_MAX_DELAY)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        previous = event["timestamp"] or previous
+        yield ndjson_line({"kind": "event", **event})
+    yield ndjson_line({"kind": "end", **replay["final"]})
 
 # 请求模型
 class CreateSessionRequest(BaseModel):
@@ -29,44 +124,118 @@ class CreateSessionRequest(BaseModel):
 class AddUserInputRequest(BaseModel):
     session_id: str
     user_input: str
+    event_id: Optional[str] = Field(None, max_length=128, description="客户端生成的事件ID，重试时使用相同的值")
 
 class AddSystemMarkerRequest(BaseModel):
     session_id: str
     reason: str
+    event_id: Optional[str] = Field(None, max_length=128, description="客户端生成的事件ID，重试时使用相同的值")
 
 class AddLLMOutputRequest(BaseModel):
     session_id: str
     llm_output: str
+    event_id: Optional[str] = Field(None, max_length=128, description="客户端生成的事件ID，重试时使用相同的值")
+
+class AddObservationRequest(BaseModel):
+    session_id: str
+    observation: str
+    tool_name: Optional[str] = None
+    tool_call_id: Optional[int] = None
+    event_id: Optional[str] = Field(None, max_length=128, description="客户端生成的事件ID，重试时使用相同的值")
+
+class BatchEvent(BaseModel):
+    type: Literal["user_input", "system_marker", "llm_output", "observation"]
+    session_id: str
+    content: str = Field(..., description="用户输入、系统标记原因、LLM输出或Observation内容")
+    event_id: Optional[str] = Field(None, max_length=128, description="客户端生成的事件ID，重试时使用相同的值")
+    tool_name: Optional[str] = None
+    tool_call_id: Optional[int] = None
+
+class BatchEventsRequest(BaseModel):
+    events: List[BatchEvent] = Field(..., max_length=settings.BATCH_MAX_EVENTS)
+
+def apply_event(event: BatchEvent, db: Session) -> dict:
+    """按事件类型追加到会话"""
+    if event.type == "user_input":
+        return prompt_tracker.add_user_input(event.session_id, event.content, db, event_id=event.event_id)
+    if event.type == "system_marker":
+        return prompt_tracker.add_system_marker(event.session_id, event.content, db, event_id=event.event_id)
+    if event.type == "llm_output":
+        return prompt_tracker.add_llm_output(event.session_id, event.content, db, event_id=event.event_id)
+    return prompt_tracker.add_observation(
+        event.session_id, event.content, db,
+        tool_name=event.tool_name, tool_call_id=event.tool_call_id, event_id=event.event_id
+    )
 
 @router.post("/sessions")
-async def create_session(
-    request: CreateSessionRequest,
-    db: Session = Depends(get_db)
+def create_session(
+    request: CreateSessionRequest
 ):
     """
     创建新会话并初始化提示词
     """
     try:
-        result = prompt_tracker.create_session(
-            session_id=request.session_id,
-            initial_prompt=request.initial_prompt,
-            db=db
-        )
+        # 会话ID在请求体中，按其所属分片打开数据库会话
+        shard_router.note_write(request.session_id)
+        with shard_router.session_scope(request.session_id) as db:
+            result = prompt_tracker.create_session(
+                session_id=request.session_id,
+                initial_prompt=request.initial_prompt,
+                db=db
+            )
         
         if not result["success"]:
-            raise HTTPException(status_code=400, detail=result["error"])
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"创建会话失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/sessions/{session_id}/fork")
+def fork_session(
+    session_id: str,
+    at_prompt_id: Optional[int] = Query(None, description="分叉点的提示词ID，默认为最新版本"),
+    new_session_id: Optional[str] = Query(None, max_length=64, description="子会话ID，默认自动生成"),
+    db: Session = Depends(get_session_db)
+):
+    """
+    从会话的任意提示词版本分叉出子会话（共享分叉点之前的历史，不复制提示词内容）
+    """
+    try:
+        # 子会话共享父会话的记录，必须与父会话位于同一分片
+        if new_session_id is None:
+            new_session_id = shard_router.colocated_session_id(session_id)
+        elif shard_router.shard_index(new_session_id) != shard_router.shard_index(session_id):
+            raise HTTPException(status_code=400, detail=f"会话 {new_session_id} 与父会话不在同一分片，请更换子会话ID或不指定")
+        
+        shard_router.note_write(new_session_id)
+        result = prompt_tracker.fork_session(
+            session_id=session_id,
+            db=db,
+            at_prompt_id=at_prompt_id,
+            new_session_id=new_session_id
+        )
+        
+        if not result["success"]:
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"分叉会话失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/sessions/{session_id}/user-input")
-async def add_user_input(
+def add_user_input(
     session_id: str,
     request: AddUserInputRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session_db)
 ):
     """
     添加用户输入到提示词
@@ -78,23 +247,26 @@ async def add_user_input(
         result = prompt_tracker.add_user_input(
             session_id=session_id,
             user_input=request.user_input,
-            db=db
+            db=db,
+            event_id=request.event_id
         )
         
         if not result["success"]:
-            raise HTTPException(status_code=400, detail=result["error"])
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"添加用户输入失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/sessions/{session_id}/system-marker")
-async def add_system_marker(
+def add_system_marker(
     session_id: str,
     request: AddSystemMarkerRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session_db)
 ):
     """
     添加系统标记到提示词
@@ -106,23 +278,27 @@ async def add_system_marker(
         result = prompt_tracker.add_system_marker(
             session_id=session_id,
             reason=request.reason,
-            db=db
+            db=db,
+            event_id=request.event_id
         )
         
         if not result["success"]:
-            raise HTTPException(status_code=400, detail=result["error"])
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"添加系统标记失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/sessions/{session_id}/llm-output")
-async def add_llm_output(
+def add_llm_output(
     session_id: str,
     request: AddLLMOutputRequest,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_session_db)
 ):
     """
     添加LLM输出到提示词
@@ -134,28 +310,229 @@ async def add_llm_output(
         result = prompt_tracker.add_llm_output(
             session_id=session_id,
             llm_output=request.llm_output,
-            db=db
+            db=db,
+            event_id=request.event_id
         )
         
         if not result["success"]:
-            raise HTTPException(status_code=400, detail=result["error"])
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
+        
+        # 会话自动完成后在后台压缩提示词链
+        if result.get("session_completed"):
+            background_tasks.add_task(session_lifecycle.compact_in_background, session_id)
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"添加LLM输出失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/sessions/{session_id}/observation")
+def add_observation(
+    session_id: str,
+    request: AddObservationRequest,
+    db: Session = Depends(get_session_db)
+):
+    """
+    添加工具执行结果（Observation）到提示词，并关联到对应的工具调用
+    """
+    try:
+        if request.session_id != session_id:
+            raise HTTPException(status_code=400, detail="URL中的session_id与请求体中的不一致")
+        
+        result = prompt_tracker.add_observation(
+            session_id=session_id,
+            observation=request.observation,
+            db=db,
+            tool_name=request.tool_name,
+            tool_call_id=request.tool_call_id,
+            event_id=request.event_id
+        )
+        
+        if not result["success"]:
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"添加Observation失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/events/batch")
+def add_events_batch(
+    request: BatchEventsRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    批量追加事件（可跨会话），同一会话的事件按请求中的顺序追加
+
+    每个事件单独提交，返回与请求顺序一致的逐条结果；失败的事件不影响其他事件
+    """
+    try:
+        # 按会话分组，每个会话在所属分片上打开一次数据库会话
+        by_session = {}
+        for index, event in enumerate(request.events):
+            by_session.setdefault(event.session_id, []).append((index, event))
+        
+        results = [None] * len(request.events)
+        for session_id, events in by_session.items():
+            shard_router.note_write(session_id)
+            with shard_router.session_scope(session_id) as db:
+                for index, event in events:
+                    results[index] = apply_event(event, db)
+            shard_router.note_write(session_id)
+            
+            # 会话自动完成后在后台压缩提示词链
+            if any(results[index].get("session_completed") for index, _ in events):
+                background_tasks.add_task(session_lifecycle.compact_in_background, session_id)
+        
+        return {
+            "success": all(result["success"] for result in results),
+            "accepted": sum(1 for result in results if result["success"]),
+            "results": results
+        }
+        
+    except Exception as e:
+        logger.error(f"批量追加事件失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/sessions/{session_id}/events")
+async def add_event(
+    session_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_session_db)
+):
+    """
+    追加单个事件，请求体为msgpack（Content-Type: application/msgpack）或JSON，
+    字段同批量接口的事件，session_id只需在URL中给出
+    """
+    try:
+        try:
+            data = decode_body(await request.body(), request.headers.get("content-type"))
+            event = BatchEvent.model_construct(**parse_event(data, session_id))
+        except IngestFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # 读取请求体需要异步处理，数据库操作放到线程池中执行，不阻塞事件循环
+        result = await run_in_threadpool(apply_event, event, db)
+        
+        if not result["success"]:
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
+        
+        if result.get("session_completed"):
+            background_tasks.add_task(session_lifecycle.compact_in_background, session_id)
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"追加事件失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/events/stream")
+async def add_events_stream(
+    request: Request,
+    background_tasks: BackgroundTasks
+):
+    """
+    以帧流追加事件：请求体为连续的帧，每帧为4字节大端长度 + 一个msgpack编码的事件（可跨会话），
+    边接收边按顺序追加，返回与帧顺序一致的逐条结果
+    """
+    if not is_msgpack(request.headers.get("content-type")):
+        raise HTTPException(status_code=415, detail="帧流的Content-Type必须是application/msgpack")
+    
+    results = []
+    touched = set()
+    completed = set()
+    # 每个分片打开一个数据库会话，流中所有事件复用
+    shard_dbs = {}
+    try:
+        async for data in iter_frames(request.stream()):
+            if len(results) >= settings.INGEST_STREAM_MAX_EVENTS:
+                raise IngestFormatError(f"单次请求的事件数超过上限 {settings.INGEST_STREAM_MAX_EVENTS}")
+            try:
+                event = BatchEvent.model_construct(**parse_event(data))
+            except IngestFormatError as e:
+                results.append({"success": False, "error": str(e)})
+                continue
+            
+            shard = shard_router.shard_index(event.session_id)
+            if shard not in shard_dbs:
+                shard_dbs[shard] = shard_router.get_session(event.session_id)
+            shard_router.note_write(event.session_id)
+            touched.add(event.session_id)
+            
+            result = await run_in_threadpool(apply_event, event, shard_dbs[shard])
+            if result.get("session_completed"):
+                completed.add(event.session_id)
+            results.append(result)
+        
+        return {
+            "success": all(result["success"] for result in results),
+            "accepted": sum(1 for result in results if result["success"]),
+            "results": results
+        }
+        
+    except IngestFormatError as e:
+        # 之前的事件已提交，客户端可用相同的event_id重发整个流
+        raise HTTPException(status_code=400, detail=f"{e}（已处理 {len(results)} 个事件）")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"帧流追加事件失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        for db in shard_dbs.values():
+            await run_in_threadpool(db.close)
+        for session_id in touched:
+            shard_router.note_write(session_id)
+        # 会话自动完成后在后台压缩提示词链
+        for session_id in completed:
+            background_tasks.add_task(session_lifecycle.compact_in_background, session_id)
+
+@router.post("/sessions/{session_id}/complete")
+def complete_session(
+    session_id: str,
+    background_tasks: BackgroundTasks,
+    status: SessionStatus = Query(SessionStatus.completed, description="结束状态：completed或error"),
+    db: Session = Depends(get_session_db)
+):
+    """
+    结束会话，并在后台压缩提示词链
+    """
+    try:
+        result = prompt_tracker.complete_session(session_id, db, status)
+        
+        if not result["success"]:
+            raise HTTPException(status_code=404 if result.get("not_found") else 400, detail=result["error"])
+        
+        background_tasks.add_task(session_lifecycle.compact_in_background, session_id)
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"结束会话失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/sessions/{session_id}/current-prompt")
-async def get_current_prompt(
+def get_current_prompt(
     session_id: str,
-    db: Session = Depends(get_db)
+    expand_blobs: bool = Query(True, description="是否展开大内容引用<BlobRef>"),
+    db: Session = Depends(get_session_read_db)
 ):
     """
     获取会话的当前完整提示词
     """
     try:
-        current_prompt = prompt_tracker.get_current_prompt(session_id, db)
+        current_prompt = prompt_tracker.get_current_prompt(session_id, db, expand_blobs)
         
         if current_prompt is None:
             raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
@@ -166,38 +543,175 @@ async def get_current_prompt(
             "prompt_length": len(current_prompt)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取当前提示词失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/sessions", response_model=List[SessionResponse])
-async def get_sessions(
-    skip: int = Query(0, ge=0, description="跳过的记录数"),
-    limit: int = Query(100, ge=1, le=1000, description="返回的记录数"),
-    status: Optional[str] = Query(None, description="会话状态过滤"),
-    db: Session = Depends(get_db)
+@router.get("/sessions/{session_id}/summary")
+def get_session_summary(
+    session_id: str,
+    db: Session = Depends(get_session_read_db)
 ):
     """
-    获取会话列表
+    获取会话摘要（事件数、当前长度、token数、工具调用数、最后活动时间）
     """
     try:
-        query = db.query(SessionModel)
+        summary = prompt_tracker.get_session_summary(session_id, db)
         
-        if status:
-            query = query.filter(SessionModel.status == status)
+        if summary is None:
+            raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
         
-        sessions = query.order_by(desc(SessionModel.updated_at)).offset(skip).limit(limit).all()
+        return FastJSONResponse(summary)
         
-        return sessions
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取会话摘要失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sessions/{session_id}/tokens")
+def get_token_usage(
+    session_id: str,
+    db: Session = Depends(get_session_read_db)
+):
+    """
+    获取会话的token曲线和上下文预算使用情况
+    """
+    try:
+        usage = prompt_tracker.get_token_usage(session_id, db)
         
+        if usage is None:
+            raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
+        
+        return FastJSONResponse(usage)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取token曲线失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sessions/{session_id}/replay")
+def replay_session(
+    session_id: str,
+    start: Optional[datetime] = Query(None, alias="from", description="起始时间（UTC），起始提示词为此前最后一条记录的内容"),
+    end: Optional[datetime] = Query(None, alias="to", description="结束时间（UTC），不输出此后的事件"),
+    speed: float = Query(0, ge=0, le=1000, description="按原始节奏回放的倍速，0表示立即输出全部事件"),
+    parse: bool = Query(False, description="是否附带按状态标签解析的片段结构"),
+    expand_blobs: bool = Query(True, description="是否展开大内容引用<BlobRef>"),
+    db: Session = Depends(get_session_read_db)
+):
+    """
+    以NDJSON流回放会话：第一行为起始提示词，之后每行为一次追加的片段（类型、时间），最后一行为汇总；
+    传输量与最终提示词长度成正比，而不是每个版本的完整提示词
+    """
+    try:
+        # 带时区的时间转换为UTC（数据库中按UTC存储）
+        start, end = (
+            moment.astimezone(timezone.utc).replace(tzinfo=None) if moment and moment.tzinfo else moment
+            for moment in (start, end)
+        )
+        replay = prompt_tracker.get_replay(session_id, db, start, end, expand_blobs, parse)
+        
+        if replay is None:
+            raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
+        
+        return StreamingResponse(_replay_lines(replay, speed), media_type=NDJSON_MEDIA_TYPE)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"回放会话失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sessions/{session_id}/verify")
+def verify_prompt_chain(
+    session_id: str,
+    db: Session = Depends(get_session_read_db)
+):
+    """
+    校验会话提示词链的完整性（长度、前缀和链式哈希），返回第一处断链
+    """
+    try:
+        result = prompt_tracker.verify_chain(session_id, db)
+        
+        if result is None:
+            raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
+        
+        return FastJSONResponse(result)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"校验提示词链失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(
+    "/sessions",
+    response_model=None,
+    responses={200: {
+        "model": List[Union[SessionResponse, SessionSummaryResponse]],
+        "description": "view=full返回SessionResponse，view=summary返回SessionSummaryResponse，fields=时只含所选字段和id"
+    }}
+)
+def get_sessions(
+    skip: int = Query(0, ge=0, description="跳过的记录数"),
+    limit: int = Query(100, ge=1, le=1000, description="返回的记录数"),
+    status: Optional[str] = Query(None, description="会话状态过滤"),
+    view: str = Query("full", pattern="^(full|summary)$", description="full返回全部字段，summary不返回初始提示词并附带会话摘要"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，优先于view"),
+):
+    """
+    获取会话列表
+    """
+    try:
+        columns = _resolve_fields(
+            fields, view, SESSION_FIELDS, SESSION_SUMMARY_FIELDS, tuple(SESSION_COLUMNS)
+        )
+        # 排序需要updated_at，合并后再去掉未请求的列
+        query_columns = columns if "updated_at" in columns else columns + ("updated_at",)
+        
+        def list_shard(db: Session):
+            if columns == SESSION_FIELDS:
+                query = db.query(SessionModel)
+            else:
+                # 只查询需要的列，避免从数据库读取初始提示词全文；摘要列来自会话摘要表
+                query = db.query(*[SESSION_COLUMNS[column].label(column) for column in query_columns])
+                if any(column not in SESSION_FIELDS for column in query_columns):
+                    query = query.select_from(SessionModel).outerjoin(
+                        SessionSummaryModel, SessionSummaryModel.session_id == SessionModel.session_id
+                    )
+            
+            if status:
+                query = query.filter(SessionModel.status == status)
+            
+            # 每个分片取前 skip+limit 条，合并排序后再分页
+            rows = query.order_by(desc(SessionModel.updated_at)).limit(skip + limit).all()
+            return [row_to_dict(row, query_columns) for row in rows]
+        
+        shard_rows = shard_router.scatter(list_shard, read=True)
+        if len(shard_rows) == 1:
+            sessions = shard_rows[0][skip:]
+        else:
+            sessions = heapq.merge(*shard_rows, key=lambda row: row["updated_at"], reverse=True)
+            sessions = list(sessions)[skip:skip + limit]
+        
+        if query_columns != columns:
+            sessions = [{column: row[column] for column in columns} for row in sessions]
+        return _projected_response(sessions, None)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取会话列表失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sessions/{session_id}", response_model=SessionResponse)
-async def get_session(
+def get_session(
     session_id: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session_read_db)
 ):
     """
     获取会话详情
@@ -208,83 +722,262 @@ async def get_session(
         if not session:
             raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
         
-        return session
+        return serialize_row(session, SESSION_FIELDS)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取会话详情失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/sessions/{session_id}/prompts", response_model=List[PromptResponse])
-async def get_prompts(
+@router.get(
+    "/sessions/{session_id}/prompts",
+    response_model=None,
+    responses={200: {
+        "model": List[Union[PromptResponse, PromptSummaryResponse]],
+        "description": "view=full返回PromptResponse，view=summary返回PromptSummaryResponse，fields=时只含所选字段和id"
+    }}
+)
+def get_prompts(
     session_id: str,
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(100, ge=1, le=1000, description="返回的记录数"),
     prompt_type: Optional[str] = Query(None, description="提示词类型过滤"),
-    db: Session = Depends(get_db)
+    view: str = Query("full", pattern="^(full|summary)$", description="full返回完整提示词，summary只返回长度等元数据"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，优先于view"),
+    expand_blobs: bool = Query(True, description="是否展开大内容引用<BlobRef>"),
+    db: Session = Depends(get_session_read_db)
 ):
     """
     获取会话的提示词历史
     """
     try:
-        query = db.query(PromptModel).filter(PromptModel.session_id == session_id)
+        columns = _resolve_fields(fields, view, PROMPT_FIELDS, PROMPT_SUMMARY_FIELDS)
+        
+        if columns == PROMPT_FIELDS:
+            query = db.query(PromptModel)
+        else:
+            # 只查询需要的列，summary视图可完全由索引覆盖；选择prompt时附带还原增量记录所需的列
+            query_columns = columns
+            if "prompt" in columns:
+                query_columns += tuple(
+                    column for column in PROMPT_RENDER_COLUMNS if column not in columns
+                )
+            query = db.query(*[getattr(PromptModel, column) for column in query_columns])
+        
+        # 分叉会话包含父会话中分叉点之前的历史
+        query = query.filter(prompt_tracker.chain.history_filter(session_id, db))
         
         if prompt_type:
             query = query.filter(PromptModel.type == prompt_type)
         
         prompts = query.order_by(PromptModel.id).offset(skip).limit(limit).all()
         
-        return prompts
-        
+        if columns == PROMPT_FIELDS:
+            if not any(
+                prompt.is_delta or (expand_blobs and "<BlobRef>" in prompt.prompt) for prompt in prompts
+            ):
+                return _projected_response(prompts, PROMPT_FIELDS)
+            # 压缩后的记录只存储增量片段、大内容只存储引用，还原完整提示词后返回
+            texts = prompt_tracker.render_prompts(prompts, db, expand_blobs)
+            return _projected_response(
+                [dict(row_to_dict(prompt, PROMPT_FIELDS), prompt=text) for prompt, text in zip(prompts, texts)],
+                None
+            )
+        if "prompt" in columns:
+            # 与完整视图一致，返回还原后的提示词而不是存储的增量片段或大内容引用
+            texts = prompt_tracker.render_prompts(prompts, db, expand_blobs)
+            return _projected_response(
+                [dict(row_to_dict(prompt, columns), prompt=text) for prompt, text in zip(prompts, texts)],
+                None
+            )
+        return _projected_response(prompts, columns)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取提示词历史失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sessions/{session_id}/tool-calls", response_model=List[ToolCallResponse])
-async def get_tool_calls(
+def get_tool_calls(
     session_id: str,
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(100, ge=1, le=1000, description="返回的记录数"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session_read_db)
 ):
     """
     获取会话的工具调用记录
     """
     try:
         tool_calls = db.query(ToolCallModel).filter(
-            ToolCallModel.session_id == session_id
+            prompt_tracker.chain.history_filter(session_id, db, ToolCallModel, ToolCallModel.prompt_id)
         ).order_by(desc(ToolCallModel.id)).offset(skip).limit(limit).all()
         
-        return tool_calls
+        return serialize_rows(tool_calls, TOOL_CALL_FIELDS)
         
     except Exception as e:
         logger.error(f"获取工具调用记录失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/blobs/{digest}")
+def get_blob(
+    digest: str
+):
+    """
+    按SHA-256读取大内容存储中的内容（内容存储在写入它的会话所属分片中）
+    """
+    try:
+        content = next(
+            (found for found in shard_router.scatter(lambda db: prompt_tracker.get_blob(digest, db), read=True) if found is not None),
+            None
+        )
+        
+        if content is None:
+            raise HTTPException(status_code=404, detail=f"内容 {digest} 不存在")
+        
+        return {
+            "digest": digest,
+            "content": content,
+            "size": len(content)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"读取内容失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/search", response_model=List[SearchResultResponse])
+def search_prompts(
+    q: str = Query(..., min_length=1, description="检索词，多个词项之间为AND关系"),
+    type: Optional[str] = Query(None, description="状态标签过滤，如Thought、ActionInput、Observation"),
+    tool: Optional[str] = Query(None, description="工具名称过滤，如quark_search"),
+    session_id: Optional[str] = Query(None, description="会话ID过滤"),
+    limit: int = Query(50, ge=1, le=500, description="返回的记录数"),
+):
+    """
+    全文检索提示词内容和工具调用参数
+    """
+    try:
+        def search_shard(db: Session):
+            return prompt_tracker.search_index.search(
+                q, db, tag=type, tool_name=tool, session_id=session_id, limit=limit
+            )
+        
+        if session_id:
+            with shard_router.session_scope(session_id, read=True) as db:
+                return FastJSONResponse(search_shard(db))
+        
+        shard_results = shard_router.scatter(search_shard, read=True)
+        if len(shard_results) == 1:
+            return FastJSONResponse(shard_results[0])
+        # 各分片的提示词ID相互独立，按时间合并
+        results = heapq.merge(
+            *shard_results, key=lambda result: result["timestamp"] or datetime.min, reverse=True
+        )
+        return FastJSONResponse(list(results)[:limit])
+        
+    except Exception as e:
+        logger.error(f"全文检索失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analytics/tool-calls")
+def get_tool_call_analytics(
+    start: Optional[datetime] = Query(None, alias="from", description="起始时间（UTC），默认24小时前"),
+    end: Optional[datetime] = Query(None, alias="to", description="结束时间（UTC），默认当前时间"),
+    tool: Optional[str] = Query(None, description="工具名称过滤"),
+):
+    """
+    获取工具调用汇总统计（按小时的调用量、参数解析失败率）；
+    未指定from、to和tool时附带每会话调用次数分布（覆盖全部历史和全部工具）
+    """
+    try:
+        analytics = prompt_tracker.tool_analytics
+        with_distribution = start is None and end is None and tool is None
+        start, end = analytics.time_range(start, end)
+        parts = shard_router.scatter(
+            lambda db: analytics.collect(db, start, end, tool, with_distribution), read=True
+        )
+        return FastJSONResponse(analytics.summarize(start, end, parts))
+        
+    except Exception as e:
+        logger.error(f"获取工具调用统计失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stats/timeseries")
+def get_event_timeseries(
+    start: Optional[datetime] = Query(None, alias="from", description="起始时间（UTC），默认为结束时间之前60个步长"),
+    end: Optional[datetime] = Query(None, alias="to", description="结束时间（UTC），默认当前时间"),
+    step: str = Query("1m", description="步长：秒数或带单位（m/h/d），如 1m、5m、1h、1d"),
+):
+    """
+    获取事件速率时间序列（每个点的各类型事件数、活跃会话数、追加字节数）
+
+    步长小于1小时时读取分钟汇总（仅保留最近 ROLLUP_MINUTE_RETENTION_HOURS 小时），否则读取小时汇总
+    """
+    try:
+        rollups = prompt_tracker.event_rollups
+        try:
+            step_seconds = parse_step(step)
+            start, end = rollups.time_range(start, end, step_seconds)
+        except TimeseriesError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        parts = shard_router.scatter(lambda db: rollups.collect(db, start, end, step_seconds), read=True)
+        return FastJSONResponse(rollups.summarize(start, end, step_seconds, parts))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取事件速率时间序列失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/retention/run")
+async def run_retention(background_tasks: BackgroundTasks):
+    """
+    立即在后台执行一次过期会话清理（RETENTION_DAYS为0时不清理）
+    """
+    background_tasks.add_task(retention_manager.purge)
+    return retention_manager.progress()
+
+@router.get("/retention/status")
+async def get_retention_status():
+    """
+    获取当前或最近一次过期会话清理的进度
+    """
+    return FastJSONResponse(retention_manager.progress())
+
 @router.get("/stats")
-async def get_statistics(db: Session = Depends(get_db)):
+def get_statistics():
     """
-    获取系统统计信息
+    获取系统统计信息（各分片并行统计后汇总）
     """
     try:
-        # 会话统计
-        total_sessions = db.query(func.count(SessionModel.id)).scalar()
-        active_sessions = db.query(func.count(SessionModel.id)).filter(
-            SessionModel.status == "active"
-        ).scalar()
-        
-        # 提示词统计
-        total_prompts = db.query(func.count(PromptModel.id)).scalar()
-        
-        # 按类型统计
-        prompt_type_stats = {}
-        for prompt_type in PromptType:
-            count = db.query(func.count(PromptModel.id)).filter(
-                PromptModel.type == prompt_type
+        def count_shard(db: Session):
+            # 会话统计
+            total_sessions = db.query(func.count(SessionModel.id)).scalar()
+            active_sessions = db.query(func.count(SessionModel.id)).filter(
+                SessionModel.status == "active"
             ).scalar()
-            prompt_type_stats[prompt_type.value] = count
-        
-        # 工具调用统计
-        total_tool_calls = db.query(func.count(ToolCallModel.id)).scalar()
+            
+            # 提示词统计（按类型）
+            prompt_type_stats = {prompt_type.value: 0 for prompt_type in PromptType}
+            for prompt_type, count in db.query(PromptModel.type, func.count(PromptModel.id)).group_by(PromptModel.type):
+                prompt_type_stats[PromptType(prompt_type).value] = count
+            
+            # 工具调用统计
+            total_tool_calls = db.query(func.count(ToolCallModel.id)).scalar()
+            
+            return total_sessions, active_sessions, prompt_type_stats, total_tool_calls
+        
+        shard_stats = shard_router.scatter(count_shard, read=True)
+        total_sessions = sum(stats[0] for stats in shard_stats)
+        active_sessions = sum(stats[1] for stats in shard_stats)
+        prompt_type_stats = {
+            prompt_type.value: sum(stats[2][prompt_type.value] for stats in shard_stats)
+            for prompt_type in PromptType
+        }
+        total_tool_calls = sum(stats[3] for stats in shard_stats)
         
         return {
             "sessions": {
@@ -293,12 +986,16 @@ async def get_statistics(db: Session = Depends(get_db)):
                 "completed": total_sessions - active_sessions
             },
             "prompts": {
-                "total": total_prompts,
+                "total": sum(prompt_type_stats.values()),
                 "by_type": prompt_type_stats
             },
             "tool_calls": {
                 "total": total_tool_calls
-            }
+            },
+            "prompt_cache": prompt_tracker.prompt_cache.stats(),
+            "admission": admission_controller.stats(),
+            "worker": invalidation_bus.stats(),
+            "shards": len(shard_stats)
         }
         
     except Exception as e:
@@ -0,0 +1,192 @@
+"""
+API响应序列化与压缩
+
+- FastJSONResponse: 优先使用orjson序列化，未安装时回退到标准库json
+- ndjson_line: 流式响应中的一行JSON（application/x-ndjson）
+- serialize_rows / serialize_row: 直接从已知合法的ORM行构建字典，跳过response_model的二次校验
+- CompressionMiddleware: 按Accept-Encoding对大响应体进行br/gzip压缩（gzip使用Starlette的GZipMiddleware）
+"""
+import json
+import enum
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterable, Sequence
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+
+from config.settings import settings
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+
+def _default(obj: Any) -> Any:
+    """序列化orjson/json无法直接处理的类型"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """将内容序列化为JSON字节串"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        default=_default,
+    ).encode("utf-8")
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def ndjson_line(content: Any) -> bytes:
+    """将内容序列化为一行NDJSON"""
+    return dumps(content) + b"\n"
+
+
+class FastJSONResponse(JSONResponse):
+    """使用orjson（可选）渲染的JSON响应"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def row_to_dict(row: Any, fields: Sequence[str]) -> dict:
+    """按字段列表从ORM对象或Row中取值"""
+    return {field: getattr(row, field) for field in fields}
+
+
+def serialize_rows(rows: Iterable[Any], fields: Sequence[str]):
+    """
+    序列化ORM行列表
+
+    启用快速路径时直接构建响应，跳过response_model校验；否则原样返回交给FastAPI处理
+    """
+    if not settings.API_FAST_JSON:
+        return rows
+    return FastJSONResponse([row_to_dict(row, fields) for row in rows])
+
+
+def serialize_row(row: Any, fields: Sequence[str]):
+    """序列化单个ORM行"""
+    if not settings.API_FAST_JSON:
+        return row
+    return FastJSONResponse(row_to_dict(row, fields))
+
+
+# 逐行流式输出的接口（按节奏回放时压缩缓冲会延迟输出），不压缩
+UNCOMPRESSED_SUFFIXES = ("/replay",)
+
+
+def _parse_accept_encoding(header: str) -> set:
+    """解析Accept-Encoding，返回q值大于0的编码集合"""
+    encodings = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            encodings.add(token)
+    return encodings
+
+
+class CompressionMiddleware:
+    """
+    响应压缩中间件
+
+    gzip交给Starlette的GZipMiddleware；客户端接受br且安装了brotli时，一次性发送完毕的大响应体改用br压缩。
+    可压缩的接口总是带 Vary: Accept-Encoding（包括未压缩的小响应），避免缓存把压缩版本返回给不支持的客户端。
+    UNCOMPRESSED_SUFFIXES 中的流式接口原样透传
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=gzip_level)
+        self.minimum_size = minimum_size
+        self.brotli_quality = brotli_quality
+
+    def _accepts_brotli(self, scope) -> bool:
+        if brotli is None:
+            return False
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                return "br" in _parse_accept_encoding(value.decode("latin-1"))
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].endswith(UNCOMPRESSED_SUFFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_vary(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("Accept-Encoding")
+            await send(message)
+
+        if self._accepts_brotli(scope):
+            await self._brotli(scope, receive, send_with_vary)
+        else:
+            await self.gzip(scope, receive, send_with_vary)
+
+    async def _brotli(self, scope, receive, send):
+        """br压缩一次性发送完毕的响应体，流式响应和小响应原样发送"""
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            pending_start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = list(pending_start.get("headers", []))
+            already_encoded = any(name == b"content-encoding" for name, _ in headers)
+
+            if message.get("more_body", False) or already_encoded or len(body) < self.minimum_size:
+                await send(pending_start)
+                await send(message)
+                return
+
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+            headers = [(name, value) for name, value in headers if name != b"content-length"]
+            headers.append((b"content-encoding", b"br"))
+            headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+            pending_start = dict(pending_start, headers=headers)
+
+            await send(pending_start)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
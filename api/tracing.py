@@ -0,0 +1,57 @@
+"""
+链路追踪中间件
+
+为每个采样的请求创建服务端span（名称为 "方法 路由模板"），沿用请求头 traceparent 中的链路，
+并在响应头 traceresponse 中返回本服务的span，便于Agent端将自身耗时与服务端耗时关联。
+"""
+from core.tracing import tracer
+
+
+class TracingMiddleware:
+    """根据traceparent开始链路，处理函数、PromptTracker和SQL的span都挂在该span下"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope.get("headers", []):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        span = tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent, attributes={
+            "http.request.method": scope["method"],
+            "url.path": scope["path"],
+        })
+        if span is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                span.set_attribute("http.response.status_code", status)
+                if status >= 500:
+                    span.set_error(f"HTTP {status}")
+                headers = list(message.get("headers", []))
+                headers.append((b"traceresponse", span.traceparent.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        with tracer.activate(span):
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # 路由匹配后用路由模板命名，避免span名称包含会话ID
+                route = scope.get("route")
+                if route is not None and hasattr(route, "path"):
+                    span.name = f"{scope['method']} {route.path}"
+                    span.set_attribute("http.route", route.path)
+                endpoint = scope.get("endpoint")
+                if endpoint is not None:
+                    span.set_attribute("code.function", getattr(endpoint, "__name__", str(endpoint)))
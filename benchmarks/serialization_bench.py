@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+响应序列化基准测试
+
+对比各列表接口在两种路径下的序列化开销（无需数据库）:
+- 默认路径: response_model校验 + jsonable编码 + 标准库json
+- 快速路径: 直接从ORM行构建字典 + FastJSONResponse（orjson可选）
+
+用法: python benchmarks/serialization_bench.py [--rows 200] [--prompt-kb 8] [--repeat 20]
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import List
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import TypeAdapter
+
+from api.responses import FastJSONResponse, row_to_dict, orjson, brotli
+from models.prompt_models import (
+    SessionModel, PromptModel, ToolCallModel,
+    SessionResponse, PromptResponse, ToolCallResponse,
+    SessionStatus, PromptType
+)
+
+
+def build_rows(rows: int, prompt_kb: int):
+    """构造各接口的模拟ORM行"""
+    now = datetime.utcnow()
+    text = ("提示词内容 prompt text " * 64)[:1024] * prompt_kb
+    sessions = [
+        SessionModel(
+            id=i, session_id=f"bench_{i}", initial_prompt=text,
+            created_at=now, updated_at=now, status=SessionStatus.active
+        )
+        for i in range(rows)
+    ]
+    prompts = [
+        PromptModel(
+            id=i, session_id="bench_0", type=PromptType.llm_output,
+            prompt=text + f"\n<Thought>{i}</Thought>", prompt_length=len(text) + 20,
+            total_tokens=len(text) // 2, timestamp=now
+        )
+        for i in range(rows)
+    ]
+    tool_calls = [
+        ToolCallModel(
+            id=i, session_id="bench_0", prompt_id=i, tool_name="quark_search",
+            arguments={"search_query": f"查询 {i}"}, description="夸克搜索"
+        )
+        for i in range(rows)
+    ]
+    return {
+        "GET /sessions": (sessions, SessionResponse),
+        "GET /sessions/{id}/prompts": (prompts, PromptResponse),
+        "GET /sessions/{id}/tool-calls": (tool_calls, ToolCallResponse),
+    }
+
+
+def default_path(rows, response_model, adapter) -> bytes:
+    """模拟FastAPI默认的response_model校验与JSON编码"""
+    validated = adapter.validate_python(rows, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(rows, fields) -> bytes:
+    """快速路径：直接构建字典并渲染"""
+    return FastJSONResponse([row_to_dict(row, fields) for row in rows]).body
+
+
+def timeit(func, repeat: int) -> float:
+    """返回单次调用的最小耗时（毫秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应序列化基准测试")
+    parser.add_argument("--rows", type=int, default=200, help="每个接口返回的行数")
+    parser.add_argument("--prompt-kb", type=int, default=8, help="每行提示词文本大小(KB)")
+    parser.add_argument("--repeat", type=int, default=20, help="重复次数（取最小值）")
+    args = parser.parse_args()
+
+    print(f"orjson: {'已安装' if orjson else '未安装（回退到json）'}, brotli: {'已安装' if brotli else '未安装'}")
+    print(f"行数: {args.rows}, 单行文本: {args.prompt_kb}KB, 重复: {args.repeat}")
+    print()
+    header = f"{'接口':<30}{'默认(ms)':>12}{'快速(ms)':>12}{'加速比':>10}{'原始大小':>12}{'gzip大小':>12}{'gzip(ms)':>10}"
+    print(header)
+    print("-" * len(header))
+
+    for endpoint, (rows, response_model) in build_rows(args.rows, args.prompt_kb).items():
+        adapter = TypeAdapter(List[response_model])
+        fields = tuple(response_model.model_fields)
+
+        before = timeit(lambda: default_path(rows, response_model, adapter), args.repeat)
+        after = timeit(lambda: fast_path(rows, fields), args.repeat)
+
+        body = fast_path(rows, fields)
+        compressed = gzip.compress(body, compresslevel=6)
+        gzip_ms = timeit(lambda: gzip.compress(body, compresslevel=6), max(1, args.repeat // 4))
+
+        print(
+            f"{endpoint:<30}{before:>12.2f}{after:>12.2f}{before / after:>9.1f}x"
+            f"{len(body):>12}{len(compressed):>12}{gzip_ms:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+历史Agent日志批量导入（离线执行，直接写数据库，不经过HTTP接口）
+
+用法: python bulk_import.py logs/*.jsonl [--workers 8] [--checkpoint import.checkpoint.json] [--batch-sessions 50]
+
+输入格式见 core/bulk_import.py；中断后使用同一个检查点文件重新运行即可继续
+"""
+import os
+import sys
+import glob
+import logging
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.settings import settings
+from core.bulk_import import run_import
+
+
+def expand_paths(patterns):
+    """展开通配符和目录（目录下的全部 .jsonl 文件），按路径排序去重"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, "**", "*.jsonl"), recursive=True))
+        else:
+            paths.update(glob.glob(pattern) or [pattern])
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入历史Agent日志（JSONL）")
+    parser.add_argument("paths", nargs="+", help="JSONL文件、通配符或目录")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行的工作进程数")
+    parser.add_argument("--checkpoint", default="import.checkpoint.json", help="记录已完成文件的检查点文件")
+    parser.add_argument("--batch-sessions", type=int, default=50, help="每个事务写入的会话数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL), format=settings.LOG_FORMAT)
+
+    paths = expand_paths(args.paths)
+    if not paths:
+        print("没有找到要导入的文件")
+        sys.exit(1)
+
+    print(f"待导入文件: {len(paths)}，工作进程: {args.workers}，检查点: {args.checkpoint}")
+    totals = run_import(paths, args.workers, args.checkpoint, args.batch_sessions)
+
+    print()
+    print(f"导入完成: {totals['sessions']} 个会话、{totals['events']} 条记录，耗时 {totals.get('seconds', 0)} 秒")
+    print(f"跳过: 已完成文件 {totals['skipped_files']} 个，已存在会话 {totals['skipped_sessions']} 个，"
+          f"格式错误的行 {totals['invalid_lines']} 行")
+    if totals["failed_files"]:
+        print(f"有 {totals['failed_files']} 个文件未完整导入，请查看日志后重新运行")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
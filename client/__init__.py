@@ -0,0 +1,12 @@
+# Client SDK for prompt tracking system
+from .base import PromptTrackerError, make_event, new_event_id
+from .sync_client import PromptTrackerClient
+from .async_client import AsyncPromptTrackerClient
+
+__all__ = [
+    "PromptTrackerClient",
+    "AsyncPromptTrackerClient",
+    "PromptTrackerError",
+    "make_event",
+    "new_event_id",
+]
@@ -0,0 +1,264 @@
+"""
+asyncio客户端（需要可选依赖httpx）
+
+接口与同步客户端一致：httpx.AsyncClient 复用keep-alive连接池，
+track() 将事件放入有界缓冲区立即返回，由后台任务合并成批量请求发送
+"""
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List, AsyncIterable, AsyncIterator
+
+try:
+    import httpx
+except ImportError:  # 可选依赖
+    httpx = None
+
+from .base import (
+    API_PREFIX, RETRY_STATUS, MSGPACK_CONTENT_TYPE, PromptTrackerError, EventBuffer,
+    make_event, new_event_id, retry_delay, error_detail, encode_frames, msgpack
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPromptTrackerClient:
+    """提示词追踪服务的asyncio客户端（在同一个事件循环中使用）"""
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        timeout: float = 10.0,
+        pool_size: int = 10,
+        max_retries: int = 3,
+        backoff: float = 0.2,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        max_buffer_events: int = 10000,
+        max_buffer_chars: int = 64 * 1024 * 1024,
+        use_msgpack: bool = True
+    ):
+        if httpx is None:
+            raise ImportError("AsyncPromptTrackerClient 需要安装httpx: pip install -e \".[client]\"")
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # 已安装msgpack时批量事件以帧流发送
+        self.use_msgpack = use_msgpack and msgpack is not None
+
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url + API_PREFIX,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+        self._buffer = EventBuffer(max_buffer_events, max_buffer_chars)
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closed = False
+        self._worker: Optional[asyncio.Task] = None
+        self.failed = 0
+
+    # ---- 请求 ----
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json: Any = None,
+        params: Optional[Dict[str, Any]] = None,
+        retry: bool = True,
+        content: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Any:
+        attempt = 0
+        while True:
+            try:
+                response = await self.http.request(
+                    method, path, json=json, params=params, content=content, headers=headers
+                )
+            except (httpx.TransportError, httpx.TimeoutException):
+                if not retry or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(attempt, self.backoff))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS and retry and attempt < self.max_retries:
+                await asyncio.sleep(retry_delay(attempt, self.backoff, response.headers.get("Retry-After")))
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = response.text
+                raise PromptTrackerError(response.status_code, error_detail(body))
+            return response.json()
+
+    async def create_session(self, session_id: str, initial_prompt: Optional[str] = None) -> Dict[str, Any]:
+        # 创建会话不可重复执行，不自动重试
+        return await self._request(
+            "POST", "/sessions", json={"session_id": session_id, "initial_prompt": initial_prompt}, retry=False
+        )
+
+    async def fork_session(
+        self, session_id: str, at_prompt_id: Optional[int] = None, new_session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        params = {"at_prompt_id": at_prompt_id, "new_session_id": new_session_id}
+        return await self._request(
+            "POST", f"/sessions/{session_id}/fork",
+            params={key: value for key, value in params.items() if value is not None}, retry=False
+        )
+
+    async def _append(
+        self, session_id: str, path: str, body: Dict[str, Any], event_id: Optional[str]
+    ) -> Dict[str, Any]:
+        body = dict(body, session_id=session_id, event_id=event_id or new_event_id())
+        return await self._request("POST", f"/sessions/{session_id}/{path}", json=body)
+
+    async def add_user_input(self, session_id: str, user_input: str, event_id: Optional[str] = None) -> Dict[str, Any]:
+        return await self._append(session_id, "user-input", {"user_input": user_input}, event_id)
+
+    async def add_system_marker(self, session_id: str, reason: str, event_id: Optional[str] = None) -> Dict[str, Any]:
+        return await self._append(session_id, "system-marker", {"reason": reason}, event_id)
+
+    async def add_llm_output(self, session_id: str, llm_output: str, event_id: Optional[str] = None) -> Dict[str, Any]:
+        return await self._append(session_id, "llm-output", {"llm_output": llm_output}, event_id)
+
+    async def add_observation(
+        self,
+        session_id: str,
+        observation: str,
+        tool_name: Optional[str] = None,
+        tool_call_id: Optional[int] = None,
+        event_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        body = {"observation": observation, "tool_name": tool_name, "tool_call_id": tool_call_id}
+        return await self._append(session_id, "observation", body, event_id)
+
+    async def send_events(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """通过批量接口发送事件（make_event构建），返回逐条结果；已安装msgpack时以帧流发送"""
+        results = []
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            if self.use_msgpack:
+                response = await self._request(
+                    "POST", "/events/stream", content=encode_frames(batch),
+                    headers={"Content-Type": MSGPACK_CONTENT_TYPE}
+                )
+            else:
+                response = await self._request("POST", "/events/batch", json={"events": batch})
+            results.extend(response["results"])
+        return results
+
+    async def complete_session(self, session_id: str, status: str = "completed") -> Dict[str, Any]:
+        return await self._request("POST", f"/sessions/{session_id}/complete", params={"status": status})
+
+    async def get_current_prompt(self, session_id: str, expand_blobs: bool = True) -> str:
+        result = await self._request(
+            "GET", f"/sessions/{session_id}/current-prompt", params={"expand_blobs": str(expand_blobs).lower()}
+        )
+        return result["current_prompt"]
+
+    async def get_session_summary(self, session_id: str) -> Dict[str, Any]:
+        return await self._request("GET", f"/sessions/{session_id}/summary")
+
+    # ---- 后台批量发送 ----
+
+    def track(
+        self,
+        session_id: str,
+        event_type: str,
+        content: str,
+        tool_name: Optional[str] = None,
+        tool_call_id: Optional[int] = None
+    ) -> bool:
+        """
+        缓冲事件并立即返回（不需要await），后台任务按顺序批量发送
+
+        缓冲区已满时丢弃事件并返回False
+        """
+        if self._closed:
+            raise RuntimeError("客户端已关闭")
+        event = make_event(session_id, event_type, content, tool_name=tool_name, tool_call_id=tool_call_id)
+        if not self._buffer.has_room(event):
+            self._buffer.dropped += 1
+            return False
+        self._buffer.push(event)
+        self._idle.clear()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def _run(self):
+        while self._buffer:
+            if len(self._buffer) < self.batch_size and not self._closed:
+                # 等待攒够一批或到达发送间隔
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self._send_batch(self._buffer.take(self.batch_size))
+        self._idle.set()
+
+    async def _send_batch(self, batch: List[Dict[str, Any]]):
+        try:
+            results = await self.send_events(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"批量发送 {len(batch)} 个事件失败: {e}")
+            return
+        for event, result in zip(batch, results):
+            if not result.get("success"):
+                self.failed += 1
+                logger.warning(f"会话 {event['session_id']} 的事件追加失败: {result.get('error')}")
+
+    async def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已缓冲的事件全部发送，超时返回False"""
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @property
+    def dropped(self) -> int:
+        """因缓冲区已满丢弃的事件数"""
+        return self._buffer.dropped
+
+    async def stream_llm_output(self, session_id: str, chunks: AsyncIterable[str]) -> AsyncIterator[str]:
+        """
+        透传LLM的流式输出，流结束（或中途停止读取）后将完整内容作为一条LLM输出缓冲发送
+
+        async for chunk in client.stream_llm_output(session_id, llm_stream):
+            print(chunk, end="")
+        """
+        parts = []
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            if parts:
+                self.track(session_id, "llm_output", "".join(parts))
+
+    async def aclose(self, timeout: Optional[float] = 10.0):
+        """发送剩余事件并关闭连接"""
+        await self.flush(timeout)
+        self._closed = True
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+        await self.http.aclose()
+
+    async def __aenter__(self) -> "AsyncPromptTrackerClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
@@ -0,0 +1,128 @@
+"""
+客户端公共部分：事件构建、重试策略和有界事件缓冲区
+"""
+import random
+import struct
+import uuid
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+API_PREFIX = "/api/v1"
+
+EVENT_TYPES = ("user_input", "system_marker", "llm_output", "observation")
+
+# 可重试的状态码：准入控制拒绝（429/503）和网关错误
+RETRY_STATUS = {429, 502, 503, 504}
+
+# 单次重试的最长等待秒数
+MAX_BACKOFF = 10.0
+
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+FRAME_HEADER = struct.Struct(">I")
+
+
+class PromptTrackerError(Exception):
+    """服务端返回错误"""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def new_event_id() -> str:
+    """生成事件ID，重试时复用同一个ID，服务端据此去重"""
+    return uuid.uuid4().hex
+
+
+def make_event(
+    session_id: str,
+    event_type: str,
+    content: str,
+    event_id: Optional[str] = None,
+    tool_name: Optional[str] = None,
+    tool_call_id: Optional[int] = None
+) -> Dict[str, Any]:
+    """构建批量追加接口的事件"""
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"不支持的事件类型: {event_type}")
+    event = {
+        "type": event_type,
+        "session_id": session_id,
+        "content": content,
+        "event_id": event_id or new_event_id(),
+    }
+    if tool_name is not None:
+        event["tool_name"] = tool_name
+    if tool_call_id is not None:
+        event["tool_call_id"] = tool_call_id
+    return event
+
+
+def encode_frames(events: List[Dict[str, Any]]) -> bytes:
+    """将事件编码为帧流：每帧为4字节大端长度 + msgpack编码的事件"""
+    frames = []
+    for event in events:
+        payload = msgpack.packb({key: value for key, value in event.items() if value is not None})
+        frames.append(FRAME_HEADER.pack(len(payload)))
+        frames.append(payload)
+    return b"".join(frames)
+
+
+def retry_delay(attempt: int, backoff: float, retry_after: Optional[str] = None) -> float:
+    """第attempt次重试前的等待秒数，优先使用服务端的Retry-After，否则指数退避加随机抖动"""
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            pass
+    return min(backoff * 2 ** attempt, MAX_BACKOFF) * (0.5 + random.random() / 2)
+
+
+def error_detail(body: Any) -> Any:
+    """从错误响应体中取出detail"""
+    if isinstance(body, dict) and "detail" in body:
+        return body["detail"]
+    return body
+
+
+class EventBuffer:
+    """
+    按事件数和内容字符数限制大小的事件缓冲区（不加锁，由调用方同步）
+
+    超过上限时拒绝新事件，已缓冲的事件按加入顺序发送
+    """
+
+    def __init__(self, max_events: int, max_chars: int):
+        self.max_events = max_events
+        self.max_chars = max_chars
+        self._events: "deque[Dict[str, Any]]" = deque()
+        self.chars = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def has_room(self, event: Dict[str, Any]) -> bool:
+        if not self._events:
+            return True
+        return len(self._events) < self.max_events and self.chars + len(event["content"]) <= self.max_chars
+
+    def push(self, event: Dict[str, Any]):
+        self._events.append(event)
+        self.chars += len(event["content"])
+
+    def take(self, limit: int) -> List[Dict[str, Any]]:
+        """按顺序取出最多limit个事件"""
+        batch = []
+        while self._events and len(batch) < limit:
+            event = self._events.popleft()
+            self.chars -= len(event["content"])
+            batch.append(event)
+        return batch
@@ -0,0 +1,292 @@
+"""
+同步客户端
+
+- 复用 requests.Session 的keep-alive连接池，不再每个事件新建TCP连接
+- 追加接口自动附带事件ID，超时、429/503时按Retry-After安全重试
+- track() 将事件放入有界缓冲区立即返回，由后台线程合并成批量请求发送，不阻塞调用方
+"""
+import logging
+import threading
+import time
+from typing import Optional, Dict, Any, List, Iterable, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .base import (
+    API_PREFIX, RETRY_STATUS, MSGPACK_CONTENT_TYPE, PromptTrackerError, EventBuffer,
+    make_event, new_event_id, retry_delay, error_detail, encode_frames, msgpack
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTrackerClient:
+    """提示词追踪服务的同步客户端（线程安全）"""
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        timeout: float = 10.0,
+        pool_size: int = 10,
+        max_retries: int = 3,
+        backoff: float = 0.2,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        max_buffer_events: int = 10000,
+        max_buffer_chars: int = 64 * 1024 * 1024,
+        use_msgpack: bool = True,
+        block_when_full: bool = False
+    ):
+        """
+        Args:
+            pool_size: 每个主机保持的keep-alive连接数
+            batch_size: track() 缓冲的事件每批最多发送的个数
+            flush_interval: 缓冲的事件最多等待该秒数后发送
+            max_buffer_events / max_buffer_chars: 缓冲区上限，超过时丢弃新事件（block_when_full为True时阻塞等待）
+            use_msgpack: 已安装msgpack时批量事件以帧流发送，否则使用JSON批量接口
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # 已安装msgpack时批量事件以帧流发送
+        self.use_msgpack = use_msgpack and msgpack is not None
+        self.block_when_full = block_when_full
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+        self._buffer = EventBuffer(max_buffer_events, max_buffer_chars)
+        self._cond = threading.Condition()
+        self._sending = 0
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+        self.failed = 0
+
+    # ---- 请求 ----
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        json: Any = None,
+        params: Optional[Dict[str, Any]] = None,
+        retry: bool = True,
+        content: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Any:
+        url = f"{self.base_url}{API_PREFIX}{path}"
+        attempt = 0
+        while True:
+            try:
+                response = self.http.request(
+                    method, url, json=json, params=params, data=content, headers=headers, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if not retry or attempt >= self.max_retries:
+                    raise
+                time.sleep(retry_delay(attempt, self.backoff))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS and retry and attempt < self.max_retries:
+                time.sleep(retry_delay(attempt, self.backoff, response.headers.get("Retry-After")))
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = response.text
+                raise PromptTrackerError(response.status_code, error_detail(body))
+            return response.json()
+
+    def create_session(self, session_id: str, initial_prompt: Optional[str] = None) -> Dict[str, Any]:
+        # 创建会话不可重复执行，不自动重试
+        return self._request(
+            "POST", "/sessions", json={"session_id": session_id, "initial_prompt": initial_prompt}, retry=False
+        )
+
+    def fork_session(
+        self, session_id: str, at_prompt_id: Optional[int] = None, new_session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        params = {"at_prompt_id": at_prompt_id, "new_session_id": new_session_id}
+        return self._request(
+            "POST", f"/sessions/{session_id}/fork",
+            params={key: value for key, value in params.items() if value is not None}, retry=False
+        )
+
+    def _append(self, session_id: str, path: str, body: Dict[str, Any], event_id: Optional[str]) -> Dict[str, Any]:
+        body = dict(body, session_id=session_id, event_id=event_id or new_event_id())
+        return self._request("POST", f"/sessions/{session_id}/{path}", json=body)
+
+    def add_user_input(self, session_id: str, user_input: str, event_id: Optional[str] = None) -> Dict[str, Any]:
+        return self._append(session_id, "user-input", {"user_input": user_input}, event_id)
+
+    def add_system_marker(self, session_id: str, reason: str, event_id: Optional[str] = None) -> Dict[str, Any]:
+        return self._append(session_id, "system-marker", {"reason": reason}, event_id)
+
+    def add_llm_output(self, session_id: str, llm_output: str, event_id: Optional[str] = None) -> Dict[str, Any]:
+        return self._append(session_id, "llm-output", {"llm_output": llm_output}, event_id)
+
+    def add_observation(
+        self,
+        session_id: str,
+        observation: str,
+        tool_name: Optional[str] = None,
+        tool_call_id: Optional[int] = None,
+        event_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        body = {"observation": observation, "tool_name": tool_name, "tool_call_id": tool_call_id}
+        return self._append(session_id, "observation", body, event_id)
+
+    def send_events(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """通过批量接口发送事件（make_event构建），返回逐条结果；已安装msgpack时以帧流发送"""
+        results = []
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            if self.use_msgpack:
+                response = self._request(
+                    "POST", "/events/stream", content=encode_frames(batch),
+                    headers={"Content-Type": MSGPACK_CONTENT_TYPE}
+                )
+            else:
+                response = self._request("POST", "/events/batch", json={"events": batch})
+            results.extend(response["results"])
+        return results
+
+    def complete_session(self, session_id: str, status: str = "completed") -> Dict[str, Any]:
+        return self._request("POST", f"/sessions/{session_id}/complete", params={"status": status})
+
+    def get_current_prompt(self, session_id: str, expand_blobs: bool = True) -> str:
+        result = self._request(
+            "GET", f"/sessions/{session_id}/current-prompt", params={"expand_blobs": str(expand_blobs).lower()}
+        )
+        return result["current_prompt"]
+
+    def get_session_summary(self, session_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/sessions/{session_id}/summary")
+
+    # ---- 后台批量发送 ----
+
+    def track(
+        self,
+        session_id: str,
+        event_type: str,
+        content: str,
+        tool_name: Optional[str] = None,
+        tool_call_id: Optional[int] = None
+    ) -> bool:
+        """
+        缓冲事件并立即返回，后台线程按顺序批量发送
+
+        缓冲区已满时丢弃事件并返回False（block_when_full为True时等待空间）；
+        同一会话中track的事件与直接调用add_*的顺序不保证，混用时先调用flush()
+        """
+        event = make_event(session_id, event_type, content, tool_name=tool_name, tool_call_id=tool_call_id)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("客户端已关闭")
+            while not self._buffer.has_room(event):
+                if not self.block_when_full:
+                    self._buffer.dropped += 1
+                    return False
+                self._cond.wait()
+            self._buffer.push(event)
+            self._ensure_worker()
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="prompt-tracker-flush", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._buffer and not self._closed:
+                    self._cond.wait()
+                if len(self._buffer) < self.batch_size and not self._closed:
+                    # 等待攒够一批或到达发送间隔
+                    self._cond.wait(self.flush_interval)
+                if not self._buffer:
+                    if self._closed:
+                        return
+                    continue
+                batch = self._buffer.take(self.batch_size)
+                self._sending += 1
+                self._cond.notify_all()
+            try:
+                self._send_batch(batch)
+            finally:
+                with self._cond:
+                    self._sending -= 1
+                    self._cond.notify_all()
+
+    def _send_batch(self, batch: List[Dict[str, Any]]):
+        try:
+            results = self.send_events(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"批量发送 {len(batch)} 个事件失败: {e}")
+            return
+        for event, result in zip(batch, results):
+            if not result.get("success"):
+                self.failed += 1
+                logger.warning(f"会话 {event['session_id']} 的事件追加失败: {result.get('error')}")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已缓冲的事件全部发送，超时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._buffer or self._sending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    @property
+    def dropped(self) -> int:
+        """因缓冲区已满丢弃的事件数"""
+        return self._buffer.dropped
+
+    def stream_llm_output(self, session_id: str, chunks: Iterable[str]) -> Iterator[str]:
+        """
+        透传LLM的流式输出，流结束（或中途停止读取）后将完整内容作为一条LLM输出缓冲发送
+
+        for chunk in client.stream_llm_output(session_id, llm_stream):
+            print(chunk, end="")
+        """
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            if parts:
+                self.track(session_id, "llm_output", "".join(parts))
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """发送剩余事件并关闭连接"""
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        self.http.close()
+
+    def __enter__(self) -> "PromptTrackerClient":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -2,7 +2,7 @@
 配置文件
 """
 import os
-from typing import Optional
+from typing import Optional, List
 
 class Settings:
     """应用配置类"""
@@ -19,11 +19,108 @@ class Settings:
     DB_MAX_OVERFLOW: int = 20
     DB_POOL_TIMEOUT: int = 30
     DB_POOL_RECYCLE: int = 3600
+    DB_POOL_WARMUP: int = 5      # 启动后预先建立的连接数（每个连接池）
+    
+    # 启动配置（数据库初始化在后台进行，/health立即可用，/ready在初始化完成后返回200）
+    STARTUP_RETRY_INTERVAL: float = 1.0       # 数据库不可用时首次重试的间隔（秒），之后指数增长
+    STARTUP_RETRY_MAX_INTERVAL: float = 30.0  # 重试间隔上限（秒）
+    
+    # 读连接池配置（GET接口使用独立的连接池，避免大查询占满写入连接）
+    DB_READ_URLS: str = ""              # 逗号分隔的只读副本URL，与分片一一对应；为空时读连接池连接主库
+    DB_READ_POOL_SIZE: int = 10
+    DB_READ_MAX_OVERFLOW: int = 20
+    READ_YOUR_WRITES_SECONDS: float = 5.0  # 会话写入后该秒数内的读取走写连接池，避免读到副本延迟前的数据
+    
+    # 分片配置（为空时只使用上面的单个数据库）
+    DB_SHARDS: str = ""          # 逗号分隔的分片数据库URL，按session_id一致性哈希路由，如 sqlite:///shard0.db,sqlite:///shard1.db
+    DB_SHARD_VNODES: int = 64    # 一致性哈希环上每个分片的虚拟节点数
     
     # API配置
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
-    API_DEBUG: bool = True
+    API_DEBUG: bool = False        # 输出SQL语句日志
+    API_RELOAD: bool = False       # 单进程运行时代码变更后自动重启（仅用于开发）
+    API_WORKERS: int = 1           # 大于1时以多进程方式运行（预加载后fork，不支持热重载）
+    WORKER_BUS_DIR: str = ""       # worker间失效通知的Unix套接字目录，为空时使用临时目录
+    
+    # 响应序列化配置
+    API_FAST_JSON: bool = True            # 使用orjson快速序列化并跳过ORM行的二次校验
+    API_COMPRESSION_MIN_SIZE: int = 1024  # 超过该字节数的响应按Accept-Encoding进行gzip/br压缩
+    
+    # 准入控制配置（按路由类别限制同时进行的数据库操作，超出时排队，排队过长返回429/503）
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_IN_FLIGHT: int = 30     # 所有类别同时执行的请求总数上限，默认与写连接池容量一致
+    ADMISSION_INGEST_LIMIT: int = 24      # 写入接口的并发上限（优先放行）
+    ADMISSION_READ_LIMIT: int = 16        # 单会话查询接口的并发上限
+    ADMISSION_EXPORT_LIMIT: int = 4       # 跨会话扫描类接口的并发上限
+    ADMISSION_QUEUE_LIMIT: int = 100      # 每个类别的最大排队数，超出时返回429
+    ADMISSION_QUEUE_TIMEOUT: float = 5.0  # 排队超过该秒数返回503
+    
+    # 全文检索配置
+    SEARCH_ENABLED: bool = True               # 写入时维护倒排索引
+    SEARCH_INDEX_INITIAL_PROMPT: bool = False  # 是否索引初始提示词（默认模板在每个会话中重复）
+    
+    # token计数配置
+    TOKENIZER: str = "approx"                 # approx（离线近似）或 tiktoken:<encoding>
+    CONTEXT_TOKEN_BUDGET: int = 32000         # 单个会话的上下文token预算
+    CONTEXT_TOKEN_WARNING_RATIO: float = 0.8  # 超过预算的该比例时告警
+    
+    # 会话生命周期配置
+    SESSION_AUTO_COMPLETE: bool = True     # LLM输出以<End><Reason>FinalAsnwer</Reason></End>结束时自动完成会话
+    SESSION_IDLE_TIMEOUT: int = 3600       # 超过该秒数无活动的会话自动完成，0表示不启用
+    SESSION_IDLE_CHECK_INTERVAL: int = 60  # 空闲会话检查间隔（秒）
+    COMPACTION_ENABLED: bool = True        # 会话完成后将中间提示词记录压缩为增量片段
+    COMPACTION_BATCH_SIZE: int = 100       # 压缩时每批读取的提示词记录数
+    
+    # 幂等追加与批量写入配置
+    EVENT_ID_WINDOW: int = 64              # 每个会话记住的最近追加事件ID数，重试的事件ID在该范围内去重
+    BATCH_MAX_EVENTS: int = 500            # 批量追加接口单次请求的最大事件数
+    INGEST_STREAM_MAX_EVENTS: int = 10000  # msgpack帧流接口单次请求的最大事件数
+    INGEST_MAX_FRAME_BYTES: int = 16 * 1024 * 1024  # 帧流中单个事件的最大字节数
+    
+    # 会话回放配置
+    REPLAY_MAX_DELAY: float = 5.0          # 按原始节奏回放（speed>0）时相邻事件之间的最大等待秒数
+    
+    # 事件速率汇总配置（/stats/timeseries 读取的分钟/小时汇总）
+    ROLLUP_ENABLED: bool = True
+    ROLLUP_SLOTS: int = 8                  # 每个时间桶分散写入的行数，减少同一分钟内写入的行锁竞争
+    ROLLUP_MINUTE_RETENTION_HOURS: int = 48  # 分钟桶保留的小时数，更早的合并为小时桶
+    ROLLUP_COMPACT_INTERVAL: int = 600     # 合并分钟桶的间隔（秒）
+    ROLLUP_COMPACT_BATCH: int = 5000       # 每个事务合并的分钟桶行数
+    TIMESERIES_MAX_POINTS: int = 1440      # 单次查询返回的最大点数
+    
+    # 数据保留配置
+    RETENTION_DAYS: int = 0                # 已结束的会话在最后活动该天数后清理，0表示永久保留
+    RETENTION_BATCH_SIZE: int = 500        # 每批删除的行数（每批一个短事务）
+    RETENTION_BATCH_PAUSE: float = 0.05    # 批之间暂停的秒数，限制对在线写入的影响
+    RETENTION_CHECK_INTERVAL: int = 3600   # 后台清理的间隔（秒）
+    
+    # 当前提示词缓存配置
+    PROMPT_CACHE_SESSIONS: int = 1000      # 内存中缓存当前提示词的会话数（共享前缀片段），0表示不缓存
+    
+    # Observation存储配置
+    OBSERVATION_INLINE_MAX_CHARS: int = 4096  # 超过该长度的Observation存入内容存储，提示词链中只保留引用
+    BLOB_STORE: str = "database"              # database（blobs表）或 file（本地目录）
+    BLOB_STORE_DIR: str = "./blob_store"      # file 后端的存储目录
+    
+    # 请求剖析配置（抽样记录解析、逻辑、SQL和序列化耗时，慢请求可在 /debug/slow-requests 查看）
+    PROFILING_ENABLED: bool = False
+    PROFILE_SAMPLE_RATE: float = 0.01       # 随机抽样比例，0表示只剖析带调试请求头的请求
+    PROFILE_HEADER: str = "X-Debug-Profile" # 带该请求头（值不为0/false）的请求总是剖析
+    PROFILE_SLOW_MS: float = 200.0          # 总耗时超过该毫秒数的请求写入慢请求缓冲区
+    PROFILE_EXPLAIN_MS: float = 50.0        # 耗时超过该毫秒数的SQL语句附带执行计划
+    PROFILE_RING_SIZE: int = 100            # 慢请求缓冲区保留的请求数
+    PROFILE_MAX_STATEMENTS: int = 200       # 每个请求最多记录的SQL语句数
+    
+    # 链路追踪配置（兼容W3C traceparent，span以OTLP JSON字段导出）
+    TRACING_ENABLED: bool = False
+    TRACE_SAMPLE_RATE: float = 0.1          # 没有上游采样决定时的抽样比例
+    TRACE_PARENT_BASED: bool = True         # 请求带traceparent时跟随上游的采样标志
+    TRACE_EXPORTER: str = "stdout"          # stdout、file、none，或 "模块:类" 形式的自定义导出器
+    TRACE_FILE: str = "./traces.jsonl"      # file 导出器的输出文件
+    TRACE_SERVICE_NAME: str = "prompt-tracker"
+    TRACE_EXPORT_INTERVAL: float = 1.0      # 后台导出的间隔（秒）
+    TRACE_QUEUE_SIZE: int = 10000           # 待导出span的队列上限，超出时丢弃
     
     # 日志配置
     LOG_LEVEL: str = "INFO"
@@ -37,6 +134,18 @@ class Settings:
         encoded_password = quote_plus(self.DB_PASSWORD)
         return f"mysql+pymysql://{self.DB_USER}:{encoded_password}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}?charset=utf8mb4"
     
+    @property
+    def shard_urls(self) -> List[str]:
+        """获取各分片的数据库连接URL，未配置分片时只有一个"""
+        urls = [url.strip() for url in self.DB_SHARDS.split(",") if url.strip()]
+        return urls or [self.database_url]
+    
+    @property
+    def read_urls(self) -> List[Optional[str]]:
+        """获取各分片的只读副本URL，未配置的分片为None"""
+        urls = [url.strip() or None for url in self.DB_READ_URLS.split(",")] if self.DB_READ_URLS else []
+        return (urls + [None] * len(self.shard_urls))[:len(self.shard_urls)]
+    
     @classmethod
     def from_env(cls) -> "Settings":
         """从环境变量创建配置"""
@@ -48,10 +157,87 @@ class Settings:
         settings.DB_USER = os.getenv("DB_USER", settings.DB_USER)
         settings.DB_PASSWORD = os.getenv("DB_PASSWORD", settings.DB_PASSWORD)
         settings.DB_NAME = os.getenv("DB_NAME", settings.DB_NAME)
+        settings.DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", settings.DB_POOL_WARMUP))
+        settings.STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", settings.STARTUP_RETRY_INTERVAL))
+        settings.STARTUP_RETRY_MAX_INTERVAL = float(os.getenv("STARTUP_RETRY_MAX_INTERVAL", settings.STARTUP_RETRY_MAX_INTERVAL))
+        settings.DB_READ_URLS = os.getenv("DB_READ_URLS", settings.DB_READ_URLS)
+        settings.DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", settings.DB_READ_POOL_SIZE))
+        settings.DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", settings.DB_READ_MAX_OVERFLOW))
+        settings.READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", settings.READ_YOUR_WRITES_SECONDS))
+        settings.DB_SHARDS = os.getenv("DB_SHARDS", settings.DB_SHARDS)
+        settings.DB_SHARD_VNODES = int(os.getenv("DB_SHARD_VNODES", settings.DB_SHARD_VNODES))
         
         settings.API_HOST = os.getenv("API_HOST", settings.API_HOST)
         settings.API_PORT = int(os.getenv("API_PORT", settings.API_PORT))
-        settings.API_DEBUG = os.getenv("API_DEBUG", "true").lower() == "true"
+        settings.API_DEBUG = os.getenv("API_DEBUG", str(settings.API_DEBUG)).lower() == "true"
+        settings.API_RELOAD = os.getenv("API_RELOAD", str(settings.API_RELOAD)).lower() == "true"
+        settings.API_WORKERS = int(os.getenv("API_WORKERS", settings.API_WORKERS))
+        settings.WORKER_BUS_DIR = os.getenv("WORKER_BUS_DIR", settings.WORKER_BUS_DIR)
+        settings.API_FAST_JSON = os.getenv("API_FAST_JSON", "true").lower() == "true"
+        settings.API_COMPRESSION_MIN_SIZE = int(os.getenv("API_COMPRESSION_MIN_SIZE", settings.API_COMPRESSION_MIN_SIZE))
+        
+        settings.ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+        settings.ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", settings.ADMISSION_MAX_IN_FLIGHT))
+        settings.ADMISSION_INGEST_LIMIT = int(os.getenv("ADMISSION_INGEST_LIMIT", settings.ADMISSION_INGEST_LIMIT))
+        settings.ADMISSION_READ_LIMIT = int(os.getenv("ADMISSION_READ_LIMIT", settings.ADMISSION_READ_LIMIT))
+        settings.ADMISSION_EXPORT_LIMIT = int(os.getenv("ADMISSION_EXPORT_LIMIT", settings.ADMISSION_EXPORT_LIMIT))
+        settings.ADMISSION_QUEUE_LIMIT = int(os.getenv("ADMISSION_QUEUE_LIMIT", settings.ADMISSION_QUEUE_LIMIT))
+        settings.ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", settings.ADMISSION_QUEUE_TIMEOUT))
+        
+        settings.SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true").lower() == "true"
+        settings.SEARCH_INDEX_INITIAL_PROMPT = os.getenv("SEARCH_INDEX_INITIAL_PROMPT", "false").lower() == "true"
+        
+        settings.TOKENIZER = os.getenv("TOKENIZER", settings.TOKENIZER)
+        settings.CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", settings.CONTEXT_TOKEN_BUDGET))
+        settings.CONTEXT_TOKEN_WARNING_RATIO = float(os.getenv("CONTEXT_TOKEN_WARNING_RATIO", settings.CONTEXT_TOKEN_WARNING_RATIO))
+        
+        settings.SESSION_AUTO_COMPLETE = os.getenv("SESSION_AUTO_COMPLETE", "true").lower() == "true"
+        settings.SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", settings.SESSION_IDLE_TIMEOUT))
+        settings.SESSION_IDLE_CHECK_INTERVAL = int(os.getenv("SESSION_IDLE_CHECK_INTERVAL", settings.SESSION_IDLE_CHECK_INTERVAL))
+        settings.COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "true").lower() == "true"
+        settings.COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", settings.COMPACTION_BATCH_SIZE))
+        
+        settings.EVENT_ID_WINDOW = int(os.getenv("EVENT_ID_WINDOW", settings.EVENT_ID_WINDOW))
+        settings.BATCH_MAX_EVENTS = int(os.getenv("BATCH_MAX_EVENTS", settings.BATCH_MAX_EVENTS))
+        settings.INGEST_STREAM_MAX_EVENTS = int(os.getenv("INGEST_STREAM_MAX_EVENTS", settings.INGEST_STREAM_MAX_EVENTS))
+        settings.INGEST_MAX_FRAME_BYTES = int(os.getenv("INGEST_MAX_FRAME_BYTES", settings.INGEST_MAX_FRAME_BYTES))
+        
+        settings.REPLAY_MAX_DELAY = float(os.getenv("REPLAY_MAX_DELAY", settings.REPLAY_MAX_DELAY))
+        
+        settings.ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "true").lower() == "true"
+        settings.ROLLUP_SLOTS = int(os.getenv("ROLLUP_SLOTS", settings.ROLLUP_SLOTS))
+        settings.ROLLUP_MINUTE_RETENTION_HOURS = int(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", settings.ROLLUP_MINUTE_RETENTION_HOURS))
+        settings.ROLLUP_COMPACT_INTERVAL = int(os.getenv("ROLLUP_COMPACT_INTERVAL", settings.ROLLUP_COMPACT_INTERVAL))
+        settings.ROLLUP_COMPACT_BATCH = int(os.getenv("ROLLUP_COMPACT_BATCH", settings.ROLLUP_COMPACT_BATCH))
+        settings.TIMESERIES_MAX_POINTS = int(os.getenv("TIMESERIES_MAX_POINTS", settings.TIMESERIES_MAX_POINTS))
+        
+        settings.RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", settings.RETENTION_DAYS))
+        settings.RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", settings.RETENTION_BATCH_SIZE))
+        settings.RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", settings.RETENTION_BATCH_PAUSE))
+        settings.RETENTION_CHECK_INTERVAL = int(os.getenv("RETENTION_CHECK_INTERVAL", settings.RETENTION_CHECK_INTERVAL))
+        
+        settings.PROMPT_CACHE_SESSIONS = int(os.getenv("PROMPT_CACHE_SESSIONS", settings.PROMPT_CACHE_SESSIONS))
+        
+        settings.OBSERVATION_INLINE_MAX_CHARS = int(os.getenv("OBSERVATION_INLINE_MAX_CHARS", settings.OBSERVATION_INLINE_MAX_CHARS))
+        settings.BLOB_STORE = os.getenv("BLOB_STORE", settings.BLOB_STORE)
+        settings.BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", settings.BLOB_STORE_DIR)
+        
+        settings.PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+        settings.PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", settings.PROFILE_SAMPLE_RATE))
+        settings.PROFILE_HEADER = os.getenv("PROFILE_HEADER", settings.PROFILE_HEADER)
+        settings.PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", settings.PROFILE_SLOW_MS))
+        settings.PROFILE_EXPLAIN_MS = float(os.getenv("PROFILE_EXPLAIN_MS", settings.PROFILE_EXPLAIN_MS))
+        settings.PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", settings.PROFILE_RING_SIZE))
+        settings.PROFILE_MAX_STATEMENTS = int(os.getenv("PROFILE_MAX_STATEMENTS", settings.PROFILE_MAX_STATEMENTS))
+        
+        settings.TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+        settings.TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", settings.TRACE_SAMPLE_RATE))
+        settings.TRACE_PARENT_BASED = os.getenv("TRACE_PARENT_BASED", "true").lower() == "true"
+        settings.TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", settings.TRACE_EXPORTER)
+        settings.TRACE_FILE = os.getenv("TRACE_FILE", settings.TRACE_FILE)
+        settings.TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", settings.TRACE_SERVICE_NAME)
+        settings.TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", settings.TRACE_EXPORT_INTERVAL))
+        settings.TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", settings.TRACE_QUEUE_SIZE))
         
         settings.LOG_LEVEL = os.getenv("LOG_LEVEL", settings.LOG_LEVEL)
         
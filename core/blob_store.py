@@ -0,0 +1,129 @@
+"""
+大内容存储
+
+超过阈值的Observation内容按SHA-256寻址只存储一次，提示词链中只保留引用
+<BlobRef>digest</BlobRef>，读取时再展开。读取时会展开文本中任何位置的引用，因此写入的用户内容中不能出现
+引用格式的文本（contains_blob_ref），否则可以借此读取其他会话的内容。支持两种后端：
+- database: 存储在 blobs 表中（默认）
+- file: 存储在本地目录 BLOB_STORE_DIR/<digest前两位>/<digest>
+"""
+import os
+import re
+import hashlib
+import logging
+import tempfile
+from typing import Optional, Dict
+from sqlalchemy.orm import Session
+from config.settings import settings
+from database import insert_ignore
+from models.prompt_models import BlobModel
+
+logger = logging.getLogger(__name__)
+
+BLOB_REF_PATTERN = re.compile(r'<BlobRef>([0-9a-f]{64})</BlobRef>')
+
+
+def blob_digest(content: str) -> str:
+    """计算内容的SHA-256"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def blob_ref(digest: str) -> str:
+    """构建提示词链中的引用标记"""
+    return f"<BlobRef>{digest}</BlobRef>"
+
+
+def contains_blob_ref(text: str) -> bool:
+    """文本中是否包含引用格式的内容"""
+    return "<BlobRef>" in text and BLOB_REF_PATTERN.search(text) is not None
+
+
+class DatabaseBlobStore:
+    """存储在 blobs 表中的内容"""
+
+    def put(self, content: str, db: Session) -> str:
+        """写入内容（不提交事务），相同内容只存储一次，返回digest"""
+        digest = blob_digest(content)
+        insert_ignore(db, BlobModel, {"digest": digest, "content": content, "size": len(content)})
+        return digest
+
+    def get_many(self, digests, db: Session) -> Dict[str, str]:
+        """批量读取内容"""
+        if not digests:
+            return {}
+        return dict(db.query(BlobModel.digest, BlobModel.content).filter(
+            BlobModel.digest.in_(list(digests))
+        ).all())
+
+
+class FileBlobStore:
+    """存储在本地目录中的内容"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, content: str, db: Session) -> str:
+        digest = blob_digest(content)
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免读到写了一半的内容
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def get_many(self, digests, db: Session) -> Dict[str, str]:
+        contents = {}
+        for digest in digests:
+            try:
+                with open(self._path(digest), "r", encoding="utf-8") as f:
+                    contents[digest] = f.read()
+            except FileNotFoundError:
+                logger.warning(f"找不到内容 {digest}")
+        return contents
+
+
+def create_blob_store():
+    """按配置创建内容存储"""
+    if settings.BLOB_STORE == "file":
+        return FileBlobStore(settings.BLOB_STORE_DIR)
+    return DatabaseBlobStore()
+
+
+class BlobResolver:
+    """展开提示词中的内容引用，同一次读取中每个digest只加载一次"""
+
+    def __init__(self, store, db: Session):
+        self.store = store
+        self.db = db
+        self._contents: Dict[str, str] = {}
+
+    def expand(self, text: str) -> str:
+        if "<BlobRef>" not in text:
+            return text
+
+        missing = {digest for digest in BLOB_REF_PATTERN.findall(text) if digest not in self._contents}
+        if missing:
+            self._contents.update(self.store.get_many(missing, self.db))
+
+        return BLOB_REF_PATTERN.sub(
+            lambda match: self._contents.get(match.group(1), match.group(0)),
+            text
+        )
+
+    def get(self, digest: str) -> Optional[str]:
+        if digest not in self._contents:
+            self._contents.update(self.store.get_many({digest}, self.db))
+        return self._contents.get(digest)
@@ -0,0 +1,452 @@
+"""
+历史日志批量导入
+
+输入为JSONL文件，每行一个事件，字段与批量追加接口一致，另可带 timestamp：
+    {"session_id": "...", "type": "user_input", "content": "...", "timestamp": "2025-01-01T08:00:00Z"}
+type 为 init 的事件（须为会话的第一个事件）指定初始提示词，否则使用默认模板。
+同一会话的全部事件需要在同一个文件中。
+
+- 解析、片段构建、token计数、工具调用提取和分词在工作进程中并行执行（每个文件一个任务）
+- 提示词链、工具调用及其Observation关联、会话摘要、全文索引、事件速率汇总与在线追加的逻辑一致，
+  提示词直接按压缩后的形式写入（中间记录只存片段）
+- 每批会话在一个事务中以多行INSERT写入，已存在的会话跳过，因此中断后重新运行不会重复导入
+- 完成的文件记入检查点文件，重新运行时跳过
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Iterable
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from config.settings import settings
+from database import shard_router, init_database
+from models.prompt_models import (
+    SessionModel, PromptModel, ToolCallModel, SessionSummaryModel, SearchTermModel,
+    PromptType, SessionStatus
+)
+from core.prompt_tracker import PromptTracker
+from core.session_summary import EVENT_COUNT_COLUMNS
+from core.tokenizer import count_tokens
+from core.prompt_chain import chain_hash
+from core.tool_analytics import hour_bucket
+from core.blob_store import blob_digest, blob_ref, contains_blob_ref
+from core.tag_parser import (
+    extract_end_reason, extract_tool_calls,
+    user_input_fragment, system_marker_fragment, llm_output_fragment, observation_fragment
+)
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = {prompt_type.value: prompt_type for prompt_type in PromptType}
+
+# 工作进程中的追踪器（复用其全文索引、工具统计、内容存储和默认初始提示词）
+_tracker: Optional[PromptTracker] = None
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """解析ISO 8601字符串或Unix秒数，统一为UTC的naive datetime"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    moment = datetime.fromisoformat(str(value))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def read_events(path: str, stats: Dict[str, Any]) -> "OrderedDict[str, List[Dict[str, Any]]]":
+    """读取文件中的事件并按会话分组（保持文件中的顺序），格式错误的行计入 invalid_lines"""
+    sessions: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+                session_id = event["session_id"]
+                if event.get("type") not in EVENT_TYPES or not isinstance(event.get("content"), str):
+                    raise ValueError(f"不支持的事件: type={event.get('type')!r}")
+                if not isinstance(session_id, str) or not 0 < len(session_id) <= 64:
+                    raise ValueError(f"无效的session_id: {session_id!r}")
+                if contains_blob_ref(event["content"]):
+                    raise ValueError("内容中不能包含大内容引用<BlobRef>")
+                event["timestamp"] = parse_timestamp(event.get("timestamp"))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                stats["invalid_lines"] += 1
+                if stats["invalid_lines"] <= 10:
+                    logger.warning(f"{path}:{line_number} 格式错误，已跳过: {e}")
+                continue
+            sessions.setdefault(session_id, []).append(event)
+    return sessions
+
+
+def build_session(session_id: str, events: List[Dict[str, Any]], tracker: PromptTracker) -> Dict[str, Any]:
+    """
+    按在线追加的规则构建会话的全部写入内容（不访问数据库）
+
+    提示词行只记录片段，写入时第一条和最后一条记录存完整提示词，中间记录存片段（is_delta）
+    """
+    now = datetime.utcnow()
+    if events and events[0]["type"] == PromptType.init.value:
+        initial_prompt, created_at = events[0]["content"], events[0]["timestamp"] or now
+        events = events[1:]
+    else:
+        initial_prompt = tracker.default_initial_prompt
+        created_at = next((event["timestamp"] for event in events if event["timestamp"]), now)
+
+    initial_tokens = count_tokens(initial_prompt)
+    rows = [{
+        "type": PromptType.init,
+        "fragment": initial_prompt,
+        "prompt_length": len(initial_prompt),
+        "content_length": len(initial_prompt),
+        "fragment_tokens": initial_tokens,
+        "total_tokens": initial_tokens,
+        "bytes": len(initial_prompt.encode("utf-8")),
+        "chain_hash": chain_hash(None, initial_prompt),
+        "timestamp": created_at,
+        "postings": (
+            tracker.search_index.postings(initial_prompt)
+            if settings.SEARCH_ENABLED and settings.SEARCH_INDEX_INITIAL_PROMPT else set()
+        ),
+        "event_id": None,
+    }]
+    tool_calls: List[Dict[str, Any]] = []
+    blobs: List[str] = []
+    completed = False
+    moment = created_at
+
+    for event in events:
+        prompt_type = EVENT_TYPES[event["type"]]
+        if prompt_type == PromptType.init:
+            # init只能是第一个事件
+            continue
+        content = event["content"]
+        # 缺少时间的事件沿用上一个事件的时间
+        moment = max(event["timestamp"] or moment, moment)
+        logical_fragment = None
+        calls = []
+
+        if prompt_type == PromptType.user_input:
+            fragment = user_input_fragment(content)
+        elif prompt_type == PromptType.system_marker:
+            fragment = system_marker_fragment(session_id, content)
+        elif prompt_type == PromptType.llm_output:
+            fragment = llm_output_fragment(content)
+            calls = extract_tool_calls(content)
+        else:
+            logical_fragment = observation_fragment(content)
+            if len(content) > settings.OBSERVATION_INLINE_MAX_CHARS:
+                blobs.append(content)
+                fragment = observation_fragment(blob_ref(blob_digest(content)))
+            else:
+                fragment = logical_fragment
+        logical_fragment = fragment if logical_fragment is None else logical_fragment
+
+        index = len(rows)
+        fragment_tokens = count_tokens(logical_fragment)
+        rows.append({
+            "type": prompt_type,
+            "fragment": fragment,
+            "prompt_length": rows[-1]["prompt_length"] + len(fragment),
+            "content_length": rows[-1]["content_length"] + len(logical_fragment),
+            "fragment_tokens": fragment_tokens,
+            "total_tokens": rows[-1]["total_tokens"] + fragment_tokens,
+            "bytes": len(logical_fragment.encode("utf-8")),
+            "chain_hash": chain_hash(rows[-1]["chain_hash"], fragment),
+            "timestamp": moment,
+            "postings": tracker.search_index.postings(logical_fragment) if settings.SEARCH_ENABLED else set(),
+            "event_id": event.get("event_id"),
+        })
+
+        for call in calls:
+            tool_calls.append(dict(call, row=index, created_at=moment, observation_row=None))
+
+        if prompt_type == PromptType.observation:
+            # 关联最早一个尚未收到结果的工具调用（同名优先）
+            tool_name = event.get("tool_name")
+            for call in tool_calls:
+                if call["observation_row"] is None and (not tool_name or call["tool_name"] == tool_name):
+                    call["observation_row"] = index
+                    call["observed_at"] = moment
+                    call["latency_ms"] = int((moment - call["created_at"]).total_seconds() * 1000)
+                    break
+
+        # 以FinalAsnwer结束的输出完成会话，之后再有追加时重新置为active
+        completed = (
+            settings.SESSION_AUTO_COMPLETE
+            and prompt_type == PromptType.llm_output
+            and extract_end_reason(content) == "FinalAsnwer"
+        )
+
+    return {
+        "session_id": session_id,
+        "initial_prompt": initial_prompt,
+        "created_at": created_at,
+        "updated_at": moment,
+        "status": SessionStatus.completed if completed else SessionStatus.active,
+        "rows": rows,
+        "tool_calls": tool_calls,
+        "blobs": blobs,
+    }
+
+
+def write_sessions(plans: List[Dict[str, Any]], db: Session, tracker: PromptTracker):
+    """在一个事务中写入一批会话（同一分片，调用方提交）"""
+    for plan in plans:
+        for content in plan["blobs"]:
+            tracker.blob_store.put(content, db)
+
+    db.execute(insert(SessionModel), [
+        {
+            "session_id": plan["session_id"],
+            "initial_prompt": plan["initial_prompt"],
+            "created_at": plan["created_at"],
+            "updated_at": plan["updated_at"],
+            "status": plan["status"],
+        }
+        for plan in plans
+    ])
+
+    prompt_rows = []
+    for plan in plans:
+        rows = plan["rows"]
+        last = len(rows) - 1
+        full_text = "".join(row["fragment"] for row in rows) if last > 0 else None
+        for index, row in enumerate(rows):
+            prompt_rows.append({
+                "session_id": plan["session_id"],
+                "type": row["type"],
+                "prompt": full_text if index == last and last > 0 else row["fragment"],
+                "is_delta": 0 < index < last,
+                "prompt_length": row["prompt_length"],
+                "content_length": row["content_length"],
+                "fragment_tokens": row["fragment_tokens"],
+                "total_tokens": row["total_tokens"],
+                "chain_hash": row["chain_hash"],
+                "timestamp": row["timestamp"],
+            })
+    db.execute(insert(PromptModel), prompt_rows)
+
+    # 新会话只包含本批插入的行，同一条INSERT中的自增ID按行顺序递增
+    prompt_ids: Dict[str, List[int]] = {plan["session_id"]: [] for plan in plans}
+    for session_id, prompt_id in db.query(PromptModel.session_id, PromptModel.id).filter(
+        PromptModel.session_id.in_(list(prompt_ids))
+    ).order_by(PromptModel.id):
+        prompt_ids[session_id].append(prompt_id)
+
+    tool_call_rows = []
+    search_rows = []
+    summary_rows = []
+    rollups: Dict[datetime, List[Dict[str, Any]]] = {}
+    for plan in plans:
+        session_id = plan["session_id"]
+        ids = prompt_ids[session_id]
+        if len(ids) != len(plan["rows"]):
+            raise RuntimeError(f"会话 {session_id} 的提示词ID数量与写入行数不一致")
+
+        for call in plan["tool_calls"]:
+            tool_call_rows.append({
+                "session_id": session_id,
+                "prompt_id": ids[call["row"]],
+                "tool_name": call["tool_name"],
+                "arguments": call["arguments"],
+                "description": call.get("description"),
+                "created_at": call["created_at"],
+                "observation_prompt_id": ids[call["observation_row"]] if call["observation_row"] is not None else None,
+                "observed_at": call.get("observed_at"),
+                "latency_ms": call.get("latency_ms"),
+            })
+            rollups.setdefault(hour_bucket(call["created_at"]), []).append(call)
+
+        counts = {column: 0 for column in EVENT_COUNT_COLUMNS.values()}
+        recent_event_ids = []
+        for prompt_id, row in zip(ids, plan["rows"]):
+            counts[EVENT_COUNT_COLUMNS[row["type"]]] += 1
+            search_rows.extend(tracker.search_index.posting_rows(session_id, prompt_id, row["postings"]))
+            if row["event_id"]:
+                recent_event_ids.append([row["event_id"], prompt_id])
+
+        last_row = plan["rows"][-1]
+        summary_rows.append({
+            "session_id": session_id,
+            "last_prompt_id": ids[-1],
+            **counts,
+            "prompt_length": last_row["prompt_length"],
+            "content_length": last_row["content_length"],
+            "total_tokens": last_row["total_tokens"],
+            "tool_call_count": len(plan["tool_calls"]),
+            "last_activity_at": plan["updated_at"],
+            "recent_event_ids": recent_event_ids[-max(settings.EVENT_ID_WINDOW, 1):] or None,
+        })
+
+    if tool_call_rows:
+        db.execute(insert(ToolCallModel), tool_call_rows)
+    if search_rows:
+        db.execute(insert(SearchTermModel), search_rows)
+    db.execute(insert(SessionSummaryModel), summary_rows)
+
+    # 工具调用汇总按调用时间所在的小时累加
+    for bucket in sorted(rollups):
+        tracker.tool_analytics.record(rollups[bucket], db, now=bucket)
+
+    # 事件速率汇总按事件时间所在的分钟累加
+    tracker.event_rollups.record_history([
+        (plan["session_id"], [(row["type"], row["bytes"], row["timestamp"]) for row in plan["rows"]])
+        for plan in plans
+    ], db)
+
+
+def _init_worker():
+    """工作进程初始化：丢弃从主进程继承的连接池"""
+    global _tracker
+    shard_router.after_fork()
+    _tracker = PromptTracker()
+
+
+def _existing_sessions(session_ids: List[str], db: Session) -> set:
+    return {
+        row.session_id for row in db.query(SessionModel.session_id).filter(SessionModel.session_id.in_(session_ids))
+    }
+
+
+def import_file(path: str, batch_sessions: int) -> Dict[str, Any]:
+    """导入一个文件（在工作进程中执行），返回统计信息"""
+    tracker = _tracker or PromptTracker()
+    started = time.monotonic()
+    stats = {
+        "path": path, "sessions": 0, "skipped_sessions": 0, "events": 0,
+        "invalid_lines": 0, "failed_sessions": 0, "errors": [],
+    }
+    sessions = read_events(path, stats)
+
+    # 按分片分组，每个分片按批写入
+    by_shard: Dict[int, List[str]] = {}
+    for session_id in sessions:
+        by_shard.setdefault(shard_router.shard_index(session_id), []).append(session_id)
+
+    batch_size = max(batch_sessions, 1)
+    for session_ids in by_shard.values():
+        for start in range(0, len(session_ids), batch_size):
+            batch = session_ids[start:start + batch_size]
+            with shard_router.session_scope(batch[0]) as db:
+                try:
+                    existing = _existing_sessions(batch, db)
+                    plans = [
+                        build_session(session_id, sessions[session_id], tracker)
+                        for session_id in batch if session_id not in existing
+                    ]
+                    if plans:
+                        write_sessions(plans, db, tracker)
+                        db.commit()
+                except Exception as e:
+                    db.rollback()
+                    stats["failed_sessions"] += len(batch)
+                    stats["errors"].append(f"{batch[0]}...（{len(batch)} 个会话）: {e}")
+                    logger.error(f"{path} 写入 {len(batch)} 个会话失败: {e}")
+                    continue
+            stats["skipped_sessions"] += len(existing)
+            stats["sessions"] += len(plans)
+            stats["events"] += sum(len(plan["rows"]) for plan in plans)
+
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    return stats
+
+
+class Checkpoint:
+    """记录已完整导入的文件（路径、大小和修改时间），文件变化后会重新导入"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    @staticmethod
+    def _signature(path: str) -> Dict[str, int]:
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_done(self, path: str) -> bool:
+        entry = self.files.get(os.path.abspath(path))
+        return entry is not None and all(entry.get(key) == value for key, value in self._signature(path).items())
+
+    def mark_done(self, path: str, stats: Dict[str, Any]):
+        self.files[os.path.abspath(path)] = {
+            **self._signature(path),
+            "sessions": stats["sessions"],
+            "events": stats["events"],
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+        self.save()
+
+    def save(self):
+        """写入临时文件后原子替换"""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".checkpoint-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def run_import(
+    paths: Iterable[str],
+    workers: int = os.cpu_count() or 1,
+    checkpoint_path: Optional[str] = None,
+    batch_sessions: int = 50
+) -> Dict[str, Any]:
+    """并行导入多个文件，按文件报告进度，返回汇总统计"""
+    init_database()
+    checkpoint = Checkpoint(checkpoint_path)
+    paths = list(paths)
+    pending = [path for path in paths if not checkpoint.is_done(path)]
+    skipped_files = len(paths) - len(pending)
+    totals = {
+        "files": len(pending), "skipped_files": skipped_files, "failed_files": 0,
+        "sessions": 0, "skipped_sessions": 0, "events": 0, "invalid_lines": 0,
+    }
+    if skipped_files:
+        logger.info(f"检查点中已完成 {skipped_files} 个文件，跳过")
+    if not pending:
+        return totals
+
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=max(workers, 1), initializer=_init_worker) as executor:
+        futures = {executor.submit(import_file, path, batch_sessions): path for path in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                totals["failed_files"] += 1
+                logger.error(f"[{done}/{len(pending)}] {path} 导入失败: {e}")
+                continue
+
+            for key in ("sessions", "skipped_sessions", "events", "invalid_lines"):
+                totals[key] += stats[key]
+            if stats["failed_sessions"]:
+                # 部分会话写入失败的文件不记入检查点，重新运行时已导入的会话会被跳过
+                totals["failed_files"] += 1
+            else:
+                checkpoint.mark_done(path, stats)
+
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"[{done}/{len(pending)}] {path}: 导入 {stats['sessions']} 个会话、{stats['events']} 条记录，"
+                f"跳过已存在 {stats['skipped_sessions']} 个，失败 {stats['failed_sessions']} 个；"
+                f"累计 {totals['events']} 条，{totals['events'] / max(elapsed, 1e-6):.0f} 条/秒"
+            )
+
+    totals["seconds"] = round(time.monotonic() - started, 3)
+    return totals
@@ -0,0 +1,268 @@
+"""
+提示词链完整性校验
+
+按ID顺序逐条读取会话自身的提示词记录，检查：
+- 长度：完整记录的内容长度等于 prompt_length；增量记录的 prompt_length 等于上一条记录长度加片段长度
+- 前缀：完整记录以上一条记录的完整内容开头
+- 哈希：chain_hash 等于由上一条记录的哈希和本次片段重新计算的值
+- 摘要：会话摘要指向的最新提示词在链上
+
+分叉会话从父会话的分叉点开始（父会话的记录在父会话中校验）。迁移前没有哈希的旧记录只检查长度和前缀。
+每个会话的记录只读取一遍，内存中只保留上一条记录的完整内容。
+
+run_verify 按分片分页读取会话ID，分批交给进程池并行校验。
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional, Dict, Any, List, Iterable, Iterator
+
+from sqlalchemy.orm import Session
+
+from database import shard_router, init_database
+from models.prompt_models import SessionModel, PromptModel, SessionSummaryModel
+from core.prompt_chain import PromptChain, chain_hash
+
+logger = logging.getLogger(__name__)
+
+# 流式读取提示词记录时每次取回的行数
+FETCH_ROWS = 200
+
+# 进度日志的最小间隔（秒）
+PROGRESS_INTERVAL = 5.0
+
+
+def verify_rows(
+    session_id: str,
+    rows: Iterable[Any],
+    previous_hash: Optional[str] = None,
+    previous_text: str = "",
+    tip_id: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    校验一个会话按ID排序的提示词记录（需要 id、prompt、is_delta、prompt_length、chain_hash 列）
+
+    previous_hash/previous_text为链起点（分叉点）的哈希和完整内容；tip_id为会话摘要指向的最新提示词ID。
+    返回 {"checked", "unhashed", "last_prompt_id", "tip_found", "broken"}，broken为第一处断链或None
+    """
+    # 上一条记录的完整内容，增量记录以片段列表的形式累积，需要时再拼接
+    parts = [previous_text] if previous_text else []
+    length = len(previous_text)
+    hashed = previous_hash is not None
+    result = {"checked": 0, "unhashed": 0, "last_prompt_id": None, "tip_found": tip_id is None, "broken": None}
+
+    for row in rows:
+        result["checked"] += 1
+        result["last_prompt_id"] = row.id
+        reason = None
+
+        if row.is_delta:
+            fragment = row.prompt
+            if length + len(fragment) != row.prompt_length:
+                reason = "增量记录的长度与上一条记录加片段长度不一致"
+        else:
+            text = row.prompt
+            fragment = text[length:]
+            if len(text) != row.prompt_length:
+                reason = "内容长度与prompt_length不一致"
+            elif length and not text.startswith("".join(parts)):
+                reason = "不是上一条提示词的延续"
+
+        if reason is None:
+            if row.chain_hash is None:
+                if hashed:
+                    reason = "缺少链式哈希"
+                result["unhashed"] += 1
+            else:
+                # 上一条是没有哈希的旧记录时，与追加时一样由其完整内容计算
+                base = previous_hash if previous_hash is not None else (
+                    chain_hash(None, "".join(parts)) if length else None
+                )
+                if row.chain_hash != chain_hash(base, fragment):
+                    reason = "链式哈希不一致"
+                hashed = True
+
+        if reason is not None:
+            result["broken"] = {"session_id": session_id, "prompt_id": row.id, "reason": reason}
+            return result
+
+        previous_hash = row.chain_hash
+        if row.is_delta:
+            parts.append(fragment)
+        else:
+            parts = [text]
+        length = row.prompt_length
+        if row.id == tip_id:
+            result["tip_found"] = True
+
+    return result
+
+
+def _chain_rows(session_id: str, db: Session) -> Iterator[Any]:
+    """按ID顺序流式读取会话自身的提示词记录"""
+    return db.query(
+        PromptModel.id, PromptModel.prompt, PromptModel.is_delta, PromptModel.prompt_length, PromptModel.chain_hash
+    ).filter(
+        PromptModel.session_id == session_id
+    ).order_by(PromptModel.id).yield_per(FETCH_ROWS)
+
+
+def verify_sessions(session_ids: List[str], db: Session, chain: Optional[PromptChain] = None) -> List[Dict[str, Any]]:
+    """
+    校验同一分片中的一批会话，返回每个会话的结果（不存在的会话不返回）
+
+    先读取会话摘要再读取提示词记录，校验期间的并发追加只会使链比摘要更长，不会误报
+    """
+    chain = chain or PromptChain()
+    sessions = {
+        row.session_id: row for row in db.query(
+            SessionModel.session_id, SessionModel.fork_prompt_id
+        ).filter(SessionModel.session_id.in_(session_ids))
+    }
+    tips = dict(db.query(SessionSummaryModel.session_id, SessionSummaryModel.last_prompt_id).filter(
+        SessionSummaryModel.session_id.in_(session_ids)
+    ).all())
+
+    results = []
+    for session_id in session_ids:
+        session = sessions.get(session_id)
+        if session is None:
+            continue
+        tip_id = tips.get(session_id)
+        previous_hash, previous_text = None, ""
+        if session.fork_prompt_id is not None:
+            fork_point = db.get(PromptModel, session.fork_prompt_id)
+            if fork_point is None:
+                results.append({
+                    "session_id": session_id, "checked": 0, "unhashed": 0,
+                    "broken": {"session_id": session_id, "prompt_id": session.fork_prompt_id, "reason": "找不到分叉点的提示词记录"},
+                })
+                continue
+            previous_hash = fork_point.chain_hash
+            previous_text = chain.materialize_one(fork_point, db)
+            if tip_id == fork_point.id:
+                # 分叉后尚未追加，摘要指向分叉点
+                tip_id = None
+
+        result = verify_rows(session_id, _chain_rows(session_id, db), previous_hash, previous_text, tip_id)
+        if result["broken"] is None and not result["tip_found"]:
+            result["broken"] = {"session_id": session_id, "prompt_id": tip_id, "reason": "会话摘要指向的最新提示词不在提示词链上"}
+        results.append({
+            "session_id": session_id,
+            "checked": result["checked"],
+            "unhashed": result["unhashed"],
+            "broken": result["broken"],
+        })
+    return results
+
+
+def verify_session(session_id: str, db: Session, chain: Optional[PromptChain] = None) -> Optional[Dict[str, Any]]:
+    """校验单个会话，会话不存在时返回None"""
+    results = verify_sessions([session_id], db, chain)
+    return results[0] if results else None
+
+
+def _init_worker():
+    """工作进程初始化：丢弃从主进程继承的连接池"""
+    shard_router.after_fork()
+
+
+def verify_batch(session_ids: List[str]) -> Dict[str, Any]:
+    """校验一批同一分片的会话（在工作进程中执行，使用读连接池），返回统计和断链列表"""
+    with shard_router.session_scope(session_ids[0], read=True) as db:
+        results = verify_sessions(session_ids, db)
+    return {
+        "sessions": len(results),
+        "prompts": sum(result["checked"] for result in results),
+        "unhashed": sum(result["unhashed"] for result in results),
+        "broken": [result["broken"] for result in results if result["broken"]],
+    }
+
+
+def _session_batches(batch_sessions: int, session_ids: Optional[List[str]] = None) -> Iterator[List[str]]:
+    """按分片生成会话ID批次；未指定会话时按主键分页读取各分片的全部会话"""
+    if session_ids is not None:
+        by_shard: Dict[int, List[str]] = {}
+        for session_id in session_ids:
+            by_shard.setdefault(shard_router.shard_index(session_id), []).append(session_id)
+        for ids in by_shard.values():
+            for start in range(0, len(ids), batch_sessions):
+                yield ids[start:start + batch_sessions]
+        return
+
+    for manager in shard_router.managers:
+        last_id = 0
+        while True:
+            db = manager.get_read_session()
+            try:
+                rows = db.query(SessionModel.id, SessionModel.session_id).filter(
+                    SessionModel.id > last_id
+                ).order_by(SessionModel.id).limit(batch_sessions).all()
+            finally:
+                db.close()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            yield [row.session_id for row in rows]
+
+
+def run_verify(
+    workers: int = os.cpu_count() or 1,
+    batch_sessions: int = 200,
+    session_ids: Optional[List[str]] = None,
+    report_path: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    并行校验会话的提示词链，返回汇总统计
+
+    断链记录写入report_path（每行一个JSON）；进程池中同时排队的批次数有上限，会话ID分页读取
+    """
+    init_database()
+    batch_sessions = max(batch_sessions, 1)
+    totals = {"sessions": 0, "prompts": 0, "unhashed": 0, "broken": 0, "failed_batches": 0}
+    report = open(report_path, "w", encoding="utf-8") if report_path else None
+    started = last_progress = time.monotonic()
+
+    def collect(future):
+        try:
+            stats = future.result()
+        except Exception as e:
+            totals["failed_batches"] += 1
+            logger.error(f"校验一批会话失败: {e}")
+            return
+        for key in ("sessions", "prompts", "unhashed"):
+            totals[key] += stats[key]
+        for broken in stats["broken"]:
+            totals["broken"] += 1
+            logger.warning(f"会话 {broken['session_id']} 的提示词 {broken['prompt_id']} 断链: {broken['reason']}")
+            if report:
+                report.write(json.dumps(broken, ensure_ascii=False) + "\n")
+
+    try:
+        workers = max(workers, 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            pending = set()
+            for batch in _session_batches(batch_sessions, session_ids):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                pending.add(executor.submit(verify_batch, batch))
+
+                now = time.monotonic()
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    logger.info(
+                        f"已校验 {totals['sessions']} 个会话、{totals['prompts']} 条记录，发现断链 {totals['broken']} 处，"
+                        f"{totals['sessions'] / max(now - started, 1e-6):.0f} 会话/秒"
+                    )
+            for future in pending:
+                collect(future)
+    finally:
+        if report:
+            report.close()
+
+    totals["seconds"] = round(time.monotonic() - started, 3)
+    return totals
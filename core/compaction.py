@@ -0,0 +1,93 @@
+"""
+提示词链压缩
+
+会话完成后，将除最新记录以外的完整提示词记录改写为本次追加的片段（is_delta=1），
+存储量从 O(轮数 × 提示词长度) 降为 O(提示词长度)。压缩前逐条校验记录确实是最终提示词
+的前缀，校验失败时放弃压缩，保持原数据不变。
+"""
+import logging
+from typing import Dict, Any
+from sqlalchemy.orm import Session
+from config.settings import settings
+from models.prompt_models import PromptModel
+from core.session_summary import SessionSummaries
+
+logger = logging.getLogger(__name__)
+
+
+class PromptCompactor:
+    """提示词链压缩器"""
+
+    def __init__(self, summaries: SessionSummaries):
+        self.summaries = summaries
+
+    def compact(self, session_id: str, db: Session) -> Dict[str, Any]:
+        """
+        压缩会话的中间提示词记录并刷新会话摘要
+
+        在一个事务内完成，期间锁定会话摘要行以阻止并发追加
+        """
+        try:
+            summary = self.summaries.lock(session_id, db)
+            if summary is None:
+                return {"success": False, "error": f"会话 {session_id} 不存在"}
+
+            final = db.get(PromptModel, summary.last_prompt_id)
+            if final is None or final.is_delta:
+                return {"success": False, "error": "找不到会话的最新完整提示词"}
+            final_text = final.prompt
+
+            chain = db.query(
+                PromptModel.id, PromptModel.prompt_length, PromptModel.is_delta
+            ).filter(
+                PromptModel.session_id == session_id,
+                PromptModel.id < final.id
+            ).order_by(PromptModel.id).all()
+
+            # 计算每条待压缩记录的片段起点（上一条记录的长度）
+            targets = []
+            previous_length = 0
+            for row in chain:
+                if not row.is_delta and previous_length > 0:
+                    targets.append((row.id, previous_length, row.prompt_length))
+                previous_length = row.prompt_length
+
+            compacted = 0
+            chars_saved = 0
+            batch_size = max(settings.COMPACTION_BATCH_SIZE, 1)
+            for start in range(0, len(targets), batch_size):
+                batch = targets[start:start + batch_size]
+                stored = dict(db.query(PromptModel.id, PromptModel.prompt).filter(
+                    PromptModel.id.in_([prompt_id for prompt_id, _, _ in batch])
+                ).all())
+
+                for prompt_id, fragment_start, length in batch:
+                    text = stored.get(prompt_id)
+                    if text is None or len(text) != length or not final_text.startswith(text):
+                        db.rollback()
+                        logger.error(f"会话 {session_id} 的提示词 {prompt_id} 不是最终提示词的前缀，放弃压缩")
+                        return {"success": False, "error": f"提示词 {prompt_id} 与提示词链不一致"}
+
+                    db.query(PromptModel).filter(PromptModel.id == prompt_id).update(
+                        {PromptModel.prompt: text[fragment_start:], PromptModel.is_delta: True},
+                        synchronize_session=False
+                    )
+                    compacted += 1
+                    chars_saved += fragment_start
+                db.flush()
+
+            self.summaries.rebuild(session_id, db)
+            db.commit()
+
+            logger.info(f"会话 {session_id} 压缩完成: {compacted} 条记录，节省约 {chars_saved} 字符")
+            return {
+                "success": True,
+                "session_id": session_id,
+                "compacted_prompts": compacted,
+                "chars_saved": chars_saved
+            }
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"压缩会话失败: {e}")
+            return {"success": False, "error": str(e)}
@@ -0,0 +1,301 @@
+"""
+事件速率汇总 - 写入时增量维护的分钟桶，过期后合并为小时桶
+
+- 每次追加在同一事务中对 (minute, 分钟桶, 槽位) 行执行一次 "插入或累加"：
+  事件类型计数、追加字节数；会话在该分钟（小时）内的第一次写入计入 active_sessions（hour_active_sessions）。
+  是否第一次由会话摘要中上一次的活动时间判断（摘要行已加锁，同一会话的追加串行执行），因此计数是精确的去重值
+- 槽位按session_id哈希（ROLLUP_SLOTS个），同一分钟的写入分散到多行，读取时按桶求和
+- 后台任务将 ROLLUP_MINUTE_RETENTION_HOURS 之前的分钟桶合并为小时桶后删除，
+  小时桶的活跃会话数为各分钟桶 hour_active_sessions 之和
+
+查询只读取时间范围内的汇总行，行数由时间范围、步长和槽位数决定，与历史数据量无关
+"""
+import asyncio
+import logging
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session
+from config.settings import settings
+from database import increment_counters, shard_router
+from models.prompt_models import EventRollupModel, PromptType
+from core.session_summary import EVENT_COUNT_COLUMNS
+from core.tool_analytics import hour_bucket
+
+logger = logging.getLogger(__name__)
+
+MINUTE = "minute"
+HOUR = "hour"
+
+# 汇总行中累加的列
+SUM_COLUMNS = list(EVENT_COUNT_COLUMNS.values()) + ["bytes_appended", "active_sessions", "hour_active_sessions"]
+
+_STEP_PATTERN = re.compile(r"^(\d+)([smhd]?)$")
+_STEP_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class TimeseriesError(ValueError):
+    """查询参数无效"""
+
+
+def minute_bucket(moment: datetime) -> datetime:
+    """取时间所在的分钟桶起始时间"""
+    return moment.replace(second=0, microsecond=0)
+
+
+def parse_step(step: str) -> int:
+    """
+    解析步长（秒数，或带单位 m/h/d，如 5m、1h），返回秒数
+
+    步长须为整分钟；不小于1小时时须为整小时，以便直接使用小时桶
+    """
+    match = _STEP_PATTERN.match(step.strip().lower())
+    if match is None:
+        raise TimeseriesError(f"无效的步长: {step}")
+    seconds = int(match.group(1)) * _STEP_UNITS[match.group(2)]
+    if seconds <= 0 or seconds % 60:
+        raise TimeseriesError("步长须为整分钟")
+    if seconds >= 3600 and seconds % 3600:
+        raise TimeseriesError("不小于1小时的步长须为整小时")
+    return seconds
+
+
+class EventRollups:
+    """事件速率汇总"""
+
+    @staticmethod
+    def slot(session_id: str) -> int:
+        return zlib.crc32(session_id.encode("utf-8")) % max(settings.ROLLUP_SLOTS, 1)
+
+    def record(
+        self,
+        session_id: str,
+        prompt_type: PromptType,
+        appended_bytes: int,
+        previous_activity: Optional[datetime],
+        db: Session,
+        now: Optional[datetime] = None
+    ):
+        """
+        计入一次追加（不提交事务）
+
+        previous_activity为本次追加前会话的最后活动时间，新会话为None
+        """
+        if not settings.ROLLUP_ENABLED:
+            return
+        now = now or datetime.utcnow()
+        minute = minute_bucket(now)
+        increments = {EVENT_COUNT_COLUMNS[prompt_type]: 1, "bytes_appended": appended_bytes}
+        if previous_activity is None or previous_activity < minute:
+            increments["active_sessions"] = 1
+        if previous_activity is None or previous_activity < hour_bucket(now):
+            increments["hour_active_sessions"] = 1
+        increment_counters(
+            db, EventRollupModel,
+            {"resolution": MINUTE, "bucket_start": minute, "slot": self.slot(session_id)},
+            increments
+        )
+
+    def record_history(self, sessions: List[Tuple[str, List[Tuple[PromptType, int, datetime]]]], db: Session):
+        """
+        计入一批新会话的历史事件 [(session_id, [(类型, 字节数, 时间)])]（批量导入使用，不提交事务）
+
+        先按 (分钟桶, 槽位) 合并，每行只累加一次
+        """
+        if not settings.ROLLUP_ENABLED:
+            return
+        per_bucket: Dict[Tuple[datetime, int], Dict[str, int]] = {}
+        for session_id, events in sessions:
+            slot = self.slot(session_id)
+            seen_minutes = set()
+            seen_hours = set()
+            for prompt_type, appended_bytes, moment in sorted(events, key=lambda event: event[2]):
+                minute = minute_bucket(moment)
+                increments = per_bucket.setdefault((minute, slot), dict.fromkeys(SUM_COLUMNS, 0))
+                if minute not in seen_minutes:
+                    seen_minutes.add(minute)
+                    increments["active_sessions"] += 1
+                if hour_bucket(moment) not in seen_hours:
+                    seen_hours.add(hour_bucket(moment))
+                    increments["hour_active_sessions"] += 1
+                increments[EVENT_COUNT_COLUMNS[prompt_type]] += 1
+                increments["bytes_appended"] += appended_bytes
+
+        # 按主键顺序累加，避免与在线写入死锁
+        for (minute, slot) in sorted(per_bucket):
+            increment_counters(
+                db, EventRollupModel,
+                {"resolution": MINUTE, "bucket_start": minute, "slot": slot},
+                per_bucket[(minute, slot)]
+            )
+
+    # ---- 合并 ----
+
+    @staticmethod
+    def minute_cutoff(now: Optional[datetime] = None) -> datetime:
+        """早于该时间的分钟桶会被合并为小时桶（整小时）"""
+        now = now or datetime.utcnow()
+        return hour_bucket(now - timedelta(hours=settings.ROLLUP_MINUTE_RETENTION_HOURS))
+
+    def compact(self, db: Session, now: Optional[datetime] = None) -> int:
+        """
+        将过期的分钟桶合并为小时桶并删除（每批一个事务），返回合并的分钟桶行数
+        """
+        cutoff = self.minute_cutoff(now)
+        batch_size = max(settings.ROLLUP_COMPACT_BATCH, 1)
+        compacted = 0
+        while True:
+            rows = db.query(EventRollupModel).filter(
+                EventRollupModel.resolution == MINUTE,
+                EventRollupModel.bucket_start < cutoff
+            ).order_by(EventRollupModel.bucket_start, EventRollupModel.slot).limit(batch_size).with_for_update().all()
+            if not rows:
+                return compacted
+
+            per_hour: Dict[Tuple[datetime, int], Dict[str, int]] = {}
+            for row in rows:
+                totals = per_hour.setdefault((hour_bucket(row.bucket_start), row.slot), dict.fromkeys(SUM_COLUMNS, 0))
+                for column in EVENT_COUNT_COLUMNS.values():
+                    totals[column] += getattr(row, column)
+                totals["bytes_appended"] += row.bytes_appended
+                totals["active_sessions"] += row.hour_active_sessions
+                totals["hour_active_sessions"] += row.hour_active_sessions
+
+            # 按主键顺序累加，避免并发合并时的死锁
+            for (bucket_start, slot) in sorted(per_hour):
+                increment_counters(
+                    db, EventRollupModel,
+                    {"resolution": HOUR, "bucket_start": bucket_start, "slot": slot},
+                    per_hour[(bucket_start, slot)]
+                )
+            db.query(EventRollupModel).filter(
+                EventRollupModel.resolution == MINUTE,
+                tuple_(EventRollupModel.bucket_start, EventRollupModel.slot).in_(
+                    [(row.bucket_start, row.slot) for row in rows]
+                )
+            ).delete(synchronize_session=False)
+            db.commit()
+            compacted += len(rows)
+            if len(rows) < batch_size:
+                return compacted
+
+    def compact_all(self) -> int:
+        """合并所有分片的过期分钟桶"""
+        compacted = sum(shard_router.scatter(self.compact))
+        if compacted:
+            logger.info(f"已将 {compacted} 个过期的分钟汇总行合并为小时汇总")
+        return compacted
+
+    async def run_periodically(self):
+        """定期合并（在应用启动时作为后台任务运行）"""
+        if not settings.ROLLUP_ENABLED:
+            return
+
+        while True:
+            await asyncio.sleep(settings.ROLLUP_COMPACT_INTERVAL)
+            try:
+                await asyncio.to_thread(self.compact_all)
+            except Exception as e:
+                logger.error(f"合并事件速率汇总失败: {e}")
+
+    # ---- 查询 ----
+
+    def time_range(
+        self, start: Optional[datetime], end: Optional[datetime], step: int
+    ) -> Tuple[datetime, datetime]:
+        """
+        补全并对齐查询时间范围（默认最近60个点），点数超过 TIMESERIES_MAX_POINTS 时报错
+
+        步长小于1小时时只能使用分钟桶，起始时间不早于分钟桶的保留范围
+        """
+        # 带时区的时间转换为UTC（汇总桶按UTC存储）
+        start, end = (
+            moment.astimezone(timezone.utc).replace(tzinfo=None) if moment and moment.tzinfo else moment
+            for moment in (start, end)
+        )
+        end = end or datetime.utcnow()
+        start = start or end - timedelta(seconds=step * 60)
+        if step < 3600:
+            start = max(start, self.minute_cutoff())
+        # 按步长对齐到整点（从Unix纪元起算）
+        epoch = datetime(1970, 1, 1)
+        start = epoch + timedelta(seconds=int((start - epoch).total_seconds()) // step * step)
+        if end <= start:
+            raise TimeseriesError("结束时间须晚于起始时间")
+        points = -(-int((end - start).total_seconds()) // step)
+        if points > settings.TIMESERIES_MAX_POINTS:
+            raise TimeseriesError(
+                f"查询点数 {points} 超过上限 {settings.TIMESERIES_MAX_POINTS}，请缩小时间范围或增大步长"
+            )
+        return start, end
+
+    def collect(self, db: Session, start: datetime, end: datetime, step: int) -> List[Tuple]:
+        """读取单个分片中时间范围内的汇总行（按粒度和桶合并槽位）"""
+        query = db.query(
+            EventRollupModel.resolution,
+            EventRollupModel.bucket_start,
+            *[func.sum(getattr(EventRollupModel, column)) for column in SUM_COLUMNS]
+        ).filter(
+            EventRollupModel.bucket_start >= start,
+            EventRollupModel.bucket_start < end
+        )
+        # 小时步长同时读取小时桶和尚未合并的分钟桶
+        if step < 3600:
+            query = query.filter(EventRollupModel.resolution == MINUTE)
+        return [tuple(row) for row in query.group_by(EventRollupModel.resolution, EventRollupModel.bucket_start)]
+
+    def summarize(self, start: datetime, end: datetime, step: int, parts: List[List[Tuple]]) -> Dict[str, Any]:
+        """
+        合并各分片的collect结果
+
+        步长为1分钟或1小时时 active_sessions 为精确的去重会话数；
+        其他步长为点内各分钟（小时）去重会话数的峰值
+        """
+        base = 60 if step < 3600 else 3600
+        count = -(-int((end - start).total_seconds()) // step)
+        points = [dict.fromkeys(SUM_COLUMNS[:-1], 0) for _ in range(count)]
+        # 每个基础桶（分钟或小时）的去重会话数
+        active: Dict[datetime, int] = {}
+
+        for part in parts:
+            for resolution, bucket_start, *sums in part:
+                values = dict(zip(SUM_COLUMNS, (int(value or 0) for value in sums)))
+                index = int((bucket_start - start).total_seconds()) // step
+                if not 0 <= index < count:
+                    continue
+                point = points[index]
+                for column in SUM_COLUMNS[:-2]:
+                    point[column] += values[column]
+                if base == 60:
+                    key = bucket_start
+                    active[key] = active.get(key, 0) + values["active_sessions"]
+                else:
+                    key = hour_bucket(bucket_start)
+                    # 小时桶和尚未合并的分钟桶都用 hour_active_sessions 计入所在小时
+                    active[key] = active.get(key, 0) + values["hour_active_sessions"]
+
+        for key, sessions in active.items():
+            point = points[int((key - start).total_seconds()) // step]
+            point["active_sessions"] = max(point["active_sessions"], sessions)
+
+        series = []
+        for index, point in enumerate(points):
+            events = {prompt_type.value: point[column] for prompt_type, column in EVENT_COUNT_COLUMNS.items()}
+            series.append({
+                "bucket_start": start + timedelta(seconds=step * index),
+                "events": events,
+                "events_total": sum(events.values()),
+                "active_sessions": point["active_sessions"],
+                "bytes_appended": point["bytes_appended"],
+            })
+
+        return {
+            "from": start,
+            "to": end,
+            "step": step,
+            "resolution": MINUTE if base == 60 else HOUR,
+            "active_sessions_mode": "exact" if step == base else "peak",
+            "points": series,
+        }
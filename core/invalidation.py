@@ -0,0 +1,152 @@
+"""
+进程间失效通知
+
+多进程部署时，每个worker在同一目录下绑定一个Unix数据报套接字（worker-<pid>.sock），
+publish() 先在本进程执行订阅的处理函数，再把 (类型, 会话ID) 发送给目录中的其他worker。
+消息尽力投递：对方接收缓冲区已满时丢弃并计数，不阻塞请求处理。
+
+当前使用的消息类型：
+- write: 会话刚被写入（读己之写，后续读取走写连接池）
+- invalidate: 会话数据已删除，丢弃内存中的当前提示词缓存
+
+未启动时（单进程）publish() 只在本进程执行处理函数。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 对端列表的刷新间隔（秒）
+PEER_REFRESH_INTERVAL = 1.0
+
+MAX_MESSAGE_BYTES = 4096
+
+
+class InvalidationBus:
+    """基于Unix数据报套接字的进程间失效通知"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._sock: Optional[socket.socket] = None
+        self._directory: Optional[str] = None
+        self._path: Optional[str] = None
+        self._peers: List[str] = []
+        self._peers_refreshed = 0.0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+
+    @property
+    def started(self) -> bool:
+        return self._sock is not None
+
+    def subscribe(self, kind: str, handler: Callable[[str], None]):
+        """订阅一种消息，处理函数可能在接收线程中执行，需要线程安全"""
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind: str, key: str):
+        """在本进程处理消息，并通知其他worker"""
+        self._dispatch(kind, key)
+        if self._sock is not None:
+            self._broadcast(f"{kind}\t{key}".encode("utf-8"))
+
+    def _dispatch(self, kind: str, key: str):
+        for handler in self._handlers.get(kind, ()):
+            try:
+                handler(key)
+            except Exception as e:
+                logger.error(f"处理 {kind} 消息失败: {e}")
+
+    def start(self, directory: str):
+        """绑定本进程的套接字并开始接收（在worker进程中调用）"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"worker-{os.getpid()}.sock")
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        self._directory = directory
+        self._path = path
+        self._sock = sock
+        self._thread = threading.Thread(target=self._receive_loop, args=(sock,), name="invalidation-bus", daemon=True)
+        self._thread.start()
+        logger.info(f"进程间失效通知已启动: {path}")
+
+    def stop(self):
+        sock, self._sock = self._sock, None
+        if sock is None:
+            return
+        sock.close()
+        if self._path and os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def _current_peers(self) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._peers_refreshed >= PEER_REFRESH_INTERVAL:
+                try:
+                    names = os.listdir(self._directory)
+                except FileNotFoundError:
+                    names = []
+                self._peers = [
+                    os.path.join(self._directory, name) for name in names
+                    if name.endswith(".sock") and os.path.join(self._directory, name) != self._path
+                ]
+                self._peers_refreshed = now
+            return list(self._peers)
+
+    def _broadcast(self, message: bytes):
+        sock = self._sock
+        for peer in self._current_peers():
+            try:
+                sock.sendto(message, socket.MSG_DONTWAIT, peer)
+                self.sent += 1
+            except BlockingIOError:
+                self.dropped += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 已退出的worker留下的套接字文件
+                self._forget(peer)
+            except OSError as e:
+                if sock.fileno() == -1:
+                    return
+                self.dropped += 1
+                logger.warning(f"发送失效通知到 {peer} 失败: {e}")
+
+    def _forget(self, peer: str):
+        with self._lock:
+            if peer in self._peers:
+                self._peers.remove(peer)
+        try:
+            os.unlink(peer)
+        except OSError:
+            pass
+
+    def _receive_loop(self, sock: socket.socket):
+        while True:
+            try:
+                data = sock.recv(MAX_MESSAGE_BYTES)
+            except OSError:
+                # 套接字已关闭
+                return
+            kind, _, key = data.decode("utf-8", errors="replace").partition("\t")
+            self.received += 1
+            self._dispatch(kind, key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pid": os.getpid(),
+            "peers": len(self._current_peers()) if self._sock is not None else 0,
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+# 全局失效通知
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,55 @@
+"""
+会话生命周期的后台任务
+
+- 会话结束后在后台压缩提示词链
+- 定期将长时间无活动的会话标记为completed并压缩
+"""
+import asyncio
+import logging
+from config.settings import settings
+from database import shard_router
+from models.prompt_models import SessionStatus
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLifecycle:
+    """会话生命周期后台任务"""
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def compact_in_background(self, session_id: str):
+        """在独立的数据库会话中压缩提示词链（供BackgroundTasks调用）"""
+        if not settings.COMPACTION_ENABLED:
+            return
+
+        with shard_router.session_scope(session_id) as db:
+            self.tracker.compact_session(session_id, db)
+
+    def sweep_idle_sessions(self) -> int:
+        """结束各分片中的空闲会话并压缩，返回处理的会话数"""
+        swept = sum(shard_router.scatter(self._sweep_shard))
+        if swept:
+            logger.info(f"已结束 {swept} 个空闲会话")
+        return swept
+
+    def _sweep_shard(self, db) -> int:
+        session_ids = self.tracker.find_idle_sessions(settings.SESSION_IDLE_TIMEOUT, db)
+        for session_id in session_ids:
+            result = self.tracker.complete_session(session_id, db, SessionStatus.completed)
+            if result["success"] and settings.COMPACTION_ENABLED:
+                self.tracker.compact_session(session_id, db)
+        return len(session_ids)
+
+    async def run_idle_sweeper(self):
+        """定期检查空闲会话（在应用启动时作为后台任务运行）"""
+        if settings.SESSION_IDLE_TIMEOUT <= 0:
+            return
+
+        while True:
+            await asyncio.sleep(settings.SESSION_IDLE_CHECK_INTERVAL)
+            try:
+                await asyncio.to_thread(self.sweep_idle_sessions)
+            except Exception as e:
+                logger.error(f"空闲会话检查失败: {e}")
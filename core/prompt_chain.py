@@ -0,0 +1,137 @@
+"""
+提示词链读取
+
+会话中每条提示词记录都是之后记录的前缀。压缩后的中间记录只存储本次追加的片段
+（is_delta=1），其完整内容由所属会话中最新的完整记录按 prompt_length 截取得到。
+
+分叉会话不复制父会话的记录，而是引用父会话中分叉点及之前的历史（写时复制）：
+会话的历史由自身记录和各祖先会话在分叉点之前的记录按ID顺序组成。
+
+还原时优先使用内存缓存中的会话提示词：同一会话的任意版本都是之后版本的前缀，
+缓存版本不短于待还原记录时可直接截取。
+
+每条记录的 chain_hash 由上一条记录的哈希和本次追加的片段计算（SHA-256），
+相当于对完整提示词的滚动哈希，追加时不需要重新哈希完整内容。
+"""
+import hashlib
+from typing import Optional, List, Sequence, Tuple, Dict
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from models.prompt_models import SessionModel, PromptModel
+from core.prompt_store import PromptCache
+
+# 第一条记录（初始提示词）的上一个哈希
+GENESIS_HASH = bytes(32)
+
+
+def chain_hash(previous: Optional[str], fragment: str) -> str:
+    """
+    计算追加片段后的链式哈希（十六进制）
+
+    previous为上一条记录的哈希，第一条记录为None；片段为存储的文本（大内容为BlobRef引用）
+    """
+    hasher = hashlib.sha256(bytes.fromhex(previous) if previous else GENESIS_HASH)
+    hasher.update(fragment.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def content_length(row) -> int:
+    """
+    展开大内容引用后的提示词长度（提示词记录或会话摘要）
+
+    prompt_length为存储长度（大内容按引用计），迁移前的记录没有content_length时按存储长度计算
+    """
+    return row.content_length if row.content_length is not None else row.prompt_length
+
+
+class PromptChain:
+    """提示词链的读取与还原"""
+
+    def __init__(self, cache: Optional[PromptCache] = None):
+        self.cache = cache
+
+    def latest_snapshot(self, session_id: str, db: Session) -> Optional[PromptModel]:
+        """获取会话中最新的完整（非增量）提示词记录"""
+        return db.query(PromptModel).filter(
+            PromptModel.session_id == session_id,
+            PromptModel.is_delta.is_(False)
+        ).order_by(PromptModel.id.desc()).first()
+
+    def lineage(self, session_id: str, db: Session) -> List[Tuple[str, Optional[int]]]:
+        """
+        获取会话的历史来源: [(会话ID, 可见的最大提示词ID)]
+
+        第一项为会话自身（无上界），之后依次为父会话、祖父会话……，
+        上界取沿途各分叉点的最小值
+        """
+        lineage = [(session_id, None)]
+        bound = None
+        seen = {session_id}
+        current = session_id
+        while True:
+            row = db.query(SessionModel.parent_session_id, SessionModel.fork_prompt_id).filter(
+                SessionModel.session_id == current
+            ).first()
+            if row is None or row.parent_session_id is None or row.parent_session_id in seen:
+                return lineage
+            bound = row.fork_prompt_id if bound is None else min(bound, row.fork_prompt_id)
+            current = row.parent_session_id
+            seen.add(current)
+            lineage.append((current, bound))
+
+    def history_filter(self, session_id: str, db: Session, model=PromptModel, id_column=None):
+        """
+        构建会话历史的过滤条件（含父会话中分叉点之前的记录）
+
+        id_column为与分叉点比较的提示词ID列，默认为model.id（tool_calls等表传入prompt_id）
+        """
+        id_column = id_column if id_column is not None else model.id
+        lineage = self.lineage(session_id, db)
+        if len(lineage) == 1:
+            return model.session_id == session_id
+        return or_(*[
+            model.session_id == source if bound is None
+            else and_(model.session_id == source, id_column <= bound)
+            for source, bound in lineage
+        ])
+
+    def owns(self, session_id: str, prompt_id: int, db: Session) -> Optional[PromptModel]:
+        """返回属于会话历史（含继承部分）的提示词记录，不属于时返回None"""
+        row = db.get(PromptModel, prompt_id)
+        if row is None:
+            return None
+        for source, bound in self.lineage(session_id, db):
+            if row.session_id == source and (bound is None or row.id <= bound):
+                return row
+        return None
+
+    def materialize(self, rows: Sequence[PromptModel], db: Session) -> List[str]:
+        """
+        还原提示词记录的完整内容
+
+        完整记录直接返回；增量记录从所属会话的缓存或最新快照中截取，每个会话的快照在一次调用中只读取一次
+        """
+        texts = []
+        snapshots: Dict[str, str] = {}
+        for row in rows:
+            if not row.is_delta:
+                texts.append(row.prompt)
+                continue
+            snapshot_text = snapshots.get(row.session_id)
+            if snapshot_text is None or len(snapshot_text) < row.prompt_length:
+                snapshot_text = self._snapshot_text(row.session_id, row.prompt_length, db)
+                snapshots[row.session_id] = snapshot_text
+            texts.append(snapshot_text[:row.prompt_length])
+        return texts
+
+    def _snapshot_text(self, session_id: str, min_length: int, db: Session) -> str:
+        """获取会话中不短于min_length的完整提示词"""
+        chunk = self.cache.peek(session_id) if self.cache else None
+        if chunk is not None and chunk.length >= min_length:
+            return chunk.render()
+        snapshot = self.latest_snapshot(session_id, db)
+        return snapshot.prompt if snapshot else ""
+
+    def materialize_one(self, row: PromptModel, db: Session) -> str:
+        """还原单条提示词记录的完整内容"""
+        return self.materialize([row], db)[0]
@@ -0,0 +1,144 @@
+"""
+共享前缀的内存提示词存储
+
+提示词在内存中表示为不可变片段组成的前缀树：每个片段只保存本次追加的文本和指向前缀片段的引用，
+按 (前缀摘要, 文本) 的哈希去重。以相同初始模板、相同前几轮输入开始的会话共享同一组片段，
+N个会话的内存占用与不同内容的总量成正比，而不是 N × 提示词长度；追加只创建一个新片段，不复制前缀。
+
+PromptCache 以会话为单位缓存当前提示词对应的片段，按 prompt_id 校验，过期即重建。
+"""
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict, Any, Sequence
+
+
+class Chunk:
+    """提示词片段（不可变）"""
+
+    __slots__ = ("parent", "text", "length", "digest", "__weakref__")
+
+    def __init__(self, parent: Optional["Chunk"], text: str, digest: str):
+        self.parent = parent
+        self.text = text
+        self.length = (parent.length if parent else 0) + len(text)
+        self.digest = digest
+
+    def render(self) -> str:
+        """拼接出完整提示词"""
+        parts = []
+        node = self
+        while node is not None:
+            parts.append(node.text)
+            node = node.parent
+        parts.reverse()
+        return "".join(parts)
+
+
+class ChunkStore:
+    """片段的去重存储，没有任何会话引用的片段随之释放"""
+
+    def __init__(self):
+        self._chunks: "weakref.WeakValueDictionary[str, Chunk]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def intern(self, parent: Optional[Chunk], text: str) -> Chunk:
+        """获取 parent 之后追加 text 得到的片段，内容相同的片段只保存一份"""
+        hasher = hashlib.sha1(parent.digest.encode("ascii") if parent else b"")
+        hasher.update(text.encode("utf-8"))
+        digest = hasher.hexdigest()
+        with self._lock:
+            chunk = self._chunks.get(digest)
+            if chunk is None:
+                chunk = Chunk(parent, text, digest)
+                self._chunks[digest] = chunk
+            return chunk
+
+    def build(self, text: str, boundaries: Sequence[int]) -> Optional[Chunk]:
+        """按各次追加后的长度切分完整提示词，得到与逐次追加相同的片段链"""
+        chunk = None
+        start = 0
+        for end in boundaries:
+            if end <= start or end > len(text):
+                continue
+            chunk = self.intern(chunk, text[start:end])
+            start = end
+        if start < len(text):
+            chunk = self.intern(chunk, text[start:])
+        return chunk
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            chunks = list(self._chunks.values())
+        return {
+            "chunks": len(chunks),
+            "unique_chars": sum(len(chunk.text) for chunk in chunks)
+        }
+
+
+class PromptCache:
+    """会话当前提示词的LRU缓存，缓存值为片段引用"""
+
+    def __init__(self, max_sessions: int, store: Optional[ChunkStore] = None):
+        self.max_sessions = max_sessions
+        self.store = store or ChunkStore()
+        self._entries: "OrderedDict[str, Tuple[int, Chunk]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id: str, prompt_id: int) -> Optional[Chunk]:
+        """读取缓存，只有缓存的版本与 prompt_id 一致时命中"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] != prompt_id:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, session_id: str) -> Optional[Chunk]:
+        """读取会话缓存的任意版本（不校验版本、不计入命中统计）"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+        return entry[1] if entry else None
+
+    def put(self, session_id: str, prompt_id: int, chunk: Chunk):
+        if self.max_sessions <= 0:
+            return
+        with self._lock:
+            self._entries[session_id] = (prompt_id, chunk)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def extend(self, session_id: str, prompt_id: int, prompt_length: int, fragment: str):
+        """
+        追加提交后更新缓存，为追加的片段创建片段（prompt_length为追加后的完整长度）
+
+        只有缓存版本正是本次追加的前一个版本时才扩展；并发追加的提交顺序不同时，
+        较早的版本不会覆盖缓存中较新的版本，中间缺少版本时保留旧缓存，读取时按版本号重建
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[1].length != prompt_length - len(fragment):
+                return
+            self._entries[session_id] = (prompt_id, self.store.intern(entry[1], fragment))
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = len(self._entries)
+            cached_chars = sum(chunk.length for _, chunk in self._entries.values())
+        return {
+            "sessions": sessions,
+            "cached_chars": cached_chars,
+            **self.store.stats(),
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -1,22 +1,70 @@
 """
 提示词追踪系统核心逻辑 - 重新设计版本
 """
-import re
-import json
+import uuid
 import logging
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List
 from sqlalchemy.orm import Session
+from config.settings import settings
 from models.prompt_models import (
-    SessionModel, PromptModel, ToolCallModel,
-    SessionCreate, PromptCreate, PromptType
+    SessionModel, PromptModel, ToolCallModel, SessionSummaryModel,
+    SessionCreate, PromptCreate, PromptType, SessionStatus
 )
+from core.search_index import SearchIndex
+from core.tool_analytics import ToolCallAnalytics
+from core.event_rollups import EventRollups
+from core.tokenizer import count_tokens, budget_status, get_tokenizer
+from core.session_summary import SessionSummaries, touch_session
+from core.prompt_chain import PromptChain, chain_hash, content_length
+from core.prompt_store import PromptCache, Chunk
+from core.compaction import PromptCompactor
+from core.chain_verify import verify_session
+from core.tag_parser import (
+    extract_end_reason, extract_tool_calls, parse_segments,
+    user_input_fragment, system_marker_fragment, llm_output_fragment, observation_fragment
+)
+from core.blob_store import create_blob_store, blob_ref, contains_blob_ref, BlobResolver
+from core.invalidation import invalidation_bus
+from core.tracing import traced
 
 logger = logging.getLogger(__name__)
 
+# 追加时需要的上一条提示词的元数据列（提示词内容命中缓存时不读取）
+PROMPT_STATE_COLUMNS = (
+    PromptModel.prompt_length,
+    PromptModel.content_length,
+    PromptModel.total_tokens,
+    PromptModel.chain_hash
+)
+
+def _blob_ref_error(*texts: str) -> Optional[Dict[str, Any]]:
+    """
+    写入的内容中包含引用格式的文本时返回错误结果
+
+    读取时提示词中的引用都会被展开，不拒绝的话可以写入其他会话的digest来读取其内容
+    """
+    if any(contains_blob_ref(text) for text in texts):
+        return {
+            "success": False,
+            "error": "内容中不能包含大内容引用<BlobRef>"
+        }
+    return None
+
 class PromptTracker:
     """提示词追踪器"""
     
     def __init__(self):
+        self.search_index = SearchIndex()
+        self.tool_analytics = ToolCallAnalytics()
+        self.event_rollups = EventRollups()
+        self.prompt_cache = PromptCache(settings.PROMPT_CACHE_SESSIONS)
+        # 会话数据在其他worker中被删除时丢弃本进程的缓存
+        invalidation_bus.subscribe("invalidate", self.prompt_cache.invalidate)
+        self.chain = PromptChain(self.prompt_cache)
+        self.summaries = SessionSummaries(self.chain)
+        self.compactor = PromptCompactor(self.summaries)
+        self.blob_store = create_blob_store()
         self.default_initial_prompt = """你是一个全能的AI助手，你能做到任何事情，包括编码、文本生成、交流聊天等。同时你也可以使用你所拥有的工具Tool。
 你所拥有的Tool工具有:
 quark_search: Call this tool to interact with the 夸克搜索 API. What is the 夸克搜索 API useful for? 夸克搜索是一个通用搜索引擎，可用于访问互联网、查询百科知识、了解时事新闻等。 Parameters: [{"name": "search_query", "description": "搜索关键词或短语", "required": true, "schema": {"type": "string"}}] Format the arguments as a JSON object.
@@ -49,6 +97,7 @@ FinalAsnwer:经过深思熟虑后的最终回答
 
 Begin!!!"""
     
+    @traced()
     def create_session(self, session_id: str, initial_prompt: Optional[str] = None, db: Session = None) -> Dict[str, Any]:
         """
         创建新会话并初始化提示词
@@ -56,6 +105,9 @@ Begin!!!"""
         try:
             # 使用提供的初始提示词或默认模板
             prompt = initial_prompt or self.default_initial_prompt
+            rejected = _blob_ref_error(prompt)
+            if rejected:
+                return rejected
             
             # 检查会话是否已存在
             existing_session = db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
@@ -74,15 +126,29 @@ Begin!!!"""
             db.flush()  # 获取session.id
             
             # 记录初始提示词
+            initial_tokens = count_tokens(prompt)
             initial_prompt_record = PromptModel(
                 session_id=session_id,
                 type=PromptType.init,
-                prompt=prompt
+                prompt=prompt,
+                prompt_length=len(prompt),
+                content_length=len(prompt),
+                fragment_tokens=initial_tokens,
+                total_tokens=initial_tokens,
+                chain_hash=chain_hash(None, prompt)
             )
             db.add(initial_prompt_record)
             db.flush()  # 获取prompt.id
             
+            if settings.SEARCH_ENABLED and settings.SEARCH_INDEX_INITIAL_PROMPT:
+                self.search_index.index_fragment(session_id, initial_prompt_record.id, prompt, db)
+            
+            self.summaries.create(session_id, initial_prompt_record, db)
+            self.event_rollups.record(session_id, PromptType.init, len(prompt.encode("utf-8")), None, db)
+            
             db.commit()
+            # 会话ID可能属于已清理的旧会话，丢弃可能残留的缓存（失效通知丢失时兜底）
+            self.prompt_cache.invalidate(session_id)
             
             logger.info(f"会话 {session_id} 创建成功")
             
@@ -91,7 +157,9 @@ Begin!!!"""
                 "session_id": session_id,
                 "session_db_id": session.id,
                 "prompt_id": initial_prompt_record.id,
-                "initial_prompt_length": len(prompt)
+                "initial_prompt_length": len(prompt),
+                "total_tokens": initial_tokens,
+                **budget_status(initial_tokens)
             }
             
         except Exception as e:
@@ -102,92 +170,463 @@ Begin!!!"""
                 "error": str(e)
             }
     
-    def add_user_input(self, session_id: str, user_input: str, db: Session) -> Dict[str, Any]:
+    @traced()
+    def fork_session(
+        self,
+        session_id: str,
+        db: Session,
+        at_prompt_id: Optional[int] = None,
+        new_session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
-        添加用户输入到提示词
+        从会话的任意提示词版本分叉出子会话
+
+        子会话只记录分叉点，通过引用共享父会话中分叉点及之前的历史（不复制提示词内容），
+        之后的追加只写入子会话；at_prompt_id为空时从最新版本分叉
         """
         try:
-            # 获取最新的提示词状态
-            latest_prompt = db.query(PromptModel).filter(
-                PromptModel.session_id == session_id
-            ).order_by(PromptModel.id.desc()).first()
+            # 锁定父会话行，与过期清理互斥（清理中的会话不能再被分叉）
+            parent = db.query(SessionModel).filter(
+                SessionModel.session_id == session_id,
+                SessionModel.status != SessionStatus.purging
+            ).with_for_update().first()
+            if not parent:
+                return {
+                    "success": False,
+                    "error": f"会话 {session_id} 不存在",
+                    "not_found": True
+                }
             
-            if not latest_prompt:
+            new_session_id = new_session_id or uuid.uuid4().hex
+            if db.query(SessionModel.id).filter(SessionModel.session_id == new_session_id).first():
                 return {
                     "success": False,
-                    "error": "找不到会话的提示词历史"
+                    "error": f"会话 {new_session_id} 已存在"
                 }
             
-            # 构建新的完整提示词
-            new_prompt = latest_prompt.prompt + "\n" + f"<UserInput>{user_input}</UserInput>"
+            if at_prompt_id is None:
+                summary = self.summaries.get(session_id, db) or self.summaries.rebuild(session_id, db)
+                fork_point = db.get(PromptModel, summary.last_prompt_id) if summary else None
+            else:
+                fork_point = self.chain.owns(session_id, at_prompt_id, db)
             
-            # 记录新的提示词状态
-            new_prompt_record = PromptModel(
-                session_id=session_id,
-                type=PromptType.user_input,
-                prompt=new_prompt
+            if not fork_point:
+                return {
+                    "success": False,
+                    "error": f"提示词 {at_prompt_id} 不属于会话 {session_id}"
+                }
+            
+            child = SessionModel(
+                session_id=new_session_id,
+                initial_prompt=parent.initial_prompt,
+                parent_session_id=session_id,
+                fork_prompt_id=fork_point.id
             )
-            db.add(new_prompt_record)
+            db.add(child)
             db.flush()
             
+            # 摘要包含继承的历史，活动时间从分叉时刻开始计算
+            summary = self.summaries.rebuild(new_session_id, db)
+            summary.last_activity_at = datetime.utcnow()
+            
             db.commit()
+            self.prompt_cache.invalidate(new_session_id)
             
-            logger.info(f"会话 {session_id} 添加用户输入成功")
+            logger.info(f"会话 {new_session_id} 从会话 {session_id} 的提示词 {fork_point.id} 分叉成功")
             
             return {
                 "success": True,
-                "session_id": session_id,
-                "prompt_id": new_prompt_record.id,
-                "new_prompt_length": len(new_prompt)
+                "session_id": new_session_id,
+                "session_db_id": child.id,
+                "parent_session_id": session_id,
+                "fork_prompt_id": fork_point.id,
+                "prompt_length": content_length(fork_point),
+                "total_tokens": fork_point.total_tokens,
+                **budget_status(fork_point.total_tokens)
             }
             
         except Exception as e:
             db.rollback()
-            logger.error(f"添加用户输入失败: {e}")
+            logger.error(f"分叉会话失败: {e}")
             return {
                 "success": False,
                 "error": str(e)
             }
     
-    def add_system_marker(self, session_id: str, reason: str, db: Session) -> Dict[str, Any]:
+    @traced()
+    def _append_prompt(
+        self,
+        session_id: str,
+        prompt_type: PromptType,
+        fragment: str,
+        db: Session,
+        tool_call_count: int = 0,
+        logical_fragment: Optional[str] = None,
+        event_id: Optional[str] = None
+    ) -> Optional[PromptModel]:
         """
-        添加系统标记（Start/End）到提示词
+        在最新提示词之后追加片段，记录新的完整提示词并更新会话摘要（不提交事务）
+
+        logical_fragment为片段展开内容引用后的实际文本，用于token计数和全文索引；
+        event_id记入会话摘要，用于识别重试；找不到会话的提示词历史时返回None
+        """
+        logical_fragment = fragment if logical_fragment is None else logical_fragment
+        
+        # 锁定会话摘要，同一会话的并发追加在此串行化
+        summary = self.summaries.lock(session_id, db)
+        if summary is None:
+            return None
+        
+        # 按摘要中记录的ID读取最新的提示词状态；缓存命中时只读取元数据列，不读取完整提示词
+        chunk = self.prompt_cache.get(session_id, summary.last_prompt_id)
+        if chunk is not None:
+            latest_prompt = db.query(*PROMPT_STATE_COLUMNS).filter(
+                PromptModel.id == summary.last_prompt_id
+            ).first()
+        else:
+            latest_prompt = db.get(PromptModel, summary.last_prompt_id)
+        
+        if not latest_prompt:
+            return None
+        
+        # 构建新的完整提示词（分叉会话的第一次追加时，最新状态可能是父会话中已压缩的记录）
+        latest_text = chunk.render() if chunk is not None else self.chain.materialize_one(latest_prompt, db)
+        new_prompt = latest_text + fragment
+        
+        # 只对追加的片段计数，累加到上一条记录的token总数
+        previous_tokens = latest_prompt.total_tokens
+        if not previous_tokens and latest_text:
+            # 迁移前的旧记录没有token数，按完整提示词计算一次
+            previous_tokens = count_tokens(latest_text)
+        fragment_tokens = count_tokens(logical_fragment)
+        total_tokens = previous_tokens + fragment_tokens
+        
+        # 链式哈希只对片段计算；迁移前的旧记录没有哈希，按完整提示词计算一次
+        previous_hash = latest_prompt.chain_hash or chain_hash(None, latest_text)
+        
+        # 记录新的提示词状态
+        new_prompt_record = PromptModel(
+            session_id=session_id,
+            type=prompt_type,
+            prompt=new_prompt,
+            prompt_length=len(new_prompt),
+            content_length=content_length(latest_prompt) + len(logical_fragment),
+            fragment_tokens=fragment_tokens,
+            total_tokens=total_tokens,
+            chain_hash=chain_hash(previous_hash, fragment)
+        )
+        db.add(new_prompt_record)
+        db.flush()
+        
+        self._check_token_budget(session_id, previous_tokens, total_tokens)
+        
+        # apply_append会更新最后活动时间，先取出用于活跃会话计数
+        previous_activity = summary.last_activity_at
+        self.summaries.apply_append(summary, new_prompt_record, tool_call_count, event_id)
+        touch_session(session_id, db)
+        self.event_rollups.record(
+            session_id, prompt_type, len(logical_fragment.encode("utf-8")), previous_activity, db
+        )
+        
+        # 只索引本次追加的片段
+        if settings.SEARCH_ENABLED:
+            self.search_index.index_fragment(session_id, new_prompt_record.id, logical_fragment, db)
+        
+        return new_prompt_record
+    
+    def _commit_append(
+        self,
+        session_id: str,
+        record: PromptModel,
+        fragment: str,
+        db: Session,
+        **extra: Any
+    ) -> Dict[str, Any]:
+        """
+        提交追加并更新提示词缓存，返回追加结果
+
+        提交会使记录过期，结果和缓存所需的值在提交前取出，避免提交后重新读取整条记录（含完整提示词）
+        """
+        result = {
+            "success": True,
+            "session_id": session_id,
+            "prompt_id": record.id,
+            "new_prompt_length": record.content_length,
+            "total_tokens": record.total_tokens,
+            **extra,
+            **budget_status(record.total_tokens)
+        }
+        prompt_length = record.prompt_length
+        db.commit()
+        self.prompt_cache.extend(session_id, result["prompt_id"], prompt_length, fragment)
+        return result
+    
+    def _find_duplicate(self, session_id: str, event_id: Optional[str], db: Session) -> Optional[Dict[str, Any]]:
+        """
+        检查事件ID是否已追加过（重试请求），是则返回首次追加的结果
+
+        在会话摘要的行锁下检查，与同一会话的追加互斥；不是重复请求时锁保持到本次追加提交
+        """
+        if not event_id:
+            return None
+        summary = self.summaries.lock(session_id, db)
+        prompt_id = self.summaries.find_event(summary, event_id) if summary else None
+        record = db.get(PromptModel, prompt_id) if prompt_id else None
+        if record is None:
+            return None
+        db.rollback()
+        logger.info(f"会话 {session_id} 的事件 {event_id} 已追加过，返回首次追加结果")
+        return {
+            "success": True,
+            "duplicate": True,
+            "session_id": session_id,
+            "prompt_id": record.id,
+            "new_prompt_length": content_length(record),
+            "total_tokens": record.total_tokens,
+            **budget_status(record.total_tokens)
+        }
+    
+    def _check_token_budget(self, session_id: str, previous_tokens: int, total_tokens: int):
+        """在会话token数首次越过告警线或预算时记录告警日志"""
+        budget = settings.CONTEXT_TOKEN_BUDGET
+        if not budget:
+            return
+        
+        warning_line = int(budget * settings.CONTEXT_TOKEN_WARNING_RATIO)
+        if previous_tokens <= budget < total_tokens:
+            logger.warning(f"会话 {session_id} 的token数 {total_tokens} 已超过上下文预算 {budget}")
+        elif previous_tokens < warning_line <= total_tokens <= budget:
+            logger.warning(f"会话 {session_id} 的token数 {total_tokens} 已接近上下文预算 {budget}")
+    
+    @traced()
+    def get_session_summary(self, session_id: str, db: Session) -> Optional[Dict[str, Any]]:
+        """
+        获取会话摘要
+        """
+        summary = self.summaries.get(session_id, db)
+        if summary is None:
+            summary = self.summaries.rebuild(session_id, db)
+            if summary is None:
+                return None
+            db.commit()
+        return self.summaries.to_dict(summary)
+    
+    @traced()
+    def get_replay(
+        self,
+        session_id: str,
+        db: Session,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        expand_blobs: bool = True,
+        parse: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """
+        获取会话的回放数据：起始提示词和之后每次追加的片段（分叉会话包含继承的历史）
+
+        只读取一次最新的完整提示词，各记录的片段按长度从中截取，数据量与最终提示词长度成正比。
+        指定start时起始提示词为start之前最后一条记录的内容；parse时附带按状态标签解析的片段结构
+        """
+        rows = db.query(
+            PromptModel.id, PromptModel.session_id, PromptModel.type, PromptModel.prompt_length,
+            PromptModel.content_length, PromptModel.fragment_tokens, PromptModel.total_tokens, PromptModel.timestamp
+        ).filter(
+            self.chain.history_filter(session_id, db)
+        ).order_by(PromptModel.id).all()
+        
+        if not rows:
+            return None
+        
+        # 每条记录都是最新记录的前缀
+        text = self.chain.materialize_one(db.get(PromptModel, rows[-1].id), db)
+        resolver = BlobResolver(self.blob_store, db) if expand_blobs else None
+        
+        def render(fragment: str) -> Dict[str, Any]:
+            fragment = resolver.expand(fragment) if resolver else fragment
+            rendered = {"fragment": fragment}
+            if parse:
+                rendered["segments"] = parse_segments(fragment)
+            return rendered
+        
+        base = 0
+        if start is not None:
+            while base + 1 < len(rows) and rows[base + 1].timestamp and rows[base + 1].timestamp < start:
+                base += 1
+        initial = rows[base]
+        origin = initial.timestamp
+        
+        events = []
+        for previous, row in zip(rows[base:], rows[base + 1:]):
+            if end is not None and row.timestamp and row.timestamp >= end:
+                break
+            events.append({
+                "prompt_id": row.id,
+                "type": row.type,
+                "timestamp": row.timestamp,
+                "elapsed_ms": int((row.timestamp - origin).total_seconds() * 1000) if row.timestamp and origin else None,
+                "inherited": row.session_id != session_id,
+                **render(text[previous.prompt_length:row.prompt_length]),
+                "fragment_tokens": row.fragment_tokens,
+                "total_tokens": row.total_tokens,
+            })
+        
+        last = rows[base + len(events)]
+        return {
+            "session_id": session_id,
+            "initial": {
+                "prompt_id": initial.id,
+                "type": initial.type,
+                "timestamp": initial.timestamp,
+                "inherited": initial.session_id != session_id,
+                **render(text[:initial.prompt_length]),
+                "total_tokens": initial.total_tokens,
+            },
+            "events": events,
+            "final": {
+                "prompt_id": last.id,
+                "prompt_length": content_length(last) if expand_blobs else last.prompt_length,
+                "total_tokens": last.total_tokens,
+                "events": len(events),
+            },
+        }
+    
+    @traced()
+    def verify_chain(self, session_id: str, db: Session) -> Optional[Dict[str, Any]]:
+        """
+        校验会话提示词链的完整性（长度、前缀和链式哈希）
+        """
+        result = verify_session(session_id, db, self.chain)
+        if result is None:
+            return None
+        return {
+            "session_id": session_id,
+            "valid": result["broken"] is None,
+            "checked_prompts": result["checked"],
+            "unhashed_prompts": result["unhashed"],
+            "broken": result["broken"]
+        }
+    
+    @traced()
+    def get_token_usage(self, session_id: str, db: Session) -> Optional[Dict[str, Any]]:
+        """
+        获取会话的token曲线（只读取元数据列，分叉会话包含继承的历史）
+        """
+        rows = db.query(
+            PromptModel.id, PromptModel.type, PromptModel.timestamp,
+            PromptModel.fragment_tokens, PromptModel.total_tokens
+        ).filter(
+            self.chain.history_filter(session_id, db)
+        ).order_by(PromptModel.id).all()
+        
+        if not rows:
+            return None
+        
+        budget = settings.CONTEXT_TOKEN_BUDGET
+        warning_line = budget * settings.CONTEXT_TOKEN_WARNING_RATIO
+        curve = []
+        warning_at = None
+        exceeded_at = None
+        for row in rows:
+            curve.append({
+                "prompt_id": row.id,
+                "type": row.type,
+                "timestamp": row.timestamp,
+                "fragment_tokens": row.fragment_tokens,
+                "total_tokens": row.total_tokens
+            })
+            if budget and warning_at is None and row.total_tokens >= warning_line:
+                warning_at = row.id
+            if budget and exceeded_at is None and row.total_tokens > budget:
+                exceeded_at = row.id
+        
+        total_tokens = rows[-1].total_tokens
+        return {
+            "session_id": session_id,
+            "tokenizer": get_tokenizer().name,
+            "total_tokens": total_tokens,
+            **budget_status(total_tokens),
+            "warning_at_prompt_id": warning_at,
+            "exceeded_at_prompt_id": exceeded_at,
+            "curve": curve
+        }
+    
+    @traced()
+    def add_user_input(
+        self, session_id: str, user_input: str, db: Session, event_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        添加用户输入到提示词
         """
         try:
-            # 获取最新的提示词状态
-            latest_prompt = db.query(PromptModel).filter(
-                PromptModel.session_id == session_id
-            ).order_by(PromptModel.id.desc()).first()
+            rejected = _blob_ref_error(user_input)
+            if rejected:
+                return rejected
+            
+            duplicate = self._find_duplicate(session_id, event_id, db)
+            if duplicate:
+                return duplicate
+            
+            fragment = user_input_fragment(user_input)
+            new_prompt_record = self._append_prompt(
+                session_id, PromptType.user_input, fragment, db,
+                event_id=event_id
+            )
             
-            if not latest_prompt:
+            if not new_prompt_record:
                 return {
                     "success": False,
-                    "error": "找不到会话的提示词历史"
+                    "error": f"会话 {session_id} 不存在",
+                    "not_found": True
                 }
             
-            # 构建新的完整提示词
-            marker = f"<Start><SessionId>{session_id}</SessionId><Reason>{reason}</Reason></Start>"
-            new_prompt = latest_prompt.prompt + "\n" + marker
+            result = self._commit_append(session_id, new_prompt_record, fragment, db)
             
-            # 记录新的提示词状态
-            new_prompt_record = PromptModel(
-                session_id=session_id,
-                type=PromptType.system_marker,
-                prompt=new_prompt
+            logger.info(f"会话 {session_id} 添加用户输入成功")
+            
+            return result
+            
+        except Exception as e:
+            db.rollback()
+            logger.error(f"添加用户输入失败: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    @traced()
+    def add_system_marker(
+        self, session_id: str, reason: str, db: Session, event_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        添加系统标记（Start/End）到提示词
+        """
+        try:
+            rejected = _blob_ref_error(reason)
+            if rejected:
+                return rejected
+            
+            duplicate = self._find_duplicate(session_id, event_id, db)
+            if duplicate:
+                return duplicate
+            
+            fragment = system_marker_fragment(session_id, reason)
+            new_prompt_record = self._append_prompt(
+                session_id, PromptType.system_marker, fragment, db,
+                event_id=event_id
             )
-            db.add(new_prompt_record)
-            db.flush()
             
-            db.commit()
+            if not new_prompt_record:
+                return {
+                    "success": False,
+                    "error": f"会话 {session_id} 不存在",
+                    "not_found": True
+                }
+            
+            result = self._commit_append(session_id, new_prompt_record, fragment, db)
             
             logger.info(f"会话 {session_id} 添加系统标记成功")
             
-            return {
-                "success": True,
-                "session_id": session_id,
-                "prompt_id": new_prompt_record.id,
-                "new_prompt_length": len(new_prompt)
-            }
+            return result
             
         except Exception as e:
             db.rollback()
@@ -197,36 +636,38 @@ Begin!!!"""
                 "error": str(e)
             }
     
-    def add_llm_output(self, session_id: str, llm_output: str, db: Session) -> Dict[str, Any]:
+    @traced()
+    def add_llm_output(
+        self, session_id: str, llm_output: str, db: Session, event_id: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         添加LLM输出到提示词
         """
         try:
-            # 获取最新的提示词状态
-            latest_prompt = db.query(PromptModel).filter(
-                PromptModel.session_id == session_id
-            ).order_by(PromptModel.id.desc()).first()
+            rejected = _blob_ref_error(llm_output)
+            if rejected:
+                return rejected
             
-            if not latest_prompt:
-                return {
-                    "success": False,
-                    "error": "找不到会话的提示词历史"
-                }
+            duplicate = self._find_duplicate(session_id, event_id, db)
+            if duplicate:
+                return duplicate
             
-            # 构建新的完整提示词
-            new_prompt = latest_prompt.prompt + "\n" + llm_output
+            # 提取工具调用信息
+            tool_calls = self._extract_tool_calls(llm_output)
             
-            # 记录新的提示词状态
-            new_prompt_record = PromptModel(
-                session_id=session_id,
-                type=PromptType.llm_output,
-                prompt=new_prompt
+            fragment = llm_output_fragment(llm_output)
+            new_prompt_record = self._append_prompt(
+                session_id, PromptType.llm_output, fragment, db,
+                tool_call_count=len(tool_calls), event_id=event_id
             )
-            db.add(new_prompt_record)
-            db.flush()
             
-            # 提取工具调用信息
-            tool_calls = self._extract_tool_calls(llm_output)
+            if not new_prompt_record:
+                return {
+                    "success": False,
+                    "error": f"会话 {session_id} 不存在",
+                    "not_found": True
+                }
+            
             for tool_call in tool_calls:
                 tool_call_record = ToolCallModel(
                     session_id=session_id,
@@ -237,70 +678,269 @@ Begin!!!"""
                 )
                 db.add(tool_call_record)
             
-            db.commit()
+            # 增量更新工具调用汇总
+            self.tool_analytics.record(tool_calls, db)
+            
+            # 以FinalAsnwer结束的输出自动完成会话
+            session_completed = False
+            if settings.SESSION_AUTO_COMPLETE and extract_end_reason(llm_output) == "FinalAsnwer":
+                self._set_session_status(session_id, SessionStatus.completed, db)
+                session_completed = True
+            
+            result = self._commit_append(
+                session_id, new_prompt_record, fragment, db,
+                tool_calls_extracted=len(tool_calls),
+                session_completed=session_completed
+            )
             
             logger.info(f"会话 {session_id} 添加LLM输出成功")
             
+            return result
+            
+        except Exception as e:
+            db.rollback()
+            logger.error(f"添加LLM输出失败: {e}")
             return {
-                "success": True,
-                "session_id": session_id,
-                "prompt_id": new_prompt_record.id,
-                "new_prompt_length": len(new_prompt),
-                "tool_calls_extracted": len(tool_calls)
+                "success": False,
+                "error": str(e)
             }
+    
+    @traced()
+    def add_observation(
+        self,
+        session_id: str,
+        observation: str,
+        db: Session,
+        tool_name: Optional[str] = None,
+        tool_call_id: Optional[int] = None,
+        event_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        添加工具执行结果（Observation）到提示词
+
+        超过阈值的内容只在内容存储中保存一次，提示词链中保留引用；
+        同时关联到对应的工具调用记录并记录调用耗时
+        """
+        try:
+            rejected = _blob_ref_error(observation)
+            if rejected:
+                return rejected
+            
+            duplicate = self._find_duplicate(session_id, event_id, db)
+            if duplicate:
+                return duplicate
+            
+            blob = None
+            stored_content = observation
+            if len(observation) > settings.OBSERVATION_INLINE_MAX_CHARS:
+                blob = self.blob_store.put(observation, db)
+                stored_content = blob_ref(blob)
+            
+            fragment = observation_fragment(stored_content)
+            new_prompt_record = self._append_prompt(
+                session_id, PromptType.observation, fragment, db,
+                logical_fragment=observation_fragment(observation),
+                event_id=event_id
+            )
+            
+            if not new_prompt_record:
+                return {
+                    "success": False,
+                    "error": f"会话 {session_id} 不存在",
+                    "not_found": True
+                }
+            
+            tool_call = self._link_observation(session_id, new_prompt_record, db, tool_name, tool_call_id)
+            
+            result = self._commit_append(
+                session_id, new_prompt_record, fragment, db,
+                blob_digest=blob,
+                tool_call_id=tool_call.id if tool_call else None,
+                tool_latency_ms=tool_call.latency_ms if tool_call else None
+            )
+            
+            logger.info(f"会话 {session_id} 添加Observation成功")
+            
+            return result
             
         except Exception as e:
             db.rollback()
-            logger.error(f"添加LLM输出失败: {e}")
+            logger.error(f"添加Observation失败: {e}")
             return {
                 "success": False,
                 "error": str(e)
             }
     
-    def get_current_prompt(self, session_id: str, db: Session) -> Optional[str]:
+    def _link_observation(
+        self,
+        session_id: str,
+        record: PromptModel,
+        db: Session,
+        tool_name: Optional[str] = None,
+        tool_call_id: Optional[int] = None
+    ) -> Optional[ToolCallModel]:
+        """
+        将Observation关联到最早一个尚未收到结果的工具调用（不提交事务）
+        """
+        query = db.query(ToolCallModel).filter(
+            ToolCallModel.session_id == session_id,
+            ToolCallModel.observation_prompt_id.is_(None)
+        )
+        if tool_call_id is not None:
+            query = query.filter(ToolCallModel.id == tool_call_id)
+        if tool_name:
+            query = query.filter(ToolCallModel.tool_name == tool_name)
+        
+        tool_call = query.order_by(ToolCallModel.id).with_for_update().first()
+        if tool_call is None:
+            return None
+        
+        observed_at = datetime.utcnow()
+        tool_call.observation_prompt_id = record.id
+        tool_call.observed_at = observed_at
+        if tool_call.created_at:
+            tool_call.latency_ms = int((observed_at - tool_call.created_at).total_seconds() * 1000)
+        return tool_call
+    
+    @traced()
+    def get_current_prompt(self, session_id: str, db: Session, expand_blobs: bool = True) -> Optional[str]:
         """
         获取会话的当前完整提示词
+
+        优先读取内存中的共享前缀缓存，缓存版本与会话摘要中的最新ID不一致时从数据库重建
         """
         try:
-            latest_prompt = db.query(PromptModel).filter(
-                PromptModel.session_id == session_id
-            ).order_by(PromptModel.id.desc()).first()
-            
-            return latest_prompt.prompt if latest_prompt else None
+            summary = self.summaries.get(session_id, db)
+            if summary:
+                chunk = self.prompt_cache.get(session_id, summary.last_prompt_id)
+                if chunk is None:
+                    latest_prompt = db.get(PromptModel, summary.last_prompt_id)
+                    if not latest_prompt:
+                        return None
+                    chunk = self._load_prompt_chunk(session_id, latest_prompt, db)
+                text = chunk.render() if chunk else ""
+            else:
+                latest_prompt = db.query(PromptModel).filter(
+                    PromptModel.session_id == session_id
+                ).order_by(PromptModel.id.desc()).first()
+                if not latest_prompt:
+                    return None
+                text = self.chain.materialize_one(latest_prompt, db)
+            
+            if expand_blobs:
+                text = BlobResolver(self.blob_store, db).expand(text)
+            return text
             
         except Exception as e:
             logger.error(f"获取当前提示词失败: {e}")
             return None
     
-    def _extract_tool_calls(self, text: str) -> List[Dict[str, Any]]:
-        """从文本中提取工具调用信息"""
-        tool_calls = []
-        
-        # 提取Action信息
-        action_pattern = r'<Action><ToolName>(.*?)</ToolName><Description>(.*?)</Description></Action>'
-        action_matches = re.findall(action_pattern, text, re.DOTALL)
-        
-        # 提取ActionInput信息
-        action_input_pattern = r'<ActionInput><ToolName>(.*?)</ToolName><Arguments>(.*?)</Arguments></ActionInput>'
-        action_input_matches = re.findall(action_input_pattern, text, re.DOTALL)
-        
-        # 合并Action和ActionInput信息
-        for i, (tool_name, description) in enumerate(action_matches):
-            tool_call = {
-                "tool_name": tool_name.strip(),
-                "description": description.strip(),
-                "arguments": {}
-            }
+    def _load_prompt_chunk(self, session_id: str, latest_prompt: PromptModel, db: Session) -> Optional[Chunk]:
+        """
+        从数据库加载会话的当前提示词并放入缓存
+
+        按历史中每次追加后的长度切分，得到与逐次追加相同的片段，从而与其他会话共享相同的前缀
+        """
+        text = self.chain.materialize_one(latest_prompt, db)
+        boundaries = [row.prompt_length for row in db.query(PromptModel.prompt_length).filter(
+            self.chain.history_filter(session_id, db),
+            PromptModel.id <= latest_prompt.id
+        ).order_by(PromptModel.id)]
+        chunk = self.prompt_cache.store.build(text, boundaries)
+        if chunk is not None:
+            self.prompt_cache.put(session_id, latest_prompt.id, chunk)
+        return chunk
+    
+    def render_prompts(self, rows: List[PromptModel], db: Session, expand_blobs: bool = True) -> List[str]:
+        """
+        还原提示词记录的完整内容
+
+        压缩后的记录只存储增量片段，需从所属会话的最新快照截取；expand_blobs时展开大内容引用
+        """
+        texts = self.chain.materialize(rows, db)
+        if expand_blobs:
+            resolver = BlobResolver(self.blob_store, db)
+            texts = [resolver.expand(text) for text in texts]
+        return texts
+    
+    def get_blob(self, digest: str, db: Session) -> Optional[str]:
+        """
+        读取大内容存储中的内容
+        """
+        return BlobResolver(self.blob_store, db).get(digest)
+    
+    def _set_session_status(self, session_id: str, status: SessionStatus, db: Session) -> int:
+        """更新会话状态（不提交事务），返回更新的行数；清理中的会话不更新"""
+        return db.query(SessionModel).filter(
+            SessionModel.session_id == session_id,
+            SessionModel.status != SessionStatus.purging
+        ).update(
+            {SessionModel.status: status, SessionModel.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+    
+    @traced()
+    def complete_session(self, session_id: str, db: Session, status: SessionStatus = SessionStatus.completed) -> Dict[str, Any]:
+        """
+        结束会话（completed或error）
+        """
+        try:
+            if status not in (SessionStatus.completed, SessionStatus.error):
+                return {
+                    "success": False,
+                    "error": "结束会话的状态只能是completed或error"
+                }
             
-            # 查找对应的ActionInput
-            for input_tool_name, arguments_str in action_input_matches:
-                if input_tool_name.strip() == tool_name.strip():
-                    try:
-                        tool_call["arguments"] = json.loads(arguments_str.strip())
-                    except json.JSONDecodeError:
-                        tool_call["arguments"] = {"raw": arguments_str.strip()}
-                    break
+            if not self._set_session_status(session_id, status, db):
+                return {
+                    "success": False,
+                    "error": f"会话 {session_id} 不存在",
+                    "not_found": True
+                }
             
-            tool_calls.append(tool_call)
-        
-        return tool_calls
+            db.commit()
+            # 已结束的会话不再追加，释放各worker中缓存的当前提示词
+            invalidation_bus.publish("invalidate", session_id)
+            
+            logger.info(f"会话 {session_id} 已结束: {status.value}")
+            
+            return {
+                "success": True,
+                "session_id": session_id,
+                "status": status.value
+            }
+            
+        except Exception as e:
+            db.rollback()
+            logger.error(f"结束会话失败: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    @traced()
+    def compact_session(self, session_id: str, db: Session) -> Dict[str, Any]:
+        """
+        压缩已结束会话的中间提示词记录，成功后丢弃各worker中缓存的当前提示词
+        """
+        result = self.compactor.compact(session_id, db)
+        if result["success"]:
+            invalidation_bus.publish("invalidate", session_id)
+        return result
+    
+    def find_idle_sessions(self, idle_seconds: int, db: Session, limit: int = 100) -> List[str]:
+        """
+        查找超过指定时间无活动的active会话
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=idle_seconds)
+        rows = db.query(SessionModel.session_id).join(
+            SessionSummaryModel, SessionSummaryModel.session_id == SessionModel.session_id
+        ).filter(
+            SessionModel.status == SessionStatus.active,
+            SessionSummaryModel.last_activity_at < cutoff
+        ).limit(limit).all()
+        return [row.session_id for row in rows]
+    
+    def _extract_tool_calls(self, text: str) -> List[Dict[str, Any]]:
+        """从文本中提取工具调用信息"""
+        return extract_tool_calls(text)
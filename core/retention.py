@@ -0,0 +1,219 @@
+"""
+数据保留 - 分批清理过期会话
+
+以会话为单位清理已结束且最后活动时间早于保留期限的会话，分两步：
+1. 在一个短事务中锁定会话摘要、确认会话仍已过期且没有分叉子会话，将会话状态置为purging并删除摘要。
+   之后的追加、分叉和结束请求都按会话不存在处理（404），不会再写入该会话
+2. 按主键顺序分批删除其倒排索引、工具调用、提示词记录，最后删除会话行。每批在独立的短事务中执行，
+   批之间暂停，不会长时间锁住热表；中途中断时下次清理会继续处理状态为purging的会话
+
+blobs（按内容寻址、可能被其他会话共享）、tool_call_rollups 和 event_rollups（按时间汇总的统计）保留，不随会话清理。
+
+prompts 的主键只有 id，MySQL分区表要求分区列包含在每个唯一键中，因此不使用分区，
+统一采用按主键分批删除。仍被分叉会话引用的会话在子会话清理之前保留。
+"""
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
+from sqlalchemy.orm import Session, aliased
+from config.settings import settings
+from database import shard_router
+from core.invalidation import invalidation_bus
+from models.prompt_models import (
+    SessionModel, PromptModel, ToolCallModel, SearchTermModel, SessionSummaryModel, SessionStatus
+)
+
+logger = logging.getLogger(__name__)
+
+# 按会话分批删除的明细表，依次清理
+PURGE_TABLES = [
+    ("search_terms", SearchTermModel),
+    ("tool_calls", ToolCallModel),
+    ("prompts", PromptModel),
+]
+
+
+class RetentionManager:
+    """过期会话清理"""
+
+    def __init__(self):
+        self._run_lock = threading.Lock()
+        self._progress_lock = threading.Lock()
+        self._progress: Dict[str, Any] = {"state": "idle"}
+
+    def progress(self) -> Dict[str, Any]:
+        """当前或最近一次清理的进度"""
+        with self._progress_lock:
+            return {
+                **self._progress,
+                "rows_deleted": dict(self._progress.get("rows_deleted", {})),
+                "retention_days": settings.RETENTION_DAYS,
+            }
+
+    def _update(self, **changes):
+        with self._progress_lock:
+            self._progress.update(changes)
+
+    def _count(self, key: str, amount: int = 1, table: Optional[str] = None):
+        with self._progress_lock:
+            if table is None:
+                self._progress[key] = self._progress.get(key, 0) + amount
+            else:
+                counts = self._progress.setdefault(key, {})
+                counts[table] = counts.get(table, 0) + amount
+
+    def purge(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        清理所有分片中的过期会话，已有清理在进行时直接返回其进度
+        """
+        if settings.RETENTION_DAYS <= 0:
+            return self.progress()
+        if not self._run_lock.acquire(blocking=False):
+            return self.progress()
+
+        try:
+            cutoff = (now or datetime.utcnow()) - timedelta(days=settings.RETENTION_DAYS)
+            with self._progress_lock:
+                self._progress = {
+                    "state": "running",
+                    "cutoff": cutoff,
+                    "started_at": datetime.utcnow(),
+                    "finished_at": None,
+                    "sessions_found": 0,
+                    "sessions_purged": 0,
+                    "sessions_skipped": 0,
+                    "rows_deleted": {},
+                    "error": None,
+                }
+            shard_router.scatter(lambda db: self._purge_shard(db, cutoff))
+            self._update(state="completed", finished_at=datetime.utcnow())
+            progress = self.progress()
+            logger.info(
+                f"数据清理完成: 清理 {progress['sessions_purged']} 个会话，删除 {progress['rows_deleted']}"
+            )
+        except Exception as e:
+            self._update(state="failed", finished_at=datetime.utcnow(), error=str(e))
+            logger.error(f"数据清理失败: {e}")
+        finally:
+            self._run_lock.release()
+        return self.progress()
+
+    def _purge_shard(self, db: Session, cutoff: datetime):
+        # 先继续上次中断的清理
+        for session_id in self._purging_sessions(db):
+            self._delete_details(db, session_id)
+            self._count("sessions_purged")
+
+        while True:
+            session_ids = self._expired_sessions(db, cutoff)
+            if not session_ids:
+                return
+            self._count("sessions_found", len(session_ids))
+            purged_any = False
+            for session_id in session_ids:
+                if self._purge_session(db, session_id, cutoff):
+                    self._count("sessions_purged")
+                    purged_any = True
+                else:
+                    self._count("sessions_skipped")
+            if not purged_any:
+                return
+
+    @staticmethod
+    def _purging_sessions(db: Session) -> List[str]:
+        """已标记为清理中的会话（上次清理中断时遗留）"""
+        rows = db.query(SessionModel.session_id).filter(SessionModel.status == SessionStatus.purging).all()
+        db.rollback()
+        return [row.session_id for row in rows]
+
+    def _expired_sessions(self, db: Session, cutoff: datetime) -> List[str]:
+        """已结束、最后活动早于期限且没有分叉子会话的会话"""
+        child = aliased(SessionModel)
+        has_children = db.query(child.id).filter(child.parent_session_id == SessionModel.session_id).exists()
+        rows = db.query(SessionModel.session_id).join(
+            SessionSummaryModel, SessionSummaryModel.session_id == SessionModel.session_id
+        ).filter(
+            SessionSummaryModel.last_activity_at < cutoff,
+            SessionModel.status.in_([SessionStatus.completed, SessionStatus.error]),
+            ~has_children
+        ).order_by(SessionSummaryModel.last_activity_at).limit(max(settings.RETENTION_BATCH_SIZE, 1)).all()
+        db.rollback()
+        return [row.session_id for row in rows]
+
+    def _purge_session(self, db: Session, session_id: str, cutoff: datetime) -> bool:
+        """
+        清理一个会话：先在一个事务中标记为清理中并删除摘要，再分批删除明细
+
+        锁定会话摘要与追加互斥，锁定会话行与分叉互斥；会话已被重新使用或有了子会话时放弃（不删除任何数据）
+        """
+        summary = db.query(SessionSummaryModel.last_activity_at).filter(
+            SessionSummaryModel.session_id == session_id
+        ).with_for_update().first()
+        if summary is None or summary.last_activity_at >= cutoff:
+            db.rollback()
+            return False
+
+        marked = db.query(SessionModel).filter(
+            SessionModel.session_id == session_id,
+            SessionModel.status.in_([SessionStatus.completed, SessionStatus.error])
+        ).update({SessionModel.status: SessionStatus.purging}, synchronize_session=False)
+        has_children = db.query(SessionModel.id).filter(
+            SessionModel.parent_session_id == session_id
+        ).with_for_update().first() is not None
+        if not marked or has_children:
+            db.rollback()
+            return False
+
+        db.query(SessionSummaryModel).filter(SessionSummaryModel.session_id == session_id).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        # 丢弃各worker中该会话的提示词缓存
+        invalidation_bus.publish("invalidate", session_id)
+
+        self._delete_details(db, session_id)
+        return True
+
+    def _delete_details(self, db: Session, session_id: str):
+        """按主键顺序分批删除清理中会话的明细，最后删除会话行"""
+        batch_size = max(settings.RETENTION_BATCH_SIZE, 1)
+        for table, model in PURGE_TABLES:
+            while True:
+                ids = [row.id for row in db.query(model.id).filter(
+                    model.session_id == session_id
+                ).order_by(model.id).limit(batch_size).all()]
+                if not ids:
+                    db.commit()
+                    break
+                db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+                db.commit()
+                self._count("rows_deleted", len(ids), table)
+                self._pause()
+
+        db.query(SessionModel).filter(
+            SessionModel.session_id == session_id,
+            SessionModel.status == SessionStatus.purging
+        ).delete(synchronize_session=False)
+        db.commit()
+        self._count("rows_deleted", 1, "sessions")
+
+    @staticmethod
+    def _pause():
+        """批之间暂停，限制清理对在线写入的影响"""
+        if settings.RETENTION_BATCH_PAUSE > 0:
+            time.sleep(settings.RETENTION_BATCH_PAUSE)
+
+    async def run_periodically(self):
+        """定期清理（在应用启动时作为后台任务运行）"""
+        if settings.RETENTION_DAYS <= 0:
+            return
+
+        while True:
+            await asyncio.sleep(settings.RETENTION_CHECK_INTERVAL)
+            try:
+                await asyncio.to_thread(self.purge)
+            except Exception as e:
+                logger.error(f"数据清理失败: {e}")
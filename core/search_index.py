@@ -0,0 +1,152 @@
+"""
+提示词全文检索 - 写入时维护的倒排索引
+
+每次追加只索引新追加的片段（而不是完整提示词），索引规模随提示词总长度线性增长。
+分词规则：ASCII字母数字按单词切分并转为小写，中日韩文字按相邻二元组（bigram）切分，
+索引时同时记录单字，使单字查询也能命中多字词中的字。
+"""
+import re
+from typing import Optional, Dict, Any, List, Set, Tuple
+from sqlalchemy import insert, func, desc
+from sqlalchemy.orm import Session
+from models.prompt_models import PromptModel, SearchTermModel
+from core.tag_parser import parse_segments
+
+# 单个词项的最大长度（与 search_terms.term 列宽一致）
+MAX_TERM_LENGTH = 64
+
+_TOKEN_PATTERN = re.compile(
+    r'[0-9a-z_]+'
+    r'|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+'
+)
+
+
+def tokenize(text: str, unigrams: bool = False) -> List[str]:
+    """
+    将文本切分为词项
+
+    ASCII单词整体作为一个词项；CJK连续文字切分为bigram，单字成词时保留单字；
+    unigrams为True时（建索引）同时输出多字文字中的每个单字
+    """
+    terms = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group(0)
+        if token[0].isascii():
+            terms.append(token[:MAX_TERM_LENGTH])
+        elif len(token) == 1:
+            terms.append(token)
+        else:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+            if unigrams:
+                terms.extend(token)
+    return terms
+
+
+class SearchIndex:
+    """提示词倒排索引"""
+
+    def index_fragment(
+        self,
+        session_id: str,
+        prompt_id: int,
+        fragment: str,
+        db: Session
+    ) -> int:
+        """
+        为追加的片段建立索引（不提交事务）
+
+        同一提示词记录中 (词项, 标签, 工具) 只记录一次，返回写入的倒排项数量
+        """
+        rows = self.posting_rows(session_id, prompt_id, self.postings(fragment))
+        if rows:
+            db.execute(insert(SearchTermModel), rows)
+        return len(rows)
+
+    @staticmethod
+    def postings(fragment: str) -> Set[Tuple[str, str, Optional[str]]]:
+        """片段中的 (词项, 标签, 工具) 集合"""
+        postings: Set[Tuple[str, str, Optional[str]]] = set()
+        for segment in parse_segments(fragment):
+            for term in tokenize(segment["content"], unigrams=True):
+                postings.add((term, segment["tag"], segment["tool_name"]))
+        return postings
+
+    @staticmethod
+    def posting_rows(
+        session_id: str, prompt_id: int, postings: Set[Tuple[str, str, Optional[str]]]
+    ) -> List[Dict[str, Any]]:
+        """倒排项转换为 search_terms 的插入行"""
+        return [
+            {
+                "term": term,
+                "session_id": session_id,
+                "prompt_id": prompt_id,
+                "tag": tag,
+                "tool_name": tool_name,
+            }
+            for term, tag, tool_name in postings
+        ]
+
+    def search(
+        self,
+        query: str,
+        db: Session,
+        tag: Optional[str] = None,
+        tool_name: Optional[str] = None,
+        session_id: Optional[str] = None,
+        limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        """
+        检索同时包含查询中所有词项的提示词片段，按提示词ID倒序返回
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+
+        matches = db.query(
+            SearchTermModel.session_id,
+            SearchTermModel.prompt_id,
+            SearchTermModel.tag,
+            SearchTermModel.tool_name,
+        ).filter(SearchTermModel.term.in_(terms))
+
+        if tag:
+            matches = matches.filter(SearchTermModel.tag == tag)
+        if tool_name:
+            matches = matches.filter(SearchTermModel.tool_name == tool_name)
+        if session_id:
+            matches = matches.filter(SearchTermModel.session_id == session_id)
+
+        matches = matches.group_by(
+            SearchTermModel.session_id,
+            SearchTermModel.prompt_id,
+            SearchTermModel.tag,
+            SearchTermModel.tool_name,
+        ).having(
+            func.count(func.distinct(SearchTermModel.term)) == len(terms)
+        ).order_by(desc(SearchTermModel.prompt_id)).limit(limit).all()
+
+        if not matches:
+            return []
+
+        # 补充提示词类型和时间（只查询元数据列）
+        prompt_ids = {match.prompt_id for match in matches}
+        prompt_meta = {
+            row.id: row
+            for row in db.query(
+                PromptModel.id, PromptModel.type, PromptModel.timestamp
+            ).filter(PromptModel.id.in_(prompt_ids)).all()
+        }
+
+        results = []
+        for match in matches:
+            meta = prompt_meta.get(match.prompt_id)
+            results.append({
+                "session_id": match.session_id,
+                "prompt_id": match.prompt_id,
+                "prompt_type": meta.type if meta else None,
+                "tag": match.tag,
+                "tool_name": match.tool_name,
+                "timestamp": meta.timestamp if meta else None,
+            })
+        return results
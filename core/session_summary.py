@@ -0,0 +1,166 @@
+"""
+会话摘要 - 每次追加时在同一事务中维护的会话级反范式数据
+
+会话列表、统计面板只需读取 session_summaries 中每个会话的一行，
+无需扫描 prompts 表；追加时对摘要行加锁，同一会话的并发追加因此串行化。
+分叉会话的摘要包含从父会话继承的历史。
+"""
+from datetime import datetime
+from typing import Optional, Dict, Any
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from config.settings import settings
+from models.prompt_models import (
+    SessionModel, PromptModel, ToolCallModel, SessionSummaryModel, PromptType, SessionStatus
+)
+from core.prompt_chain import PromptChain, content_length
+
+# 摘要中各事件类型的计数列
+EVENT_COUNT_COLUMNS = {prompt_type: f"{prompt_type.value}_count" for prompt_type in PromptType}
+
+
+class SessionSummaries:
+    """会话摘要维护"""
+
+    def __init__(self, chain: PromptChain):
+        self.chain = chain
+
+    def create(self, session_id: str, initial_record: PromptModel, db: Session) -> SessionSummaryModel:
+        """为新会话创建摘要（不提交事务）"""
+        summary = SessionSummaryModel(
+            session_id=session_id,
+            last_prompt_id=initial_record.id,
+            init_count=1,
+            user_input_count=0,
+            system_marker_count=0,
+            llm_output_count=0,
+            observation_count=0,
+            prompt_length=initial_record.prompt_length,
+            content_length=initial_record.content_length,
+            total_tokens=initial_record.total_tokens,
+            tool_call_count=0,
+            last_activity_at=datetime.utcnow()
+        )
+        db.add(summary)
+        return summary
+
+    def lock(self, session_id: str, db: Session) -> Optional[SessionSummaryModel]:
+        """
+        读取并锁定会话摘要（SELECT ... FOR UPDATE）
+
+        早于摘要表创建的会话没有摘要行，此时从 prompts 重建一次；会话不存在时返回None
+        """
+        summary = db.query(SessionSummaryModel).filter(
+            SessionSummaryModel.session_id == session_id
+        ).with_for_update().first()
+
+        if summary is None:
+            summary = self.rebuild(session_id, db)
+        return summary
+
+    def get(self, session_id: str, db: Session) -> Optional[SessionSummaryModel]:
+        """读取会话摘要（不加锁）"""
+        return db.query(SessionSummaryModel).filter(
+            SessionSummaryModel.session_id == session_id
+        ).first()
+
+    def apply_append(
+        self,
+        summary: SessionSummaryModel,
+        record: PromptModel,
+        tool_call_count: int = 0,
+        event_id: Optional[str] = None
+    ):
+        """将一次追加计入摘要，event_id记入最近事件ID（只保留 EVENT_ID_WINDOW 个）"""
+        column = EVENT_COUNT_COLUMNS[record.type]
+        setattr(summary, column, (getattr(summary, column) or 0) + 1)
+        summary.last_prompt_id = record.id
+        summary.prompt_length = record.prompt_length
+        summary.content_length = record.content_length
+        summary.total_tokens = record.total_tokens
+        summary.tool_call_count = (summary.tool_call_count or 0) + tool_call_count
+        summary.last_activity_at = datetime.utcnow()
+        if event_id:
+            recent = list(summary.recent_event_ids or [])
+            recent.append([event_id, record.id])
+            summary.recent_event_ids = recent[-max(settings.EVENT_ID_WINDOW, 1):]
+
+    @staticmethod
+    def find_event(summary: SessionSummaryModel, event_id: str) -> Optional[int]:
+        """查找最近事件ID对应的提示词ID"""
+        for recent_id, prompt_id in reversed(summary.recent_event_ids or []):
+            if recent_id == event_id:
+                return prompt_id
+        return None
+
+    def rebuild(self, session_id: str, db: Session) -> Optional[SessionSummaryModel]:
+        """
+        从 prompts 和 tool_calls 重新计算会话摘要（不提交事务）
+
+        分叉会话同时统计父会话中分叉点之前的记录；会话不存在或正在清理时返回None
+        """
+        session = db.query(SessionModel.status).filter(SessionModel.session_id == session_id).first()
+        if session is None or session.status == SessionStatus.purging:
+            return None
+        history = self.chain.history_filter(session_id, db)
+        counts = dict(db.query(PromptModel.type, func.count(PromptModel.id)).filter(
+            history
+        ).group_by(PromptModel.type).all())
+
+        if not counts:
+            return None
+
+        latest = db.query(
+            PromptModel.id, PromptModel.prompt_length, PromptModel.content_length,
+            PromptModel.total_tokens, PromptModel.timestamp
+        ).filter(
+            history
+        ).order_by(PromptModel.id.desc()).first()
+
+        tool_call_count = db.query(func.count(ToolCallModel.id)).filter(
+            self.chain.history_filter(session_id, db, ToolCallModel, ToolCallModel.prompt_id)
+        ).scalar() or 0
+
+        summary = db.query(SessionSummaryModel).filter(
+            SessionSummaryModel.session_id == session_id
+        ).with_for_update().first()
+        if summary is None:
+            summary = SessionSummaryModel(session_id=session_id)
+            db.add(summary)
+
+        for prompt_type, column in EVENT_COUNT_COLUMNS.items():
+            setattr(summary, column, counts.get(prompt_type, 0))
+        summary.last_prompt_id = latest.id
+        summary.prompt_length = latest.prompt_length
+        summary.content_length = latest.content_length
+        summary.total_tokens = latest.total_tokens
+        summary.tool_call_count = tool_call_count
+        summary.last_activity_at = latest.timestamp
+        db.flush()
+        return summary
+
+    @staticmethod
+    def to_dict(summary: SessionSummaryModel) -> Dict[str, Any]:
+        """摘要转换为响应字典"""
+        event_counts = {
+            prompt_type.value: getattr(summary, column) or 0
+            for prompt_type, column in EVENT_COUNT_COLUMNS.items()
+        }
+        return {
+            "session_id": summary.session_id,
+            "last_prompt_id": summary.last_prompt_id,
+            "event_counts": event_counts,
+            "event_count": sum(event_counts.values()),
+            "prompt_length": content_length(summary),
+            "total_tokens": summary.total_tokens,
+            "tool_call_count": summary.tool_call_count,
+            "last_activity_at": summary.last_activity_at,
+        }
+
+
+def touch_session(session_id: str, db: Session, moment: Optional[datetime] = None):
+    """更新会话的updated_at，已结束的会话有新的追加时重新置为active（不提交事务）"""
+    db.query(SessionModel).filter(SessionModel.session_id == session_id).update(
+        {SessionModel.updated_at: moment or datetime.utcnow(), SessionModel.status: SessionStatus.active},
+        synchronize_session=False
+    )
@@ -0,0 +1,117 @@
+"""
+提示词标签解析
+
+将提示词片段按状态标签（<Thought>、<Action>、<Observation>等）切分为片段列表，
+提取工具调用，以及构建各类事件追加到提示词中的片段
+"""
+import re
+import json
+from typing import List, Dict, Any, Optional
+
+# 提示词语法中的状态标签
+STATE_TAGS = (
+    "UserInput", "Thought", "UserInteraction", "Action", "ActionInput",
+    "Observation", "FinalAsnwer", "Start", "End",
+)
+
+# 不属于任何状态标签的文本
+PLAIN_TEXT = "Text"
+
+_SEGMENT_PATTERN = re.compile(
+    r'<(' + '|'.join(STATE_TAGS) + r')>(.*?)</\1>',
+    re.DOTALL
+)
+_TOOL_NAME_PATTERN = re.compile(r'<ToolName>(.*?)</ToolName>', re.DOTALL)
+_REASON_PATTERN = re.compile(r'<Reason>(.*?)</Reason>', re.DOTALL)
+_ACTION_PATTERN = re.compile(r'<Action><ToolName>(.*?)</ToolName><Description>(.*?)</Description></Action>', re.DOTALL)
+_ACTION_INPUT_PATTERN = re.compile(
+    r'<ActionInput><ToolName>(.*?)</ToolName><Arguments>(.*?)</Arguments></ActionInput>', re.DOTALL
+)
+
+
+def user_input_fragment(user_input: str) -> str:
+    return "\n" + f"<UserInput>{user_input}</UserInput>"
+
+
+def system_marker_fragment(session_id: str, reason: str) -> str:
+    return "\n" + f"<Start><SessionId>{session_id}</SessionId><Reason>{reason}</Reason></Start>"
+
+
+def llm_output_fragment(llm_output: str) -> str:
+    return "\n" + llm_output
+
+
+def observation_fragment(observation: str) -> str:
+    return "\n" + f"<Observation>{observation}</Observation>"
+
+
+def parse_segments(text: str) -> List[Dict[str, Optional[str]]]:
+    """
+    将文本切分为状态标签片段
+
+    返回 [{"tag": 标签名, "content": 标签内文本, "tool_name": 工具名}]，
+    标签之外的非空白文本以 PLAIN_TEXT 作为标签名；Action/ActionInput 会额外解析工具名
+    """
+    segments = []
+    position = 0
+
+    for match in _SEGMENT_PATTERN.finditer(text):
+        leading = text[position:match.start()]
+        if leading.strip():
+            segments.append({"tag": PLAIN_TEXT, "content": leading.strip(), "tool_name": None})
+
+        tag, content = match.group(1), match.group(2)
+        tool_name = None
+        if tag in ("Action", "ActionInput"):
+            tool_match = _TOOL_NAME_PATTERN.search(content)
+            if tool_match:
+                tool_name = tool_match.group(1).strip()
+
+        segments.append({"tag": tag, "content": content, "tool_name": tool_name})
+        position = match.end()
+
+    trailing = text[position:]
+    if trailing.strip():
+        segments.append({"tag": PLAIN_TEXT, "content": trailing.strip(), "tool_name": None})
+
+    return segments
+
+
+
+def extract_end_reason(text: str) -> Optional[str]:
+    """提取文本中最后一个<End>标签的结束原因，没有<End>标签时返回None"""
+    reason = None
+    for segment in parse_segments(text):
+        if segment["tag"] == "End":
+            reason_match = _REASON_PATTERN.search(segment["content"])
+            reason = reason_match.group(1).strip() if reason_match else ""
+    return reason
+
+
+def extract_tool_calls(text: str) -> List[Dict[str, Any]]:
+    """从LLM输出中提取工具调用信息（Action与同名工具的ActionInput配对）"""
+    tool_calls = []
+    action_input_matches = _ACTION_INPUT_PATTERN.findall(text)
+    
+    for tool_name, description in _ACTION_PATTERN.findall(text):
+        tool_call = {
+            "tool_name": tool_name.strip(),
+            "description": description.strip(),
+            "arguments": {},
+            "arguments_status": "missing"
+        }
+        
+        # 查找对应的ActionInput
+        for input_tool_name, arguments_str in action_input_matches:
+            if input_tool_name.strip() == tool_name.strip():
+                try:
+                    tool_call["arguments"] = json.loads(arguments_str.strip())
+                    tool_call["arguments_status"] = "ok"
+                except json.JSONDecodeError:
+                    tool_call["arguments"] = {"raw": arguments_str.strip()}
+                    tool_call["arguments_status"] = "parse_error"
+                break
+        
+        tool_calls.append(tool_call)
+    
+    return tool_calls
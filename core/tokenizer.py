@@ -0,0 +1,109 @@
+"""
+提示词token计数
+
+提供可插拔的分词器接口，默认使用离线的近似分词器：
+- 中日韩文字每个字计为1个token
+- ASCII单词/数字每4个字符计为1个token（向上取整）
+- 其他标点符号每个计为1个token，空白不计数
+
+可通过配置 TOKENIZER=tiktoken:<encoding> 使用 tiktoken（可选依赖），
+或调用 set_tokenizer() 注入自定义实现。
+"""
+import re
+import logging
+from typing import Callable, Dict, Optional, Protocol
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# ASCII单词整体匹配，其余非空白字符（中日韩文字、标点）逐个匹配
+_APPROX_PATTERN = re.compile(r'(?P<word>[A-Za-z0-9_]+)|\S')
+
+
+class Tokenizer(Protocol):
+    """分词器接口"""
+    name: str
+
+    def count(self, text: str) -> int:
+        """返回文本的token数"""
+        ...
+
+
+class ApproximateTokenizer:
+    """离线近似分词器"""
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        tokens = 0
+        for match in _APPROX_PATTERN.finditer(text):
+            word = match.group("word")
+            tokens += (len(word) + 3) // 4 if word else 1
+        return tokens
+
+
+class TiktokenTokenizer:
+    """基于tiktoken的分词器（可选依赖）"""
+
+    def __init__(self, encoding: str = "cl100k_base"):
+        import tiktoken
+        self._encoding = tiktoken.get_encoding(encoding)
+        self.name = f"tiktoken:{encoding}"
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+_factories: Dict[str, Callable[[str], Tokenizer]] = {
+    "approx": lambda option: ApproximateTokenizer(),
+    "tiktoken": lambda option: TiktokenTokenizer(option or "cl100k_base"),
+}
+_tokenizer: Optional[Tokenizer] = None
+
+
+def register_tokenizer(name: str, factory: Callable[[str], Tokenizer]):
+    """注册分词器工厂，配置值为 name 或 name:option"""
+    _factories[name] = factory
+
+
+def set_tokenizer(tokenizer: Tokenizer):
+    """直接设置当前使用的分词器"""
+    global _tokenizer
+    _tokenizer = tokenizer
+
+
+def get_tokenizer() -> Tokenizer:
+    """获取当前分词器，首次调用时按配置创建，创建失败时回退到近似分词器"""
+    global _tokenizer
+    if _tokenizer is None:
+        name, _, option = settings.TOKENIZER.partition(":")
+        try:
+            _tokenizer = _factories[name](option)
+        except Exception as e:
+            logger.warning(f"分词器 {settings.TOKENIZER} 初始化失败，使用近似分词器: {e}")
+            _tokenizer = ApproximateTokenizer()
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """使用当前分词器计算token数"""
+    return get_tokenizer().count(text)
+
+
+def budget_status(total_tokens: int) -> Dict[str, object]:
+    """
+    计算会话相对上下文预算的使用情况
+
+    warning 为 None、"approaching"（超过告警比例）或 "exceeded"（超过预算）
+    """
+    budget = settings.CONTEXT_TOKEN_BUDGET
+    ratio = total_tokens / budget if budget else 0.0
+    warning = None
+    if budget and total_tokens > budget:
+        warning = "exceeded"
+    elif budget and ratio >= settings.CONTEXT_TOKEN_WARNING_RATIO:
+        warning = "approaching"
+    return {
+        "context_budget": budget,
+        "budget_used_ratio": round(ratio, 4),
+        "budget_warning": warning,
+    }
@@ -0,0 +1,178 @@
+"""
+工具调用统计 - 写入时增量维护的汇总表
+
+- tool_call_rollups: 按 (小时, 工具) 汇总调用次数、参数解析失败次数
+- session_summaries.tool_call_count: 每个会话的工具调用次数（由会话摘要维护），用于计算分布
+
+查询只读取汇总表，不扫描 tool_calls 明细表。每会话调用次数分布覆盖全部历史和全部工具，
+需要按 tool_call_count 索引扫描会话摘要表，只在未指定时间范围和工具过滤时返回
+"""
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import increment_counters
+from models.prompt_models import ToolCallRollupModel, SessionSummaryModel
+
+# 单次查询允许的最大时间范围（小时桶数量上限）
+MAX_RANGE_HOURS = 31 * 24
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    """取时间所在的小时桶起始时间"""
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class ToolCallAnalytics:
+    """工具调用统计"""
+
+    def record(self, tool_calls: List[Dict[str, Any]], db: Session, now: Optional[datetime] = None):
+        """
+        累加一次LLM输出中提取到的工具调用（不提交事务）
+        """
+        if not tool_calls:
+            return
+
+        bucket = hour_bucket(now or datetime.utcnow())
+
+        per_tool: Dict[str, Dict[str, int]] = {}
+        for tool_call in tool_calls:
+            counters = per_tool.setdefault(
+                tool_call["tool_name"],
+                {"calls": 0, "parse_failures": 0, "missing_arguments": 0}
+            )
+            counters["calls"] += 1
+            if tool_call.get("arguments_status") == "parse_error":
+                counters["parse_failures"] += 1
+            elif tool_call.get("arguments_status") == "missing":
+                counters["missing_arguments"] += 1
+
+        # 按主键顺序更新，避免并发写入时的死锁
+        for tool_name in sorted(per_tool):
+            increment_counters(
+                db, ToolCallRollupModel,
+                {"bucket_start": bucket, "tool_name": tool_name},
+                per_tool[tool_name]
+            )
+
+    def query(
+        self,
+        db: Session,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        tool_name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        查询时间范围内的工具调用汇总（默认最近24小时），未指定过滤条件时附带每会话调用次数分布
+        """
+        with_distribution = start is None and end is None and tool_name is None
+        start, end = self.time_range(start, end)
+        return self.summarize(start, end, [self.collect(db, start, end, tool_name, with_distribution)])
+
+    @staticmethod
+    def time_range(start: Optional[datetime], end: Optional[datetime]) -> Tuple[datetime, datetime]:
+        """补全查询时间范围，最长 MAX_RANGE_HOURS 小时"""
+        end = end or datetime.utcnow()
+        start = start or end - timedelta(hours=24)
+        if end - start > timedelta(hours=MAX_RANGE_HOURS):
+            start = end - timedelta(hours=MAX_RANGE_HOURS)
+        return start, end
+
+    def collect(
+        self,
+        db: Session,
+        start: datetime,
+        end: datetime,
+        tool_name: Optional[str] = None,
+        with_distribution: bool = False
+    ) -> Dict[str, Any]:
+        """读取单个数据库（分片）中的小时汇总，with_distribution为True时附带每会话调用次数直方图（全部历史）"""
+        rollups = db.query(ToolCallRollupModel).filter(
+            ToolCallRollupModel.bucket_start >= hour_bucket(start),
+            ToolCallRollupModel.bucket_start <= end
+        )
+        if tool_name:
+            rollups = rollups.filter(ToolCallRollupModel.tool_name == tool_name)
+
+        part = {
+            "rollups": [
+                (row.bucket_start, row.tool_name, row.calls, row.parse_failures, row.missing_arguments)
+                for row in rollups
+            ],
+        }
+        if with_distribution:
+            histogram_rows = db.query(
+                SessionSummaryModel.tool_call_count,
+                func.count(SessionSummaryModel.session_id)
+            ).group_by(SessionSummaryModel.tool_call_count).all()
+            part["histogram"] = {int(calls): int(count) for calls, count in histogram_rows}
+        return part
+
+    def summarize(self, start: datetime, end: datetime, parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """合并一个或多个分片的collect结果"""
+        buckets: Dict[Tuple[datetime, str], List[int]] = {}
+        histogram: Dict[int, int] = {}
+        for part in parts:
+            for bucket_start, tool, calls, parse_failures, missing_arguments in part["rollups"]:
+                bucket = buckets.setdefault((bucket_start, tool), [0, 0, 0])
+                bucket[0] += calls
+                bucket[1] += parse_failures
+                bucket[2] += missing_arguments
+            for calls, count in part.get("histogram", {}).items():
+                histogram[calls] = histogram.get(calls, 0) + count
+
+        per_hour = []
+        totals: Dict[str, Dict[str, Any]] = {}
+        for (bucket_start, tool), (calls, parse_failures, missing_arguments) in sorted(buckets.items()):
+            per_hour.append({
+                "bucket_start": bucket_start,
+                "tool_name": tool,
+                "calls": calls,
+                "parse_failures": parse_failures,
+                "missing_arguments": missing_arguments,
+            })
+            total = totals.setdefault(tool, {"calls": 0, "parse_failures": 0, "missing_arguments": 0})
+            total["calls"] += calls
+            total["parse_failures"] += parse_failures
+            total["missing_arguments"] += missing_arguments
+
+        for total in totals.values():
+            total["parse_failure_rate"] = total["parse_failures"] / total["calls"] if total["calls"] else 0.0
+
+        result = {
+            "from": start,
+            "to": end,
+            "per_hour": per_hour,
+            "tools": totals,
+        }
+        if any("histogram" in part for part in parts):
+            result["calls_per_session"] = self._session_distribution(histogram)
+        return result
+
+    def _session_distribution(self, histogram: Dict[int, int]) -> Dict[str, Any]:
+        """由每会话调用次数直方图计算分布（全部历史）"""
+        histogram = dict(sorted(histogram.items()))
+
+        total_calls = sum(calls * count for calls, count in histogram.items())
+        session_count = sum(histogram.values())
+
+        def percentile(fraction: float) -> int:
+            if not session_count:
+                return 0
+            target = fraction * session_count
+            seen = 0
+            for calls in sorted(histogram):
+                seen += histogram[calls]
+                if seen >= target:
+                    return calls
+            return max(histogram)
+
+        return {
+            "sessions": session_count,
+            "mean": total_calls / session_count if session_count else 0.0,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": max(histogram) if histogram else 0,
+            "histogram": histogram,
+        }
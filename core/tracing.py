@@ -0,0 +1,395 @@
+"""
+链路追踪（兼容OpenTelemetry/W3C Trace Context）
+
+- 根span由API中间件根据请求头 traceparent 创建：上游已采样时跟随上游，否则按 TRACE_SAMPLE_RATE 抽样
+- PromptTracker 方法（traced装饰器）和SQL执行在当前span下创建子span
+- 未采样的请求不创建任何span，开销只有一次上下文变量读取
+- 结束的span进入有界队列，由后台线程批量交给导出器（stdout/file，或 "模块:类" 形式的自定义导出器）
+
+导出格式为每行一个span的JSON，字段名与OTLP JSON一致（traceId、spanId、parentSpanId、startTimeUnixNano等）。
+跨分片并行查询在线程池中执行，其SQL不计入当前链路。
+"""
+import functools
+import importlib
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Callable, Tuple, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# 队列中的span达到该数量时立即导出
+EXPORT_BATCH_SIZE = 512
+
+# 记录的SQL语句最大长度
+MAX_STATEMENT_CHARS = 2000
+
+SPAN_KINDS = {
+    "internal": "SPAN_KIND_INTERNAL",
+    "server": "SPAN_KIND_SERVER",
+    "client": "SPAN_KIND_CLIENT",
+}
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """解析 traceparent 请求头，返回 (trace_id, parent_span_id, sampled)，格式无效时返回None"""
+    if not value:
+        return None
+    match = TRACEPARENT_RE.match(value.strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+class Span:
+    """一个已采样的span"""
+
+    __slots__ = (
+        "name", "kind", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+        "attributes", "status", "status_message"
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str = "internal",
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        self.status = "unset"
+        self.status_message: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.status = "error"
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            tracer.processor.on_end(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS.get(self.kind, SPAN_KINDS["internal"]),
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": {"code": "STATUS_CODE_ERROR" if self.status == "error" else "STATUS_CODE_UNSET"},
+            "resource": {"service.name": settings.TRACE_SERVICE_NAME},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """当前请求的span，未采样时为None"""
+    return _current_span.get()
+
+
+# ---- 导出器 ----
+
+class SpanExporter:
+    """导出器接口：export() 在后台线程中调用"""
+
+    def export(self, spans: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class ConsoleSpanExporter(SpanExporter):
+    """每行一个JSON写到标准输出"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def export(self, spans: List[Dict[str, Any]]):
+        self.stream.write("".join(json.dumps(span, ensure_ascii=False) + "\n" for span in spans))
+        self.stream.flush()
+
+
+class FileSpanExporter(SpanExporter):
+    """每行一个JSON追加到文件（多worker时按进程号区分文件）"""
+
+    def __init__(self, path: str):
+        if settings.API_WORKERS > 1:
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{os.getpid()}{ext}"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: List[Dict[str, Any]]):
+        self._file.write("".join(json.dumps(span, ensure_ascii=False) + "\n" for span in spans))
+        self._file.flush()
+
+    def shutdown(self):
+        self._file.close()
+
+
+class NoopSpanExporter(SpanExporter):
+    def export(self, spans: List[Dict[str, Any]]):
+        pass
+
+
+def create_exporter(spec: str) -> SpanExporter:
+    """按配置创建导出器：stdout、file、none，或 "模块:类"（无参构造的SpanExporter子类）"""
+    if spec == "stdout":
+        return ConsoleSpanExporter()
+    if spec == "file":
+        return FileSpanExporter(settings.TRACE_FILE)
+    if spec == "none":
+        return NoopSpanExporter()
+    module_name, _, class_name = spec.partition(":")
+    if not class_name:
+        raise ValueError(f"不支持的链路导出器: {spec}")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class BatchSpanProcessor:
+    """结束的span进入有界队列，后台线程按 TRACE_EXPORT_INTERVAL 或攒够一批时导出"""
+
+    def __init__(self, max_queue: int, interval: float):
+        self._queue: "deque[Span]" = deque()
+        self.max_queue = max_queue
+        self.interval = interval
+        self._exporter: Optional[SpanExporter] = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self.exported = 0
+        self.dropped = 0
+
+    def set_exporter(self, exporter: SpanExporter):
+        with self._lock:
+            previous, self._exporter = self._exporter, exporter
+        if previous is not None:
+            previous.shutdown()
+
+    def on_end(self, span: Span):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(span)
+        self._ensure_thread()
+        if len(self._queue) >= EXPORT_BATCH_SIZE:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # fork出的worker进程中需要重新启动导出线程
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """导出队列中的全部span"""
+        with self._lock:
+            if self._exporter is None:
+                self._exporter = create_exporter(settings.TRACE_EXPORTER)
+            spans = []
+            while self._queue:
+                spans.append(self._queue.popleft().to_dict())
+            if not spans:
+                return
+            try:
+                self._exporter.export(spans)
+                self.exported += len(spans)
+            except Exception as e:
+                self.dropped += len(spans)
+                logger.warning(f"导出 {len(spans)} 个span失败: {e}")
+
+    def shutdown(self):
+        self.flush()
+        if self._exporter is not None:
+            self._exporter.shutdown()
+
+
+# ---- 追踪器 ----
+
+class Tracer:
+    """创建span并维护当前span"""
+
+    def __init__(self):
+        self.processor = BatchSpanProcessor(settings.TRACE_QUEUE_SIZE, settings.TRACE_EXPORT_INTERVAL)
+
+    @property
+    def enabled(self) -> bool:
+        return settings.TRACING_ENABLED
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, kind: str = "server",
+                    attributes: Optional[Dict[str, Any]] = None) -> Optional[Span]:
+        """
+        开始一条链路的本地根span，未采样时返回None
+
+        上游带有效traceparent时沿用其trace_id并以其span为父span；
+        TRACE_PARENT_BASED 开启时是否采样跟随上游的采样标志
+        """
+        if not settings.TRACING_ENABLED:
+            return None
+        parent = parse_traceparent(traceparent)
+        if parent is not None and settings.TRACE_PARENT_BASED:
+            sampled = parent[2]
+        else:
+            sampled = settings.TRACE_SAMPLE_RATE > 0 and random.random() < settings.TRACE_SAMPLE_RATE
+        if not sampled:
+            return None
+        if parent is not None:
+            return Span(name, parent[0], parent[1], kind, attributes)
+        return Span(name, "%032x" % random.getrandbits(128), None, kind, attributes)
+
+    def start_span(self, name: str, kind: str = "internal",
+                   attributes: Optional[Dict[str, Any]] = None) -> Optional[Span]:
+        """在当前span下创建子span（不设为当前span），当前请求未采样时返回None"""
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+
+    @contextmanager
+    def activate(self, span: Optional[Span]) -> Iterator[Optional[Span]]:
+        """将span设为当前span，退出时结束span；异常记为错误状态后继续抛出"""
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """with tracer.span("name", key=value) as span: ...（未采样时span为None）"""
+        with self.activate(self.start_span(name, attributes=attributes)) as span:
+            yield span
+
+    def shutdown(self):
+        self.processor.shutdown()
+
+
+tracer = Tracer()
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    为函数创建子span，记录session_id参数和返回结果中的success
+
+    当前请求未采样时直接调用原函数
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+        parameters = list(inspect.signature(func).parameters)
+        session_index = parameters.index("session_id") if "session_id" in parameters else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            attributes = {}
+            if session_index is not None:
+                session_id = kwargs.get("session_id", args[session_index] if len(args) > session_index else None)
+                if session_id is not None:
+                    attributes["session.id"] = session_id
+            with tracer.activate(tracer.start_span(span_name, attributes=attributes)) as span:
+                result = func(*args, **kwargs)
+                if isinstance(result, dict) and "success" in result:
+                    span.set_attribute("tracker.success", result["success"])
+                    if not result["success"] and result.get("error"):
+                        span.set_error(str(result["error"]))
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+# ---- SQL执行 ----
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = tracer.start_span("db.query", kind="client", attributes={
+        "db.system": conn.dialect.name,
+        "db.statement": statement[:MAX_STATEMENT_CHARS],
+    })
+    if span is not None:
+        conn.info.setdefault("trace_spans", []).append(span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans and _current_span.get() is not None:
+        span = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set_attribute("db.rowcount", cursor.rowcount)
+        span.end()
+
+
+def _handle_error(exception_context):
+    spans = exception_context.connection.info.get("trace_spans") if exception_context.connection else None
+    if spans and _current_span.get() is not None:
+        span = spans.pop()
+        span.set_error(str(exception_context.original_exception))
+        span.end()
+
+
+def install_sql_hooks():
+    """为所有引擎注册SQL执行的span（开启追踪时在应用启动时调用一次）"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
@@ -1,3 +1,10 @@
 from .connection import db_manager, get_db, init_database, Base
+from .counters import increment_counters, insert_ignore
+from .sharding import shard_router, get_session_db, get_session_read_db
+from .startup import startup_state, warm_up, prepare_schema
 
-__all__ = ["db_manager", "get_db", "init_database", "Base"]
+__all__ = [
+    "db_manager", "get_db", "init_database", "Base", "increment_counters", "insert_ignore",
+    "shard_router", "get_session_db", "get_session_read_db", "startup_state", "warm_up",
+    "prepare_schema"
+]
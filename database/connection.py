@@ -1,9 +1,16 @@
 """
 数据库连接管理
+
+启动时先读取 schema_version 表中记录的表结构指纹，与当前代码一致时跳过建表和迁移；
+连接在首次使用时建立（或由启动预热提前建立）。
 """
+import os
+import re
+import hashlib
 import logging
+from datetime import datetime
 from typing import Optional
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.pool import QueuePool
@@ -14,31 +21,129 @@ logger = logging.getLogger(__name__)
 # SQLAlchemy基类
 Base = declarative_base()
 
+# 已有数据库的增量列迁移（schema.sql 中的 CREATE TABLE IF NOT EXISTS 不会修改已存在的表）
+# (表名, 列名, 列定义, 回填语句)
+COLUMN_MIGRATIONS = [
+    ("prompts", "prompt_length", "INT NOT NULL DEFAULT 0 COMMENT '完整提示词长度（字符数）'",
+     "UPDATE prompts SET prompt_length = CHAR_LENGTH(prompt)"),
+    # token数无法在SQL中计算，旧记录保持0，下次追加时按完整提示词计算一次
+    ("prompts", "fragment_tokens", "INT NOT NULL DEFAULT 0 COMMENT '本次追加片段的token数'", None),
+    ("prompts", "total_tokens", "INT NOT NULL DEFAULT 0 COMMENT '完整提示词的累计token数'", None),
+    ("prompts", "is_delta", "TINYINT(1) NOT NULL DEFAULT 0 COMMENT '是否已压缩为增量片段'", None),
+    # 旧记录没有哈希，下次追加时由完整提示词计算一次作为上一个哈希
+    ("prompts", "chain_hash", "CHAR(64) COMMENT '链式哈希：上一条记录的哈希与本次片段的SHA-256'", None),
+    ("tool_calls", "created_at", "DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '调用时间'", None),
+    ("tool_calls", "observation_prompt_id", "BIGINT COMMENT '对应Observation的提示词ID'", None),
+    ("tool_calls", "observed_at", "DATETIME COMMENT '收到Observation的时间'", None),
+    ("tool_calls", "latency_ms", "INT COMMENT '从调用到收到Observation的耗时（毫秒）'", None),
+    ("sessions", "parent_session_id", "VARCHAR(64) COMMENT '分叉来源会话ID'", None),
+    ("sessions", "fork_prompt_id", "BIGINT COMMENT '分叉点的提示词ID（共享父会话中该ID及之前的历史）'", None),
+    ("session_summaries", "observation_count", "INT NOT NULL DEFAULT 0 COMMENT 'observation事件数'", None),
+    ("session_summaries", "recent_event_ids", "JSON COMMENT '最近追加的事件ID及对应提示词ID（重试去重）'", None),
+    # 旧记录为空，读取时按存储长度计算，下次追加时由上一条记录的长度累加
+    ("prompts", "content_length", "INT COMMENT '展开大内容引用后的完整提示词长度（字符数）'", None),
+    ("session_summaries", "content_length", "INT COMMENT '展开大内容引用后的当前提示词长度（字符数）'", None),
+]
+
+# 已有数据库的枚举列扩展: (表名, 列名, 完整列定义)
+ENUM_MIGRATIONS = [
+    ("prompts", "type",
+     "ENUM('init', 'user_input', 'system_marker', 'llm_output', 'observation') NOT NULL COMMENT '提示词类型'"),
+    ("sessions", "status",
+     "ENUM('active', 'completed', 'error', 'purging') DEFAULT 'active' COMMENT '会话状态'"),
+]
+
+# 已有数据库的增量索引迁移: (表名, 索引名, 索引列)
+INDEX_MIGRATIONS = [
+    ("prompts", "idx_session_prompt", "session_id, id, type, prompt_length, timestamp"),
+    ("tool_calls", "idx_session_pending", "session_id, observation_prompt_id, id"),
+    ("sessions", "idx_parent_session_id", "parent_session_id"),
+]
+
+# 各分片的自增ID区间大小：分片i的ID从 i × SHARD_ID_SPAN + 1 开始，跨分片合并的列表中ID不重复
+SHARD_ID_SPAN = 1 << 40
+
+# 使用自增主键的表
+AUTOINCREMENT_TABLES = ("sessions", "prompts", "tool_calls", "search_terms")
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "schema.sql")
+
+_schema_version: Optional[str] = None
+
+def schema_version() -> str:
+    """当前代码的表结构指纹：schema.sql与各迁移列表的SHA-256"""
+    global _schema_version
+    if _schema_version is None:
+        hasher = hashlib.sha256()
+        with open(SCHEMA_FILE, "rb") as f:
+            hasher.update(f.read())
+        hasher.update(repr((COLUMN_MIGRATIONS, ENUM_MIGRATIONS, INDEX_MIGRATIONS)).encode("utf-8"))
+        _schema_version = hasher.hexdigest()
+    return _schema_version
+
+def _strip_sql_comments(statement: str) -> str:
+    """去掉语句开头的注释行"""
+    lines = [line for line in statement.strip().splitlines() if not line.strip().startswith("--")]
+    return "\n".join(lines).strip()
+
 class DatabaseManager:
-    """数据库管理器"""
+    """数据库管理器（每个分片一个实例，读写使用独立的连接池）"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        name: str = "default",
+        read_url: Optional[str] = None,
+        id_base: int = 0
+    ):
+        self.url = url
+        self.read_url = read_url
+        self.name = name
+        self.id_base = id_base
         self.engine = None
         self.SessionLocal = None
+        self.read_engine = None
+        self.ReadSessionLocal = None
         self._initialized = False
     
+    @staticmethod
+    def _create_engine(url: str, pool_size: int, max_overflow: int):
+        """创建数据库引擎"""
+        if url.startswith("sqlite"):
+            # 本地SQLite分片（测试用），使用默认连接池
+            return create_engine(
+                url,
+                connect_args={"check_same_thread": False},
+                echo=settings.API_DEBUG,
+            )
+        return create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            echo=settings.API_DEBUG,
+            pool_pre_ping=True,  # 连接前检查连接是否有效
+        )
+    
     def initialize(self):
         """初始化数据库连接"""
         if self._initialized:
             return
         
         try:
-            # 创建数据库引擎
-            self.engine = create_engine(
-                settings.database_url,
-                poolclass=QueuePool,
-                pool_size=settings.DB_POOL_SIZE,
-                max_overflow=settings.DB_MAX_OVERFLOW,
-                pool_timeout=settings.DB_POOL_TIMEOUT,
-                pool_recycle=settings.DB_POOL_RECYCLE,
-                echo=settings.API_DEBUG,
-                pool_pre_ping=True,  # 连接前检查连接是否有效
-            )
+            # 创建写入引擎
+            url = self.url or settings.database_url
+            self.engine = self._create_engine(url, settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW)
+            
+            # 创建读取引擎：连接只读副本，未配置副本时以独立的连接池连接主库
+            read_url = self.read_url or url
+            if read_url in ("sqlite://", "sqlite:///:memory:"):
+                # 内存SQLite无法跨连接池共享
+                self.read_engine = self.engine
+            else:
+                self.read_engine = self._create_engine(read_url, settings.DB_READ_POOL_SIZE, settings.DB_READ_MAX_OVERFLOW)
             
             # 创建会话工厂
             self.SessionLocal = sessionmaker(
@@ -46,15 +151,18 @@ class DatabaseManager:
                 autoflush=False,
                 bind=self.engine
             )
+            self.ReadSessionLocal = sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                bind=self.read_engine
+            )
             
-            # 测试连接
-            self.test_connection()
-            
+            # 只创建引擎，连接在首次使用时建立
             self._initialized = True
-            logger.info("数据库连接初始化成功")
+            logger.info(f"数据库 {self.name} 连接初始化成功")
             
         except Exception as e:
-            logger.error(f"数据库连接初始化失败: {e}")
+            logger.error(f"数据库 {self.name} 连接初始化失败: {e}")
             raise
     
     def test_connection(self):
@@ -69,41 +177,171 @@ class DatabaseManager:
             raise
     
     def get_session(self) -> Session:
-        """获取数据库会话"""
+        """获取数据库会话（写连接池）"""
         if not self._initialized:
             self.initialize()
         return self.SessionLocal()
     
+    def get_read_session(self) -> Session:
+        """获取只读数据库会话（读连接池）"""
+        if not self._initialized:
+            self.initialize()
+        if self.ReadSessionLocal is None:
+            return self.SessionLocal()
+        return self.ReadSessionLocal()
+    
     def create_tables(self):
         """创建数据库表"""
         if not self._initialized:
             self.initialize()
         
         try:
-            # 读取并执行SQL脚本
-            import os
-            sql_file = os.path.join(os.path.dirname(__file__), "schema.sql")
-            
-            with open(sql_file, 'r', encoding='utf-8') as f:
-                sql_content = f.read()
-            
-            # 分割SQL语句并执行
-            statements = [stmt.strip() for stmt in sql_content.split(';') if stmt.strip()]
-            
-            with self.engine.connect() as conn:
-                for statement in statements:
-                    if statement:
-                        conn.execute(text(statement))
-                conn.commit()
-            
-            logger.info("数据库表创建成功")
+            if self._schema_is_current():
+                logger.info(f"数据库 {self.name} 表结构已是最新，跳过建表和迁移")
+            else:
+                self._create_schema()
+                logger.info(f"数据库 {self.name} 表创建成功")
+            self._reserve_id_range()
             
         except Exception as e:
-            logger.error(f"数据库表创建失败: {e}")
+            logger.error(f"数据库 {self.name} 表创建失败: {e}")
             raise
     
+    def _create_schema(self):
+        """建表并执行增量迁移，完成后记录表结构版本"""
+        if self.engine.dialect.name == "sqlite":
+            # schema.sql 为MySQL语法，SQLite分片按模型建表
+            import models  # noqa: F401 注册全部模型
+            Base.metadata.create_all(self.engine)
+            self._record_schema_version()
+            return
+        
+        # 读取并执行SQL脚本
+        with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+            sql_content = f.read()
+        
+        # 分割SQL语句并执行（连接URL已指定数据库，跳过建库和USE语句，使各分片可使用不同的库名）
+        statements = [
+            stmt.strip() for stmt in sql_content.split(';')
+            if stmt.strip() and not re.match(r"(CREATE DATABASE|USE)\b", _strip_sql_comments(stmt), re.IGNORECASE)
+        ]
+        
+        with self.engine.connect() as conn:
+            for statement in statements:
+                if statement:
+                    conn.execute(text(statement))
+            conn.commit()
+            
+            self._apply_migrations(conn)
+        
+        self._record_schema_version()
+    
+    def _reserve_id_range(self):
+        """
+        将各自增表的下一个ID移到本分片的区间（从 id_base + 1 开始），第一个分片的 id_base 为0不处理
+
+        表中已有区间内的ID时不调整；MySQL 8.0之前自增值在重启后按最大ID重置，因此每次启动都检查
+        """
+        if not self.id_base:
+            return
+        with self.engine.connect() as conn:
+            for table in AUTOINCREMENT_TABLES:
+                max_id = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar()
+                if max_id >= self.id_base:
+                    continue
+                if self.engine.dialect.name == "sqlite":
+                    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :table"), {"table": table})
+                    conn.execute(
+                        text("INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :seq)"),
+                        {"table": table, "seq": self.id_base}
+                    )
+                else:
+                    conn.execute(text(f"ALTER TABLE {table} AUTO_INCREMENT = {self.id_base + 1}"))
+                logger.info(f"数据库 {self.name} 的表 {table} 自增ID从 {self.id_base + 1} 开始")
+            conn.commit()
+    
+    def check_schema(self):
+        """只检查表结构版本，不建表和迁移（多进程模式下由主进程在fork之前完成）"""
+        if not self._initialized:
+            self.initialize()
+        if not self._schema_is_current():
+            raise RuntimeError(f"数据库 {self.name} 的表结构版本与当前代码不一致")
+    
+    def _schema_is_current(self) -> bool:
+        """schema_version 中记录的指纹是否与当前代码一致（表不存在时视为不一致）"""
+        with self.engine.connect() as conn:
+            try:
+                row = conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).first()
+            except Exception:
+                return False
+        return row is not None and row.version == schema_version()
+    
+    def _record_schema_version(self):
+        with self.engine.connect() as conn:
+            conn.execute(text("DELETE FROM schema_version WHERE id = 1"))
+            conn.execute(
+                text("INSERT INTO schema_version (id, version, applied_at) VALUES (1, :version, :applied_at)"),
+                {"version": schema_version(), "applied_at": datetime.utcnow()}
+            )
+            conn.commit()
+    
+    def warm_pool(self, size: int):
+        """预先建立size个写连接和读连接放入连接池，首批请求不必等待建连"""
+        if not self._initialized:
+            self.initialize()
+        for engine in {self.engine, self.read_engine} - {None}:
+            if engine.dialect.name == "sqlite":
+                continue
+            connections = []
+            try:
+                for _ in range(min(size, engine.pool.size())):
+                    connections.append(engine.connect())
+            finally:
+                for conn in connections:
+                    conn.close()
+    
+    def _apply_migrations(self, conn):
+        """为已存在的表补充新增的列和索引"""
+        inspector = inspect(conn)
+        
+        for table, column, definition, backfill in COLUMN_MIGRATIONS:
+            columns = {col["name"] for col in inspector.get_columns(table)}
+            if column in columns:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+            if backfill:
+                conn.execute(text(backfill))
+            conn.commit()
+            logger.info(f"已为表 {table} 添加列 {column}")
+        
+        for table, column, definition in ENUM_MIGRATIONS:
+            current = next((col for col in inspector.get_columns(table) if col["name"] == column), None)
+            wanted = set(re.findall(r"'([^']*)'", definition.split(")")[0]))
+            if current is None or wanted <= set(getattr(current["type"], "enums", None) or wanted):
+                continue
+            conn.execute(text(f"ALTER TABLE {table} MODIFY COLUMN {column} {definition}"))
+            conn.commit()
+            logger.info(f"已扩展表 {table} 的枚举列 {column}")
+        
+        for table, index_name, index_columns in INDEX_MIGRATIONS:
+            indexes = {index["name"] for index in inspector.get_indexes(table)}
+            if index_name in indexes:
+                continue
+            conn.execute(text(f"CREATE INDEX {index_name} ON {table} ({index_columns})"))
+            conn.commit()
+            logger.info(f"已为表 {table} 添加索引 {index_name}")
+    
+    def after_fork(self):
+        """丢弃从父进程继承的连接（不关闭，父进程可能仍在使用），之后按需新建"""
+        if self.read_engine is not None and self.read_engine is not self.engine:
+            self.read_engine.dispose(close=False)
+        if self.engine:
+            self.engine.dispose(close=False)
+    
     def close(self):
         """关闭数据库连接"""
+        if self.read_engine is not None and self.read_engine is not self.engine:
+            self.read_engine.dispose()
         if self.engine:
             self.engine.dispose()
             logger.info("数据库连接已关闭")
@@ -120,6 +358,6 @@ def get_db() -> Session:
         db.close()
 
 def init_database():
-    """初始化数据库"""
-    db_manager.initialize()
-    db_manager.create_tables()
+    """初始化数据库（配置了分片时初始化全部分片）"""
+    from .sharding import shard_router
+    shard_router.initialize()
@@ -0,0 +1,77 @@
+"""
+计数器表的原子累加与幂等插入
+
+按主键插入计数行，主键冲突时在数据库内累加，写路径无需先查询再更新
+"""
+from typing import Any, Dict
+from sqlalchemy.orm import Session
+
+
+def increment_counters(db: Session, model, keys: Dict[str, Any], increments: Dict[str, int]):
+    """
+    对计数表执行 "插入或累加"（不提交事务）
+
+    keys为主键列取值，increments为需要累加的计数列及增量
+    """
+    table = model.__table__
+    values = {**keys, **increments}
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update({
+            column: table.c[column] + stmt.inserted[column] for column in increments
+        })
+        db.execute(stmt)
+        return
+
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + stmt.excluded[column] for column in increments}
+        )
+        db.execute(stmt)
+        return
+
+    # 其他数据库：加锁读取后更新
+    row = db.query(model).filter_by(**keys).with_for_update().first()
+    if row is None:
+        db.add(model(**values))
+        db.flush()
+    else:
+        for column, delta in increments.items():
+            setattr(row, column, (getattr(row, column) or 0) + delta)
+
+
+def insert_ignore(db: Session, model, values: Dict[str, Any]) -> bool:
+    """
+    按主键插入一行，已存在时忽略（不提交事务），返回是否插入了新行
+    """
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        result = db.execute(insert(table).values(**values).prefix_with("IGNORE"))
+        return result.rowcount > 0
+
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        result = db.execute(insert(table).values(**values).on_conflict_do_nothing())
+        return result.rowcount > 0
+
+    keys = {column.name: values[column.name] for column in table.primary_key.columns}
+    if db.query(model).filter_by(**keys).first() is not None:
+        return False
+    db.add(model(**values))
+    db.flush()
+    return True
@@ -12,20 +12,30 @@ CREATE TABLE IF NOT EXISTS sessions (
     initial_prompt LONGTEXT NOT NULL COMMENT '初始提示词模板',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
-    status ENUM('active', 'completed', 'error') DEFAULT 'active' COMMENT '会话状态',
+    status ENUM('active', 'completed', 'error', 'purging') DEFAULT 'active' COMMENT '会话状态',
+    parent_session_id VARCHAR(64) COMMENT '分叉来源会话ID',
+    fork_prompt_id BIGINT COMMENT '分叉点的提示词ID（共享父会话中该ID及之前的历史）',
     INDEX idx_session_id (session_id),
     INDEX idx_created_at (created_at),
-    INDEX idx_status (status)
+    INDEX idx_status (status),
+    INDEX idx_parent_session_id (parent_session_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='会话表';
 
 -- 提示词记录表
 CREATE TABLE IF NOT EXISTS prompts (
     id BIGINT AUTO_INCREMENT PRIMARY KEY COMMENT '主键ID',
     session_id VARCHAR(64) NOT NULL COMMENT '会话ID',
-    type ENUM('init', 'user_input', 'system_marker', 'llm_output') NOT NULL COMMENT '提示词类型',
-    prompt LONGTEXT NOT NULL COMMENT '完整提示词内容',
+    type ENUM('init', 'user_input', 'system_marker', 'llm_output', 'observation') NOT NULL COMMENT '提示词类型',
+    prompt LONGTEXT NOT NULL COMMENT '完整提示词内容（压缩后只存储本次追加的片段）',
+    is_delta TINYINT(1) NOT NULL DEFAULT 0 COMMENT '是否已压缩为增量片段',
+    prompt_length INT NOT NULL DEFAULT 0 COMMENT '完整提示词长度（字符数）',
+    content_length INT COMMENT '展开大内容引用后的完整提示词长度（字符数）',
+    fragment_tokens INT NOT NULL DEFAULT 0 COMMENT '本次追加片段的token数',
+    total_tokens INT NOT NULL DEFAULT 0 COMMENT '完整提示词的累计token数',
+    chain_hash CHAR(64) COMMENT '链式哈希：上一条记录的哈希与本次片段的SHA-256',
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     INDEX idx_session_id (session_id),
+    INDEX idx_session_prompt (session_id, id, type, prompt_length, timestamp),
     INDEX idx_type (type),
     INDEX idx_timestamp (timestamp)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='提示词记录表';
@@ -38,7 +48,85 @@ CREATE TABLE IF NOT EXISTS tool_calls (
     tool_name VARCHAR(100) NOT NULL COMMENT '工具名称',
     arguments JSON COMMENT '调用参数',
     description TEXT COMMENT '工具描述',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '调用时间',
+    observation_prompt_id BIGINT COMMENT '对应Observation的提示词ID',
+    observed_at DATETIME COMMENT '收到Observation的时间',
+    latency_ms INT COMMENT '从调用到收到Observation的耗时（毫秒）',
     INDEX idx_session_id (session_id),
     INDEX idx_prompt_id (prompt_id),
-    INDEX idx_tool_name (tool_name)
+    INDEX idx_tool_name (tool_name),
+    INDEX idx_session_pending (session_id, observation_prompt_id, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='工具调用记录表';
+
+-- 倒排索引表（只索引每次追加的片段）
+CREATE TABLE IF NOT EXISTS search_terms (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY COMMENT '主键ID',
+    term VARCHAR(64) NOT NULL COMMENT '词项',
+    session_id VARCHAR(64) NOT NULL COMMENT '会话ID',
+    prompt_id BIGINT NOT NULL COMMENT '对应的提示词ID',
+    tag VARCHAR(32) NOT NULL COMMENT '所在的状态标签',
+    tool_name VARCHAR(100) COMMENT 'Action/ActionInput对应的工具名称',
+    INDEX idx_term_tag (term, tag, tool_name),
+    INDEX idx_session_id (session_id),
+    INDEX idx_prompt_id (prompt_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin COMMENT='倒排索引表';
+
+-- 工具调用小时汇总表（写入时增量维护）
+CREATE TABLE IF NOT EXISTS tool_call_rollups (
+    bucket_start DATETIME NOT NULL COMMENT '小时桶起始时间',
+    tool_name VARCHAR(100) NOT NULL COMMENT '工具名称',
+    calls BIGINT NOT NULL DEFAULT 0 COMMENT '调用次数',
+    parse_failures BIGINT NOT NULL DEFAULT 0 COMMENT '参数JSON解析失败次数',
+    missing_arguments BIGINT NOT NULL DEFAULT 0 COMMENT '缺少ActionInput的次数',
+    PRIMARY KEY (bucket_start, tool_name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='工具调用小时汇总表';
+
+-- 事件速率汇总表（写入时增量维护分钟桶，过期的分钟桶由后台任务合并为小时桶）
+CREATE TABLE IF NOT EXISTS event_rollups (
+    resolution VARCHAR(8) NOT NULL COMMENT '桶粒度: minute 或 hour',
+    bucket_start DATETIME NOT NULL COMMENT '桶起始时间',
+    slot INT NOT NULL COMMENT '写入分散槽位（按session_id哈希，减少热点行竞争）',
+    init_count BIGINT NOT NULL DEFAULT 0 COMMENT 'init事件数',
+    user_input_count BIGINT NOT NULL DEFAULT 0 COMMENT 'user_input事件数',
+    system_marker_count BIGINT NOT NULL DEFAULT 0 COMMENT 'system_marker事件数',
+    llm_output_count BIGINT NOT NULL DEFAULT 0 COMMENT 'llm_output事件数',
+    observation_count BIGINT NOT NULL DEFAULT 0 COMMENT 'observation事件数',
+    bytes_appended BIGINT NOT NULL DEFAULT 0 COMMENT '追加内容的字节数（UTF-8）',
+    active_sessions BIGINT NOT NULL DEFAULT 0 COMMENT '桶内有写入的会话数',
+    hour_active_sessions BIGINT NOT NULL DEFAULT 0 COMMENT '在本桶首次出现于所在小时的会话数',
+    PRIMARY KEY (resolution, bucket_start, slot)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='事件速率汇总表';
+
+-- 会话摘要表（每次追加时在同一事务中更新）
+CREATE TABLE IF NOT EXISTS session_summaries (
+    session_id VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '会话ID',
+    last_prompt_id BIGINT NOT NULL COMMENT '最新的提示词ID',
+    init_count INT NOT NULL DEFAULT 0 COMMENT 'init事件数',
+    user_input_count INT NOT NULL DEFAULT 0 COMMENT 'user_input事件数',
+    system_marker_count INT NOT NULL DEFAULT 0 COMMENT 'system_marker事件数',
+    llm_output_count INT NOT NULL DEFAULT 0 COMMENT 'llm_output事件数',
+    observation_count INT NOT NULL DEFAULT 0 COMMENT 'observation事件数',
+    prompt_length INT NOT NULL DEFAULT 0 COMMENT '当前提示词长度（字符数）',
+    content_length INT COMMENT '展开大内容引用后的当前提示词长度（字符数）',
+    total_tokens INT NOT NULL DEFAULT 0 COMMENT '当前提示词token数',
+    tool_call_count INT NOT NULL DEFAULT 0 COMMENT '工具调用次数',
+    last_activity_at DATETIME COMMENT '最后活动时间',
+    recent_event_ids JSON COMMENT '最近追加的事件ID及对应提示词ID（重试去重）',
+    INDEX idx_last_activity_at (last_activity_at),
+    INDEX idx_tool_call_count (tool_call_count)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='会话摘要表';
+
+-- 大内容存储表（按内容SHA-256寻址，相同内容只存储一次）
+CREATE TABLE IF NOT EXISTS blobs (
+    digest CHAR(64) NOT NULL PRIMARY KEY COMMENT '内容的SHA-256',
+    content LONGTEXT NOT NULL COMMENT '内容',
+    size INT NOT NULL COMMENT '内容长度（字符数）',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='大内容存储表';
+
+-- 表结构版本表（只有一行；启动时版本与当前代码一致则跳过建表和迁移）
+CREATE TABLE IF NOT EXISTS schema_version (
+    id TINYINT NOT NULL PRIMARY KEY COMMENT '固定为1',
+    version CHAR(64) NOT NULL COMMENT '表结构指纹（schema.sql与迁移列表的SHA-256）',
+    applied_at DATETIME NOT NULL COMMENT '应用时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='表结构版本表';
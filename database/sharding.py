@@ -0,0 +1,228 @@
+"""
+会话分片路由
+
+按 session_id 在一致性哈希环上选择分片，同一会话的所有数据（提示词、工具调用、摘要、索引、大内容）
+都写入所属分片；跨会话的查询在各分片上并行执行后合并结果。
+未配置 DB_SHARDS 时只有一个分片，即全局的 db_manager。
+
+GET接口使用各分片的读连接池（可指向只读副本），刚写入过的会话在 READ_YOUR_WRITES_SECONDS
+内仍读写连接池，保证客户端追加后立即读取能看到自己的写入。多进程部署时写入记录通过
+进程间失效通知同步到其他worker。
+"""
+import bisect
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, TypeVar
+from sqlalchemy.orm import Session
+from config.settings import settings
+from core.invalidation import invalidation_bus
+from .connection import DatabaseManager, db_manager, SHARD_ID_SPAN
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环，增加分片时只有约 1/N 的会话需要迁移"""
+
+    def __init__(self, shard_names: List[str], vnodes: int):
+        points = sorted(
+            (_ring_hash(f"{name}#{replica}"), index)
+            for index, name in enumerate(shard_names)
+            for replica in range(max(vnodes, 1))
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [index for _, index in points]
+
+    def locate(self, key: str) -> int:
+        """返回key所属分片的序号"""
+        position = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._hashes)
+        return self._shards[position]
+
+
+class RecentWrites:
+    """记录最近写入过的会话（本进程内），用于读己之写"""
+
+    # 记录数超过该值时清理过期记录
+    PRUNE_THRESHOLD = 10000
+
+    def __init__(self):
+        self._expires: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, session_id: str):
+        window = settings.READ_YOUR_WRITES_SECONDS
+        if window <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._expires[session_id] = now + window
+            if len(self._expires) > self.PRUNE_THRESHOLD:
+                self._expires = {key: expires for key, expires in self._expires.items() if expires > now}
+
+    def contains(self, session_id: str) -> bool:
+        with self._lock:
+            expires = self._expires.get(session_id)
+        return expires is not None and expires > time.monotonic()
+
+
+class ShardRouter:
+    """分片路由器"""
+
+    def __init__(self, primary: DatabaseManager):
+        self.primary = primary
+        self.managers: List[DatabaseManager] = []
+        self.ring: Optional[HashRing] = None
+        self.recent_writes = RecentWrites()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _ensure_configured(self):
+        if self.managers:
+            return
+        urls = settings.shard_urls
+        read_urls = settings.read_urls
+        # 第一个分片复用全局 db_manager；各分片使用不重叠的自增ID区间，第一个分片从1开始
+        self.primary.url = self.primary.url or urls[0]
+        self.primary.read_url = self.primary.read_url or read_urls[0]
+        self.primary.name = "shard-0" if len(urls) > 1 else self.primary.name
+        managers = [self.primary] + [
+            DatabaseManager(url, f"shard-{index}", read_urls[index], id_base=index * SHARD_ID_SPAN)
+            for index, url in enumerate(urls[1:], start=1)
+        ]
+        self.ring = HashRing([manager.name for manager in managers], settings.DB_SHARD_VNODES)
+        if len(managers) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=len(managers), thread_name_prefix="shard")
+        self.managers = managers
+
+    @property
+    def shard_count(self) -> int:
+        self._ensure_configured()
+        return len(self.managers)
+
+    def shard_index(self, session_id: str) -> int:
+        """会话所属分片的序号"""
+        self._ensure_configured()
+        if len(self.managers) == 1:
+            return 0
+        return self.ring.locate(session_id)
+
+    def manager_for(self, session_id: str) -> DatabaseManager:
+        """会话所属分片的数据库管理器"""
+        index = self.shard_index(session_id)
+        return self.managers[index]
+
+    def get_session(self, session_id: str) -> Session:
+        """获取会话所属分片的数据库会话（写连接池）"""
+        return self.manager_for(session_id).get_session()
+
+    def get_read_session(self, session_id: str) -> Session:
+        """获取会话所属分片的只读数据库会话，刚写入过的会话仍使用写连接池"""
+        manager = self.manager_for(session_id)
+        if self.recent_writes.contains(session_id):
+            return manager.get_session()
+        return manager.get_read_session()
+
+    def note_write(self, session_id: str):
+        """记录会话刚被写入（并通知其他worker）"""
+        invalidation_bus.publish("write", session_id)
+
+    @contextmanager
+    def session_scope(self, session_id: str, read: bool = False):
+        """会话所属分片的数据库会话（用完关闭），read为True时使用读连接池"""
+        db = self.get_read_session(session_id) if read else self.get_session(session_id)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def colocated_session_id(self, session_id: str) -> str:
+        """生成与session_id位于同一分片的新会话ID（分叉会话需要与父会话在同一个库中）"""
+        target = self.shard_index(session_id)
+        while True:
+            candidate = uuid.uuid4().hex
+            if self.shard_index(candidate) == target:
+                return candidate
+
+    def scatter(self, fn: Callable[[Session], T], read: bool = False) -> List[T]:
+        """
+        在每个分片上各开一个数据库会话执行fn，多个分片时并行执行，按分片顺序返回结果
+
+        read为True时使用各分片的读连接池
+        """
+        self._ensure_configured()
+
+        def run(manager: DatabaseManager) -> T:
+            db = manager.get_read_session() if read else manager.get_session()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        if self._executor is None:
+            return [run(manager) for manager in self.managers]
+        return list(self._executor.map(run, self.managers))
+
+    def initialize(self):
+        """初始化所有分片的连接并建表"""
+        self._ensure_configured()
+        for manager in self.managers:
+            manager.initialize()
+            manager.create_tables()
+        if len(self.managers) > 1:
+            logger.info(f"已初始化 {len(self.managers)} 个数据库分片")
+
+    def check_schema(self):
+        """初始化所有分片的连接并检查表结构版本（不建表）"""
+        self._ensure_configured()
+        for manager in self.managers:
+            manager.initialize()
+            manager.check_schema()
+
+    def close(self):
+        for manager in self.managers:
+            manager.close()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def after_fork(self):
+        """在fork出的worker进程中调用：丢弃继承的连接池和线程池，按需重新建立"""
+        for manager in self.managers:
+            manager.after_fork()
+        if len(self.managers) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.managers), thread_name_prefix="shard")
+
+
+# 全局分片路由器
+shard_router = ShardRouter(db_manager)
+invalidation_bus.subscribe("write", shard_router.recent_writes.mark)
+
+
+def get_session_db(session_id: str) -> Session:
+    """按路径中的session_id获取所属分片数据库会话（写连接池）的依赖注入函数"""
+    # 开始和结束时都记录写入：依赖的清理可能在响应发出之后才执行
+    shard_router.note_write(session_id)
+    db = shard_router.get_session(session_id)
+    try:
+        yield db
+    finally:
+        db.close()
+        shard_router.note_write(session_id)
+
+
+def get_session_read_db(session_id: str) -> Session:
+    """按路径中的session_id获取所属分片只读数据库会话的依赖注入函数"""
+    db = shard_router.get_read_session(session_id)
+    try:
+        yield db
+    finally:
+        db.close()
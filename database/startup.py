@@ -0,0 +1,96 @@
+"""
+启动预热与就绪状态
+
+应用启动时不再同步初始化数据库：后台任务检查表结构版本（一致时跳过建表和迁移）并预热连接池，
+数据库暂时不可用时按退避间隔重试。/health 立即可用，/ready 在预热完成后才返回200。
+
+多进程模式下由主进程在fork之前执行一次建表和迁移（prepare_schema），worker只检查表结构版本并预热连接池。
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+from config.settings import settings
+from .connection import init_database
+from .sharding import shard_router
+
+logger = logging.getLogger(__name__)
+
+
+class StartupState:
+    """启动预热的进度"""
+
+    def __init__(self):
+        self.state = "starting"
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.started_at = datetime.utcnow()
+        self.ready_at: Optional[datetime] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "attempts": self.attempts,
+            "error": self.error,
+            "started_at": self.started_at,
+            "ready_at": self.ready_at,
+        }
+
+
+startup_state = StartupState()
+
+
+def warm_pools():
+    """为每个分片预先建立 DB_POOL_WARMUP 个连接"""
+    for manager in shard_router.managers:
+        manager.warm_pool(settings.DB_POOL_WARMUP)
+
+
+def prepare_schema():
+    """在主进程中建表和迁移（fork worker之前调用），失败时按指数退避重试直到成功，完成后关闭主进程的连接"""
+    delay = settings.STARTUP_RETRY_INTERVAL
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            init_database()
+            break
+        except Exception as e:
+            logger.warning(f"数据库初始化失败（第 {attempts} 次），{delay:.1f} 秒后重试: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, settings.STARTUP_RETRY_MAX_INTERVAL)
+    shard_router.close()
+
+
+async def warm_up(create_schema: bool = True):
+    """
+    后台初始化数据库并预热连接池，失败时按指数退避重试直到成功
+
+    create_schema为False时（表结构已由主进程准备）只检查表结构版本
+    """
+    delay = settings.STARTUP_RETRY_INTERVAL
+    while True:
+        startup_state.attempts += 1
+        try:
+            await asyncio.to_thread(init_database if create_schema else shard_router.check_schema)
+            await asyncio.to_thread(warm_pools)
+        except Exception as e:
+            startup_state.state = "retrying"
+            startup_state.error = str(e)
+            logger.warning(f"数据库初始化失败（第 {startup_state.attempts} 次），{delay:.1f} 秒后重试: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.STARTUP_RETRY_MAX_INTERVAL)
+            continue
+
+        startup_state.state = "ready"
+        startup_state.error = None
+        startup_state.ready_at = datetime.utcnow()
+        elapsed = (startup_state.ready_at - startup_state.started_at).total_seconds()
+        logger.info(f"数据库初始化和连接池预热完成，耗时 {elapsed:.2f} 秒")
+        return
@@ -8,6 +8,9 @@ import requests
 import json
 import time
 
+# 复用同一个连接（keep-alive），不为每个请求新建TCP连接；嵌入Agent运行时请使用 client 包
+http = requests.Session()
+
 def print_separator(title=""):
     """打印分隔线"""
     print("=" * 80)
@@ -22,7 +25,7 @@ def wait_for_server(base_url="http://localhost:8000", timeout=30):
     
     while time.time() - start_time < timeout:
         try:
-            response = requests.get(f"{base_url}/health", timeout=1)
+            response = http.get(f"{base_url}/health", timeout=1)
             if response.status_code == 200:
                 print("✅ 服务器已启动！")
                 return True
@@ -47,7 +50,7 @@ def demo_prompt_tracking():
     # 1. 创建会话并初始化提示词
     print("1️⃣ 创建会话并初始化提示词...")
     try:
-        response = requests.post(f"{base_url}/api/v1/sessions", json={
+        response = http.post(f"{base_url}/api/v1/sessions", json={
             "session_id": session_id
         })
         
@@ -68,7 +71,7 @@ def demo_prompt_tracking():
     print("\n2️⃣ 添加用户输入...")
     user_input = "现在给我画个五彩斑斓的黑"
     try:
-        response = requests.post(f"{base_url}/api/v1/sessions/{session_id}/user-input", json={
+        response = http.post(f"{base_url}/api/v1/sessions/{session_id}/user-input", json={
             "session_id": session_id,
             "user_input": user_input
         })
@@ -88,7 +91,7 @@ def demo_prompt_tracking():
     # 3. 添加系统标记
     print("\n3️⃣ 添加系统标记...")
     try:
-        response = requests.post(f"{base_url}/api/v1/sessions/{session_id}/system-marker", json={
+        response = http.post(f"{base_url}/api/v1/sessions/{session_id}/system-marker", json={
             "session_id": session_id,
             "reason": "UserInput"
         })
@@ -113,7 +116,7 @@ def demo_prompt_tracking():
 <End><Reason>ActionInput</Reason></End>"""
     
     try:
-        response = requests.post(f"{base_url}/api/v1/sessions/{session_id}/llm-output", json={
+        response = http.post(f"{base_url}/api/v1/sessions/{session_id}/llm-output", json={
             "session_id": session_id,
             "llm_output": llm_output
         })
@@ -134,7 +137,7 @@ def demo_prompt_tracking():
     # 5. 查看当前完整提示词
     print("\n5️⃣ 查看当前完整提示词...")
     try:
-        response = requests.get(f"{base_url}/api/v1/sessions/{session_id}/current-prompt")
+        response = http.get(f"{base_url}/api/v1/sessions/{session_id}/current-prompt")
         
         if response.status_code == 200:
             result = response.json()
@@ -150,7 +153,7 @@ def demo_prompt_tracking():
     # 6. 查看提示词变化历史
     print("\n6️⃣ 查看提示词历史...")
     try:
-        response = requests.get(f"{base_url}/api/v1/sessions/{session_id}/prompts")
+        response = http.get(f"{base_url}/api/v1/sessions/{session_id}/prompts")
         
         if response.status_code == 200:
             prompts = response.json()
@@ -169,7 +172,7 @@ def demo_prompt_tracking():
     # 7. 查看工具调用记录
     print("7️⃣ 查看工具调用记录...")
     try:
-        response = requests.get(f"{base_url}/api/v1/sessions/{session_id}/tool-calls")
+        response = http.get(f"{base_url}/api/v1/sessions/{session_id}/tool-calls")
         
         if response.status_code == 200:
             tool_calls = response.json()
@@ -189,7 +192,7 @@ def demo_prompt_tracking():
     # 8. 查看系统统计
     print("8️⃣ 查看系统统计...")
     try:
-        response = requests.get(f"{base_url}/api/v1/stats")
+        response = http.get(f"{base_url}/api/v1/stats")
         
         if response.status_code == 200:
             stats = response.json()
@@ -2,14 +2,27 @@
 """
 提示词追踪系统 - 主应用
 """
+import asyncio
 import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from config.settings import settings
-from database import init_database
-from api.prompt_routes import router as prompt_router
+from database import shard_router, startup_state, warm_up, prepare_schema
+from core.invalidation import invalidation_bus
+from api.prompt_routes import router as prompt_router, prompt_tracker, session_lifecycle, retention_manager
+from api.responses import FastJSONResponse, CompressionMiddleware
+from api.admission import AdmissionMiddleware, ReadinessMiddleware, admission_controller
+from api.profiling import ProfilingMiddleware, install_sql_hooks, slow_requests
+from api.tracing import TracingMiddleware
+from core.tracing import tracer, install_sql_hooks as install_trace_hooks
 
 # 配置日志
 logging.basicConfig(
@@ -24,9 +37,27 @@ app = FastAPI(
     description="透明化的LLM提示词变化管理系统",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse if settings.API_FAST_JSON else JSONResponse
 )
 
+# 添加准入控制中间件（按路由类别限制并发，过载时返回429/503和Retry-After）
+if settings.ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
+# 添加就绪检查中间件（数据库预热完成前API请求返回503，不占用准入名额）
+app.add_middleware(ReadinessMiddleware, state=startup_state)
+
+# 添加请求剖析中间件（在准入控制之外，剖析结果包含排队时间）
+if settings.PROFILING_ENABLED:
+    install_sql_hooks()
+    app.add_middleware(ProfilingMiddleware)
+
+# 添加链路追踪中间件（沿用请求头traceparent，未采样的请求不创建span）
+if settings.TRACING_ENABLED:
+    install_trace_hooks()
+    app.add_middleware(TracingMiddleware)
+
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +67,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 添加响应压缩中间件（大响应体按Accept-Encoding进行gzip/br压缩，总是带Vary: Accept-Encoding）
+app.add_middleware(CompressionMiddleware, minimum_size=settings.API_COMPRESSION_MIN_SIZE)
+
 # 注册路由
 app.include_router(prompt_router, prefix="/api/v1", tags=["提示词追踪"])
 
@@ -58,28 +92,136 @@ async def health_check():
         "version": "2.0.0"
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：数据库初始化和连接池预热完成前返回503"""
+    return FastJSONResponse(startup_state.to_dict(), status_code=200 if startup_state.ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """运行指标（Prometheus文本格式）：各路由类别的并发数、排队长度和拒绝数"""
+    return admission_controller.metrics()
+
+@app.get("/debug/slow-requests")
+async def get_slow_requests(limit: int = Query(50, ge=1, le=1000, description="返回的请求数")):
+    """最近的慢请求剖析结果（需开启PROFILING_ENABLED），最新的在前"""
+    return {
+        "enabled": settings.PROFILING_ENABLED,
+        "threshold_ms": settings.PROFILE_SLOW_MS,
+        "requests": slow_requests.recent(limit)
+    }
+
+# 后台任务
+background_tasks = []
+
+# 多进程模式下只有第一个worker运行后台任务
+run_background_jobs = True
+
+# 多进程模式下表结构由主进程在fork之前准备，worker只检查版本
+create_schema_on_startup = True
+
 @app.on_event("startup")
 async def startup_event():
-    """应用启动事件"""
-    try:
-        logger.info("正在初始化数据库...")
-        init_database()
-        logger.info("数据库初始化完成")
-        logger.info(f"应用启动成功，监听地址: {settings.API_HOST}:{settings.API_PORT}")
-    except Exception as e:
-        logger.error(f"应用启动失败: {e}")
-        raise
+    """应用启动事件：数据库在后台初始化，不阻塞启动"""
+    background_tasks.append(asyncio.create_task(warm_up(create_schema=create_schema_on_startup)))
+    if run_background_jobs:
+        background_tasks.append(asyncio.create_task(session_lifecycle.run_idle_sweeper()))
+        background_tasks.append(asyncio.create_task(retention_manager.run_periodically()))
+        background_tasks.append(asyncio.create_task(prompt_tracker.event_rollups.run_periodically()))
+    logger.info(f"应用启动成功，监听地址: {settings.API_HOST}:{settings.API_PORT}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
     logger.info("应用正在关闭...")
+    for task in background_tasks:
+        task.cancel()
+    if settings.TRACING_ENABLED:
+        tracer.shutdown()
+
+def _run_worker(index: int, sock: socket.socket, bus_dir: str):
+    """worker进程：复用预加载的应用，在共享的监听套接字上处理请求"""
+    global run_background_jobs, create_schema_on_startup
+    run_background_jobs = index == 0
+    create_schema_on_startup = False
+    shard_router.after_fork()
+    invalidation_bus.start(bus_dir)
+    try:
+        config = uvicorn.Config(app, log_level=settings.LOG_LEVEL.lower())
+        uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        invalidation_bus.stop()
+
+def run_workers(count: int):
+    """
+    多进程运行：主进程加载应用后fork出count个worker，worker共享监听套接字，
+    通过Unix套接字互相发送失效通知；worker异常退出时自动重启。
+    主进程在fork之前建表和迁移（只执行一次）后关闭自己的连接，各worker启动后在后台检查表结构版本并预热自己的连接池
+    """
+    prepare_schema()
+    
+    bus_dir = settings.WORKER_BUS_DIR or tempfile.mkdtemp(prefix="prompt-tracker-bus-")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((settings.API_HOST, settings.API_PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    
+    workers = {}
+    stopping = False
+    
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(index, sock, bus_dir)
+            except Exception as e:
+                logger.error(f"worker {index} 异常退出: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = index
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    for index in range(count):
+        spawn(index)
+    logger.info(f"应用以 {count} 个worker启动，监听地址: {settings.API_HOST}:{settings.API_PORT}")
+    
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is not None and not stopping:
+            logger.warning(f"worker {index}（pid {pid}）退出，状态 {status}，正在重启")
+            spawn(index)
+    sock.close()
+    if not settings.WORKER_BUS_DIR:
+        shutil.rmtree(bus_dir, ignore_errors=True)
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host=settings.API_HOST,
-        port=settings.API_PORT,
-        reload=settings.API_DEBUG,
-        log_level=settings.LOG_LEVEL.lower()
-    )
+    if settings.API_WORKERS > 1 and hasattr(os, "fork"):
+        run_workers(settings.API_WORKERS)
+    else:
+        uvicorn.run(
+            "main:app",
+            host=settings.API_HOST,
+            port=settings.API_PORT,
+            reload=settings.API_RELOAD,
+            log_level=settings.LOG_LEVEL.lower()
+        )
@@ -1,16 +1,20 @@
 # 提示词追踪系统模型
 from .prompt_models import (
-    SessionModel, PromptModel, ToolCallModel,
+    SessionModel, PromptModel, ToolCallModel, SearchTermModel,
+    ToolCallRollupModel, EventRollupModel, SessionSummaryModel, BlobModel, SchemaVersionModel,
     SessionCreate, PromptCreate, SessionResponse, PromptResponse,
-    ToolCallResponse, SessionStatus, PromptType
+    SessionSummaryResponse, PromptSummaryResponse,
+    ToolCallResponse, SearchResultResponse, SessionStatus, PromptType
 )
 
 __all__ = [
     # Models
-    "SessionModel", "PromptModel", "ToolCallModel",
+    "SessionModel", "PromptModel", "ToolCallModel", "SearchTermModel",
+    "ToolCallRollupModel", "EventRollupModel", "SessionSummaryModel", "BlobModel", "SchemaVersionModel",
     # Request/Response Models
     "SessionCreate", "PromptCreate", "SessionResponse", "PromptResponse",
-    "ToolCallResponse",
+    "SessionSummaryResponse", "PromptSummaryResponse", "ToolCallResponse",
+    "SearchResultResponse",
     # Enums
     "SessionStatus", "PromptType",
 ]
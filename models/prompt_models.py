@@ -3,17 +3,24 @@
 """
 from datetime import datetime
 from typing import Optional, Dict, Any, List
-from sqlalchemy import Column, String, Integer, DateTime, Enum, Text, JSON, BigInteger, ForeignKey
+from sqlalchemy import Column, String, Integer, DateTime, Enum, Text, JSON, BigInteger, Boolean, ForeignKey
 from sqlalchemy.orm import relationship
 from database import Base
 from pydantic import BaseModel
 import enum
 
+# 自增主键类型（SQLite只对INTEGER主键自增，用作测试分片时需要映射）
+BigIntegerPK = BigInteger().with_variant(Integer, "sqlite")
+
+# 自增主键的表参数：SQLite分片使用AUTOINCREMENT，才能像MySQL一样预留本分片的ID区间
+AUTOINCREMENT_TABLE_ARGS = {"sqlite_autoincrement": True}
+
 class SessionStatus(str, enum.Enum):
     """会话状态枚举"""
     active = "active"
     completed = "completed"
     error = "error"
+    purging = "purging"          # 过期清理中，不再接受追加和分叉
 
 class PromptType(str, enum.Enum):
     """提示词类型枚举"""
@@ -21,39 +28,128 @@ class PromptType(str, enum.Enum):
     user_input = "user_input"    # 用户输入
     system_marker = "system_marker"  # 系统标记（Start/End）
     llm_output = "llm_output"    # LLM输出
+    observation = "observation"  # 工具执行结果
 
 # SQLAlchemy 模型
 class SessionModel(Base):
     """会话数据库模型"""
     __tablename__ = "sessions"
+    __table_args__ = AUTOINCREMENT_TABLE_ARGS
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True, comment="主键ID")
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment="主键ID")
     session_id = Column(String(64), nullable=False, unique=True, comment="会话ID")
     initial_prompt = Column(Text, nullable=False, comment="初始提示词模板")
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
     status = Column(Enum(SessionStatus), default=SessionStatus.active, comment="会话状态")
+    parent_session_id = Column(String(64), comment="分叉来源会话ID")
+    fork_prompt_id = Column(BigInteger, comment="分叉点的提示词ID（共享父会话中该ID及之前的历史）")
 
 class PromptModel(Base):
     """提示词记录数据库模型"""
     __tablename__ = "prompts"
+    __table_args__ = AUTOINCREMENT_TABLE_ARGS
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True, comment="主键ID")
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment="主键ID")
     session_id = Column(String(64), nullable=False, comment="会话ID")
     type = Column(Enum(PromptType), nullable=False, comment="提示词类型")
-    prompt = Column(Text, nullable=False, comment="完整提示词内容")
+    prompt = Column(Text, nullable=False, comment="完整提示词内容（压缩后只存储本次追加的片段）")
+    is_delta = Column(Boolean, nullable=False, default=False, comment="是否已压缩为增量片段")
+    prompt_length = Column(Integer, nullable=False, default=0, comment="完整提示词长度（字符数）")
+    content_length = Column(Integer, comment="展开大内容引用后的完整提示词长度（字符数）")
+    fragment_tokens = Column(Integer, nullable=False, default=0, comment="本次追加片段的token数")
+    total_tokens = Column(Integer, nullable=False, default=0, comment="完整提示词的累计token数")
+    chain_hash = Column(String(64), comment="链式哈希：上一条记录的哈希与本次片段的SHA-256")
     timestamp = Column(DateTime, default=datetime.utcnow, comment="创建时间")
 
 class ToolCallModel(Base):
     """工具调用记录数据库模型"""
     __tablename__ = "tool_calls"
+    __table_args__ = AUTOINCREMENT_TABLE_ARGS
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True, comment="主键ID")
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment="主键ID")
     session_id = Column(String(64), nullable=False, comment="会话ID")
     prompt_id = Column(BigInteger, nullable=False, comment="对应的提示词ID")
     tool_name = Column(String(100), nullable=False, comment="工具名称")
     arguments = Column(JSON, comment="调用参数")
     description = Column(Text, comment="工具描述")
+    created_at = Column(DateTime, default=datetime.utcnow, comment="调用时间")
+    observation_prompt_id = Column(BigInteger, comment="对应Observation的提示词ID")
+    observed_at = Column(DateTime, comment="收到Observation的时间")
+    latency_ms = Column(Integer, comment="从调用到收到Observation的耗时（毫秒）")
+
+class ToolCallRollupModel(Base):
+    """工具调用小时汇总数据库模型"""
+    __tablename__ = "tool_call_rollups"
+
+    bucket_start = Column(DateTime, primary_key=True, comment="小时桶起始时间")
+    tool_name = Column(String(100), primary_key=True, comment="工具名称")
+    calls = Column(BigInteger, nullable=False, default=0, comment="调用次数")
+    parse_failures = Column(BigInteger, nullable=False, default=0, comment="参数JSON解析失败次数")
+    missing_arguments = Column(BigInteger, nullable=False, default=0, comment="缺少ActionInput的次数")
+
+class EventRollupModel(Base):
+    """事件速率汇总数据库模型（分钟桶，过期后合并为小时桶）"""
+    __tablename__ = "event_rollups"
+
+    resolution = Column(String(8), primary_key=True, comment="桶粒度: minute 或 hour")
+    bucket_start = Column(DateTime, primary_key=True, comment="桶起始时间")
+    slot = Column(Integer, primary_key=True, comment="写入分散槽位（按session_id哈希，减少热点行竞争）")
+    init_count = Column(BigInteger, nullable=False, default=0, comment="init事件数")
+    user_input_count = Column(BigInteger, nullable=False, default=0, comment="user_input事件数")
+    system_marker_count = Column(BigInteger, nullable=False, default=0, comment="system_marker事件数")
+    llm_output_count = Column(BigInteger, nullable=False, default=0, comment="llm_output事件数")
+    observation_count = Column(BigInteger, nullable=False, default=0, comment="observation事件数")
+    bytes_appended = Column(BigInteger, nullable=False, default=0, comment="追加内容的字节数（UTF-8）")
+    active_sessions = Column(BigInteger, nullable=False, default=0, comment="桶内有写入的会话数")
+    hour_active_sessions = Column(BigInteger, nullable=False, default=0, comment="在本桶首次出现于所在小时的会话数")
+
+class SessionSummaryModel(Base):
+    """会话摘要数据库模型（每次追加时在同一事务中更新）"""
+    __tablename__ = "session_summaries"
+
+    session_id = Column(String(64), primary_key=True, comment="会话ID")
+    last_prompt_id = Column(BigInteger, nullable=False, comment="最新的提示词ID")
+    init_count = Column(Integer, nullable=False, default=0, comment="init事件数")
+    user_input_count = Column(Integer, nullable=False, default=0, comment="user_input事件数")
+    system_marker_count = Column(Integer, nullable=False, default=0, comment="system_marker事件数")
+    llm_output_count = Column(Integer, nullable=False, default=0, comment="llm_output事件数")
+    observation_count = Column(Integer, nullable=False, default=0, comment="observation事件数")
+    prompt_length = Column(Integer, nullable=False, default=0, comment="当前提示词长度（字符数）")
+    content_length = Column(Integer, comment="展开大内容引用后的当前提示词长度（字符数）")
+    total_tokens = Column(Integer, nullable=False, default=0, comment="当前提示词token数")
+    tool_call_count = Column(Integer, nullable=False, default=0, comment="工具调用次数")
+    last_activity_at = Column(DateTime, default=datetime.utcnow, comment="最后活动时间")
+    recent_event_ids = Column(JSON, comment="最近追加的事件ID及对应提示词ID（重试去重）")
+
+class BlobModel(Base):
+    """大内容存储数据库模型（按内容SHA-256寻址）"""
+    __tablename__ = "blobs"
+
+    digest = Column(String(64), primary_key=True, comment="内容的SHA-256")
+    content = Column(Text, nullable=False, comment="内容")
+    size = Column(Integer, nullable=False, comment="内容长度（字符数）")
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+
+class SchemaVersionModel(Base):
+    """表结构版本数据库模型（只有一行）"""
+    __tablename__ = "schema_version"
+
+    id = Column(Integer, primary_key=True, comment="固定为1")
+    version = Column(String(64), nullable=False, comment="表结构指纹")
+    applied_at = Column(DateTime, nullable=False, comment="应用时间")
+
+class SearchTermModel(Base):
+    """倒排索引数据库模型"""
+    __tablename__ = "search_terms"
+    __table_args__ = AUTOINCREMENT_TABLE_ARGS
+
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True, comment="主键ID")
+    term = Column(String(64), nullable=False, comment="词项")
+    session_id = Column(String(64), nullable=False, comment="会话ID")
+    prompt_id = Column(BigInteger, nullable=False, comment="对应的提示词ID")
+    tag = Column(String(32), nullable=False, comment="所在的状态标签")
+    tool_name = Column(String(100), comment="Action/ActionInput对应的工具名称")
 
 # Pydantic 模型
 class SessionCreate(BaseModel):
@@ -75,6 +171,25 @@ class SessionResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     status: SessionStatus
+    parent_session_id: Optional[str] = None
+    fork_prompt_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class SessionSummaryResponse(BaseModel):
+    """会话摘要响应模型（不含初始提示词全文）"""
+    id: int
+    session_id: str
+    created_at: datetime
+    updated_at: datetime
+    status: SessionStatus
+    last_prompt_id: Optional[int] = None
+    event_count: Optional[int] = None
+    prompt_length: Optional[int] = None
+    total_tokens: Optional[int] = None
+    tool_call_count: Optional[int] = None
+    last_activity_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -85,11 +200,34 @@ class PromptResponse(BaseModel):
     session_id: str
     type: PromptType
     prompt: str
+    prompt_length: int
+    total_tokens: int
+    timestamp: datetime
+
+    class Config:
+        from_attributes = True
+
+class PromptSummaryResponse(BaseModel):
+    """提示词摘要响应模型（不含提示词全文）"""
+    id: int
+    session_id: str
+    type: PromptType
+    prompt_length: int
+    total_tokens: int
     timestamp: datetime
 
     class Config:
         from_attributes = True
 
+class SearchResultResponse(BaseModel):
+    """检索结果响应模型"""
+    session_id: str
+    prompt_id: int
+    prompt_type: Optional[PromptType] = None
+    tag: str
+    tool_name: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
 class ToolCallResponse(BaseModel):
     """工具调用响应模型"""
     id: int
@@ -98,6 +236,10 @@ class ToolCallResponse(BaseModel):
     tool_name: str
     arguments: Optional[Dict[str, Any]] = None
     description: Optional[str] = None
+    created_at: Optional[datetime] = None
+    observation_prompt_id: Optional[int] = None
+    observed_at: Optional[datetime] = None
+    latency_ms: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -0,0 +1,82 @@
+"""
+测试配置
+
+测试使用临时目录中的两个SQLite分片（DB_SHARDS），环境变量在导入应用之前设置；
+所有测试共享同一个应用实例，每个测试使用随机的会话ID
+"""
+import os
+import tempfile
+import time
+import uuid
+
+import pytest
+
+DATA_DIR = tempfile.mkdtemp(prefix="prompt-tracker-tests-")
+os.environ["DB_SHARDS"] = ",".join(
+    f"sqlite:///{os.path.join(DATA_DIR, f'shard{index}.db')}" for index in range(2)
+)
+os.environ["API_DEBUG"] = "false"
+os.environ["SESSION_IDLE_TIMEOUT"] = "0"
+os.environ["RETENTION_DAYS"] = "0"
+os.environ["RETENTION_BATCH_PAUSE"] = "0"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from database import shard_router  # noqa: E402
+
+API = "/api/v1"
+
+# 追加接口及请求体中内容字段的名称
+EVENT_FIELDS = {
+    "user-input": "user_input",
+    "system-marker": "reason",
+    "llm-output": "llm_output",
+    "observation": "observation",
+}
+
+
+@pytest.fixture(scope="session")
+def client():
+    """启动应用并等待数据库预热完成"""
+    with TestClient(main.app) as test_client:
+        deadline = time.monotonic() + 30
+        while test_client.get("/ready").status_code != 200:
+            assert time.monotonic() < deadline, "数据库预热超时"
+            time.sleep(0.05)
+        yield test_client
+
+
+@pytest.fixture
+def create_session(client):
+    """创建会话，返回会话ID"""
+    def create(initial_prompt: str = "INIT", session_id: str = None) -> str:
+        session_id = session_id or f"t-{uuid.uuid4().hex[:12]}"
+        response = client.post(f"{API}/sessions", json={"session_id": session_id, "initial_prompt": initial_prompt})
+        assert response.status_code == 200, response.text
+        return session_id
+    return create
+
+
+@pytest.fixture
+def session_id(create_session) -> str:
+    return create_session()
+
+
+@pytest.fixture
+def append(client):
+    """调用追加接口，检查状态码后返回响应内容"""
+    def post(session_id: str, kind: str, content: str, status_code: int = 200, **fields):
+        response = client.post(
+            f"{API}/sessions/{session_id}/{kind}",
+            json={"session_id": session_id, EVENT_FIELDS[kind]: content, **fields}
+        )
+        assert response.status_code == status_code, response.text
+        return response.json()
+    return post
+
+
+@pytest.fixture
+def shard_db():
+    """打开会话所属分片的数据库会话（上下文管理器）"""
+    return shard_router.session_scope
@@ -0,0 +1,92 @@
+"""
+按路由类别的准入控制与启动预热期间的就绪拦截
+"""
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from api.admission import AdmissionController, ReadinessMiddleware, route_class
+
+
+def test_route_class():
+    assert route_class("POST", "/api/v1/sessions/s/user-input") == "ingest"
+    assert route_class("GET", "/api/v1/sessions/s/prompts") == "read"
+    assert route_class("GET", "/api/v1/sessions") == "export"
+    assert route_class("POST", "/api/v1/sessions") == "ingest"
+    assert route_class("GET", "/api/v1/search") == "export"
+    assert route_class("GET", "/health") is None
+
+
+def _controller(**overrides):
+    options = dict(limits={"ingest": 1, "read": 1, "export": 1}, max_in_flight=2, queue_limit=1, queue_timeout=0.05)
+    options.update(overrides)
+    return AdmissionController(**options)
+
+
+def test_queue_full_and_timeout():
+    async def scenario():
+        controller = _controller()
+        assert await controller.acquire("ingest") is None
+        queued = asyncio.ensure_future(controller.acquire("ingest"))
+        await asyncio.sleep(0)
+        status_code, retry_after, reason = await controller.acquire("ingest")
+        assert (status_code, reason) == (429, "queue_full")
+        assert retry_after >= 1
+        assert (await queued)[::2] == (503, "timeout")
+        assert controller.classes["ingest"].rejected == {"queue_full": 1, "timeout": 1}
+
+    asyncio.run(scenario())
+
+
+def test_release_admits_waiter():
+    async def scenario():
+        controller = _controller(queue_timeout=1.0)
+        assert await controller.acquire("read") is None
+        queued = asyncio.ensure_future(controller.acquire("read"))
+        await asyncio.sleep(0)
+        controller.release("read", 0.01)
+        assert await queued is None
+        assert controller.classes["read"].in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_higher_priority_waiter_is_served_first():
+    async def scenario():
+        controller = _controller(limits={"ingest": 2, "read": 2, "export": 2}, queue_timeout=1.0)
+        assert await controller.acquire("ingest") is None
+        assert await controller.acquire("export") is None
+        read = asyncio.ensure_future(controller.acquire("read"))
+        ingest = asyncio.ensure_future(controller.acquire("ingest"))
+        await asyncio.sleep(0)
+        controller.release("export", 0.01)
+        assert await ingest is None
+        assert not read.done()
+        controller.release("ingest", 0.01)
+        assert await read is None
+
+    asyncio.run(scenario())
+
+
+def test_readiness_middleware_rejects_api_until_ready():
+    state = SimpleNamespace(ready=False)
+
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/api/v1/sessions", ok), Route("/health", ok)])
+    app.add_middleware(ReadinessMiddleware, state=state)
+    client = TestClient(app)
+
+    response = client.get("/api/v1/sessions")
+    assert response.status_code == 503
+    assert response.json()["reason"] == "starting"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get("/health").status_code == 200
+
+    state.ready = True
+    assert client.get("/api/v1/sessions").text == "ok"
@@ -0,0 +1,110 @@
+"""
+追加接口：提示词拼接、会话摘要、token计数、大内容存储和事件ID去重
+"""
+from core.tag_parser import (
+    user_input_fragment, system_marker_fragment, llm_output_fragment, observation_fragment
+)
+from config.settings import settings
+from tests.conftest import API
+
+ACTION = (
+    '<Action><ToolName>quark_search</ToolName><Description>搜索</Description></Action>'
+    '<ActionInput><ToolName>quark_search</ToolName><Arguments>{"q": "天气"}</Arguments></ActionInput>'
+)
+
+
+def test_appends_build_current_prompt(client, session_id, append):
+    append(session_id, "user-input", "你好")
+    append(session_id, "system-marker", "UserInput")
+    append(session_id, "llm-output", ACTION)
+    result = append(session_id, "observation", "晴", tool_name="quark_search")
+
+    expected = (
+        "INIT"
+        + user_input_fragment("你好")
+        + system_marker_fragment(session_id, "UserInput")
+        + llm_output_fragment(ACTION)
+        + observation_fragment("晴")
+    )
+    current = client.get(f"{API}/sessions/{session_id}/current-prompt").json()
+    assert current["current_prompt"] == expected
+    assert result["new_prompt_length"] == len(expected)
+
+    prompts = client.get(f"{API}/sessions/{session_id}/prompts").json()
+    assert [prompt["type"] for prompt in prompts] == [
+        "init", "user_input", "system_marker", "llm_output", "observation"
+    ]
+    assert prompts[-1]["prompt"] == expected
+
+
+def test_summary_follows_appends(client, session_id, append):
+    append(session_id, "user-input", "q1")
+    last = append(session_id, "llm-output", ACTION)
+
+    summary = client.get(f"{API}/sessions/{session_id}/summary").json()
+    assert summary["last_prompt_id"] == last["prompt_id"]
+    assert summary["event_count"] == 3
+    assert summary["event_counts"]["user_input"] == 1
+    assert summary["tool_call_count"] == 1
+    assert summary["prompt_length"] == last["new_prompt_length"]
+    assert summary["total_tokens"] == last["total_tokens"]
+
+
+def test_token_counts_accumulate(client, session_id, append):
+    first = append(session_id, "user-input", "hello world")
+    second = append(session_id, "user-input", "more words here")
+    assert 0 < first["total_tokens"] < second["total_tokens"]
+    assert second["context_budget"] == settings.CONTEXT_TOKEN_BUDGET
+
+    usage = client.get(f"{API}/sessions/{session_id}/tokens").json()
+    assert usage["total_tokens"] == second["total_tokens"]
+    assert [point["prompt_id"] for point in usage["curve"]][-1] == second["prompt_id"]
+
+
+def test_tool_calls_are_linked_to_observations(client, session_id, append):
+    append(session_id, "llm-output", ACTION)
+    result = append(session_id, "observation", "晴", tool_name="quark_search")
+    assert result["tool_call_id"] is not None
+
+    tool_calls = client.get(f"{API}/sessions/{session_id}/tool-calls").json()
+    assert len(tool_calls) == 1
+    assert tool_calls[0]["tool_name"] == "quark_search"
+    assert tool_calls[0]["arguments"] == {"q": "天气"}
+
+
+def test_duplicate_event_id_returns_first_result(client, session_id, append):
+    first = append(session_id, "user-input", "once", event_id="evt-1")
+    retry = append(session_id, "user-input", "once", event_id="evt-1")
+
+    assert retry["duplicate"] is True
+    assert retry["prompt_id"] == first["prompt_id"]
+    assert retry["new_prompt_length"] == first["new_prompt_length"]
+    prompts = client.get(f"{API}/sessions/{session_id}/prompts?view=summary").json()
+    assert len(prompts) == 2
+
+
+def test_large_observation_is_stored_out_of_line(client, session_id, append):
+    content = "x" * (settings.OBSERVATION_INLINE_MAX_CHARS + 1)
+    result = append(session_id, "observation", content)
+    digest = result["blob_digest"]
+    assert digest
+
+    expanded = client.get(f"{API}/sessions/{session_id}/current-prompt").json()["current_prompt"]
+    stored = client.get(f"{API}/sessions/{session_id}/current-prompt?expand_blobs=false").json()["current_prompt"]
+    assert expanded == "INIT" + observation_fragment(content)
+    assert f"<BlobRef>{digest}</BlobRef>" in stored
+    assert result["new_prompt_length"] == len(expanded)
+    assert client.get(f"{API}/blobs/{digest}").json()["content"] == content
+
+
+def test_content_with_blob_ref_is_rejected(client, session_id, append):
+    content = "y" * (settings.OBSERVATION_INLINE_MAX_CHARS + 1)
+    digest = append(session_id, "observation", content)["blob_digest"]
+
+    other = client.post(f"{API}/sessions", json={"session_id": session_id + "-b", "initial_prompt": "I"})
+    assert other.status_code == 200
+    append(session_id + "-b", "user-input", f"<BlobRef>{digest}</BlobRef>", status_code=400)
+
+
+def test_append_to_unknown_session_returns_404(append):
+    append("missing-session", "user-input", "hi", status_code=404)
@@ -0,0 +1,83 @@
+"""
+链式哈希与提示词链完整性校验
+"""
+from types import SimpleNamespace
+
+from core.chain_verify import verify_rows, run_verify
+from core.prompt_chain import chain_hash
+from models.prompt_models import PromptModel
+from tests.conftest import API
+
+
+def _row(prompt_id, prompt, prompt_length, previous_hash, fragment, is_delta=False):
+    return SimpleNamespace(
+        id=prompt_id, prompt=prompt, prompt_length=prompt_length, is_delta=is_delta,
+        chain_hash=chain_hash(previous_hash, fragment)
+    )
+
+
+def test_chain_hash_depends_on_previous_hash():
+    first = chain_hash(None, "INIT")
+    assert chain_hash(first, "a") != chain_hash(chain_hash(None, "OTHER"), "a")
+    assert chain_hash(first, "a") == chain_hash(first, "a")
+
+
+def test_verify_rows_accepts_full_and_delta_rows():
+    first = _row(1, "INIT", 4, None, "INIT")
+    second = _row(2, "+a", 6, first.chain_hash, "+a", is_delta=True)
+    third = _row(3, "INIT+a+b", 8, second.chain_hash, "+b")
+    result = verify_rows("s", [first, second, third], tip_id=3)
+    assert result["broken"] is None
+    assert result["checked"] == 3
+    assert result["tip_found"] is True
+
+
+def test_verify_rows_reports_first_break():
+    first = _row(1, "INIT", 4, None, "INIT")
+    tampered = _row(2, "INIT+x", 6, first.chain_hash, "+a")
+    result = verify_rows("s", [first, tampered])
+    assert result["broken"] == {"session_id": "s", "prompt_id": 2, "reason": "链式哈希不一致"}
+
+    not_prefix = _row(2, "OTHER+a", 7, first.chain_hash, "ER+a")
+    assert verify_rows("s", [first, not_prefix])["broken"]["reason"] == "不是上一条提示词的延续"
+
+
+def test_verify_endpoint(client, session_id, append, shard_db):
+    append(session_id, "user-input", "a")
+    append(session_id, "user-input", "b")
+    result = client.get(f"{API}/sessions/{session_id}/verify").json()
+    assert result["valid"] is True
+    assert result["checked_prompts"] == 3
+
+    client.post(f"{API}/sessions/{session_id}/complete")
+    assert client.get(f"{API}/sessions/{session_id}/verify").json()["broken"] is None
+
+    with shard_db(session_id) as db:
+        middle = db.query(PromptModel).filter(PromptModel.session_id == session_id).order_by(PromptModel.id)[1]
+        middle_id = middle.id
+        middle.prompt = middle.prompt.replace("a", "z")
+        db.commit()
+    result = client.get(f"{API}/sessions/{session_id}/verify").json()
+    assert result["valid"] is False
+    assert result["broken"]["prompt_id"] == middle_id
+
+
+def test_verify_fork_child(client, session_id, append):
+    append(session_id, "user-input", "a")
+    child_id = client.post(f"{API}/sessions/{session_id}/fork").json()["session_id"]
+    assert client.get(f"{API}/sessions/{child_id}/verify").json()["broken"] is None
+    append(child_id, "user-input", "b")
+    assert client.get(f"{API}/sessions/{child_id}/verify").json()["broken"] is None
+
+
+def test_run_verify_in_process_pool(client, create_session, append, tmp_path):
+    session_ids = [create_session() for _ in range(4)]
+    for session_id in session_ids:
+        append(session_id, "user-input", "x")
+    report = tmp_path / "broken.jsonl"
+
+    totals = run_verify(workers=2, batch_sessions=2, session_ids=session_ids, report_path=str(report))
+    assert totals["sessions"] == 4
+    assert totals["prompts"] == 8
+    assert totals["broken"] == 0
+    assert report.read_text() == ""
@@ -0,0 +1,132 @@
+"""
+事件写入格式：事件校验、msgpack帧流解析、批量和帧流接口
+"""
+import asyncio
+
+import pytest
+
+from api.ingest import FRAME_HEADER, IngestFormatError, iter_frames, parse_event
+from config.settings import settings
+from tests.conftest import API
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+requires_msgpack = pytest.mark.skipif(msgpack is None, reason="未安装msgpack")
+
+
+def _frame(event) -> bytes:
+    payload = msgpack.packb(event)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def _decode(chunks):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [item async for item in iter_frames(stream())]
+
+    return asyncio.run(collect())
+
+
+def test_parse_event_normalizes_fields():
+    event = parse_event({"type": "user_input", "content": "hi"}, session_id="s1")
+    assert event == {
+        "type": "user_input", "session_id": "s1", "content": "hi",
+        "event_id": None, "tool_name": None, "tool_call_id": None,
+    }
+
+
+@pytest.mark.parametrize("data, session_id", [
+    ([], None),
+    ({"type": "unknown", "session_id": "s", "content": ""}, None),
+    ({"type": "user_input", "content": "x"}, None),
+    ({"type": "user_input", "session_id": "other", "content": "x"}, "s"),
+    ({"type": "user_input", "session_id": "s", "content": 1}, None),
+    ({"type": "user_input", "session_id": "s", "content": "x", "event_id": "e" * 129}, None),
+    ({"type": "observation", "session_id": "s", "content": "x", "tool_call_id": True}, None),
+])
+def test_parse_event_rejects_invalid_events(data, session_id):
+    with pytest.raises(IngestFormatError):
+        parse_event(data, session_id)
+
+
+@requires_msgpack
+def test_iter_frames_handles_frames_split_across_chunks():
+    events = [{"type": "user_input", "session_id": "s", "content": str(index)} for index in range(3)]
+    body = b"".join(_frame(event) for event in events)
+    chunks = [body[index:index + 5] for index in range(0, len(body), 5)]
+    assert _decode(chunks) == events
+    assert _decode([body]) == events
+
+
+@requires_msgpack
+def test_iter_frames_rejects_truncated_body():
+    body = _frame({"type": "user_input"})
+    with pytest.raises(IngestFormatError):
+        _decode([body[:-1]])
+
+
+@requires_msgpack
+def test_iter_frames_rejects_oversized_frame():
+    with pytest.raises(IngestFormatError):
+        _decode([FRAME_HEADER.pack(settings.INGEST_MAX_FRAME_BYTES + 1)])
+
+
+def test_batch_events_across_sessions(client, create_session):
+    first, second = create_session(), create_session()
+    response = client.post(f"{API}/events/batch", json={"events": [
+        {"type": "user_input", "session_id": first, "content": "a"},
+        {"type": "user_input", "session_id": second, "content": "b"},
+        {"type": "llm_output", "session_id": first, "content": "<Thought>t</Thought>"},
+        {"type": "user_input", "session_id": "missing-session", "content": "c"},
+    ]}).json()
+    assert response["accepted"] == 3
+    assert [result["success"] for result in response["results"]] == [True, True, True, False]
+
+    current = client.get(f"{API}/sessions/{first}/current-prompt").json()["current_prompt"]
+    assert current == "INIT\n<UserInput>a</UserInput>\n<Thought>t</Thought>"
+
+
+@requires_msgpack
+def test_single_msgpack_event(client, session_id):
+    response = client.post(
+        f"{API}/sessions/{session_id}/events",
+        content=msgpack.packb({"type": "user_input", "content": "packed", "event_id": "m-1"}),
+        headers={"Content-Type": "application/msgpack"}
+    )
+    assert response.status_code == 200, response.text
+    retry = client.post(
+        f"{API}/sessions/{session_id}/events",
+        content=msgpack.packb({"type": "user_input", "content": "packed", "event_id": "m-1"}),
+        headers={"Content-Type": "application/msgpack"}
+    ).json()
+    assert retry["duplicate"] is True
+
+    bad = client.post(f"{API}/sessions/{session_id}/events", content=b"\xc1", headers={"Content-Type": "application/msgpack"})
+    assert bad.status_code == 400
+
+
+@requires_msgpack
+def test_event_stream(client, create_session):
+    first, second = create_session(), create_session()
+    body = b"".join([
+        _frame({"type": "user_input", "session_id": first, "content": "1"}),
+        _frame({"type": "user_input", "session_id": second, "content": "2"}),
+        _frame({"type": "bogus", "session_id": first, "content": "3"}),
+        _frame({"type": "user_input", "session_id": first, "content": "4"}),
+    ])
+    response = client.post(f"{API}/events/stream", content=body, headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 200, response.text
+    assert [result["success"] for result in response.json()["results"]] == [True, True, False, True]
+    assert client.get(f"{API}/sessions/{first}/current-prompt").json()["current_prompt"] == (
+        "INIT\n<UserInput>1</UserInput>\n<UserInput>4</UserInput>"
+    )
+
+    truncated = client.post(f"{API}/events/stream", content=body[:-2], headers={"Content-Type": "application/msgpack"})
+    assert truncated.status_code == 400
+    assert client.post(f"{API}/events/stream", content=body).status_code == 415
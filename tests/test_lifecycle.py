@@ -0,0 +1,94 @@
+"""
+会话结束、提示词链压缩与分叉
+"""
+from models.prompt_models import PromptModel
+from tests.conftest import API
+
+
+def _build_session(session_id, append, turns=3):
+    for turn in range(turns):
+        append(session_id, "user-input", f"问题{turn}")
+        append(session_id, "llm-output", f"<Thought>思考{turn}</Thought>")
+
+
+def _prompts(client, session_id, query=""):
+    return client.get(f"{API}/sessions/{session_id}/prompts{query}").json()
+
+
+def _current_prompt(client, session_id):
+    return client.get(f"{API}/sessions/{session_id}/current-prompt").json()["current_prompt"]
+
+
+def test_complete_compacts_prompt_chain(client, session_id, append, shard_db):
+    _build_session(session_id, append)
+    before = _prompts(client, session_id)
+    current = _current_prompt(client, session_id)
+
+    # 后台任务在响应发送后、请求结束前执行
+    result = client.post(f"{API}/sessions/{session_id}/complete").json()
+    assert result["status"] == "completed"
+
+    with shard_db(session_id) as db:
+        deltas = [row.is_delta for row in db.query(PromptModel.is_delta).filter(
+            PromptModel.session_id == session_id
+        ).order_by(PromptModel.id)]
+    # 第一条和最后一条保存完整提示词，中间记录只保存片段
+    assert deltas == [False] + [True] * (len(before) - 2) + [False]
+
+    assert _prompts(client, session_id) == before
+    assert _prompts(client, session_id, "?fields=id,prompt") == [
+        {"id": prompt["id"], "prompt": prompt["prompt"]} for prompt in before
+    ]
+    assert _current_prompt(client, session_id) == current
+    assert client.get(f"{API}/sessions/{session_id}").json()["status"] == "completed"
+
+
+def test_final_answer_completes_session(client, session_id, append):
+    result = append(session_id, "llm-output", "<FinalAsnwer>完成</FinalAsnwer><End><Reason>FinalAsnwer</Reason></End>")
+    assert result["session_completed"] is True
+    assert client.get(f"{API}/sessions/{session_id}").json()["status"] == "completed"
+
+
+def test_complete_with_error_status(client, session_id):
+    result = client.post(f"{API}/sessions/{session_id}/complete?status=error").json()
+    assert result["status"] == "error"
+
+
+def test_fork_shares_history_up_to_fork_point(client, session_id, append):
+    _build_session(session_id, append)
+    parent_prompts = _prompts(client, session_id)
+    fork_point = parent_prompts[2]
+
+    fork = client.post(f"{API}/sessions/{session_id}/fork?at_prompt_id={fork_point['id']}").json()
+    child_id = fork["session_id"]
+    assert fork["parent_session_id"] == session_id
+    assert _current_prompt(client, child_id) == fork_point["prompt"]
+    assert _prompts(client, child_id) == parent_prompts[:3]
+
+    append(child_id, "user-input", "分支")
+    assert _current_prompt(client, child_id) == fork_point["prompt"] + "\n<UserInput>分支</UserInput>"
+    assert _prompts(client, session_id) == parent_prompts
+
+
+def test_fork_after_parent_compaction(client, session_id, append):
+    _build_session(session_id, append)
+    parent_prompts = _prompts(client, session_id)
+    client.post(f"{API}/sessions/{session_id}/complete")
+
+    fork_point = parent_prompts[3]
+    child_id = client.post(f"{API}/sessions/{session_id}/fork?at_prompt_id={fork_point['id']}").json()["session_id"]
+    assert _current_prompt(client, child_id) == fork_point["prompt"]
+    assert _prompts(client, child_id, "?fields=prompt") == [
+        {"id": prompt["id"], "prompt": prompt["prompt"]} for prompt in parent_prompts[:4]
+    ]
+
+    result = append(child_id, "user-input", "继续")
+    assert result["new_prompt_length"] == len(fork_point["prompt"] + "\n<UserInput>继续</UserInput>")
+
+
+def test_fork_at_foreign_prompt_is_rejected(client, create_session, append):
+    first = create_session()
+    second = create_session()
+    other_prompt = append(second, "user-input", "x")["prompt_id"]
+    response = client.post(f"{API}/sessions/{first}/fork?at_prompt_id={other_prompt}")
+    assert response.status_code == 400
@@ -0,0 +1,62 @@
+"""
+列表接口的字段投影（view/fields）与响应编码
+"""
+from api.prompt_routes import PROMPT_SUMMARY_FIELDS, SESSION_SUMMARY_FIELDS
+from tests.conftest import API
+
+
+def test_prompt_summary_view_omits_prompt_text(client, session_id, append):
+    append(session_id, "user-input", "q")
+    prompts = client.get(f"{API}/sessions/{session_id}/prompts?view=summary").json()
+    assert [set(prompt) for prompt in prompts] == [set(PROMPT_SUMMARY_FIELDS)] * 2
+
+
+def test_prompt_fields_selects_columns(client, session_id, append):
+    append(session_id, "user-input", "q")
+    prompts = client.get(f"{API}/sessions/{session_id}/prompts?fields=type,prompt_length").json()
+    assert prompts == [
+        {"id": prompts[0]["id"], "type": "init", "prompt_length": 4},
+        {"id": prompts[1]["id"], "type": "user_input", "prompt_length": len("INIT\n<UserInput>q</UserInput>")},
+    ]
+
+
+def test_prompt_fields_with_prompt_matches_full_view(client, session_id, append):
+    append(session_id, "user-input", "q")
+    full = client.get(f"{API}/sessions/{session_id}/prompts").json()
+    projected = client.get(f"{API}/sessions/{session_id}/prompts?fields=prompt").json()
+    assert projected == [{"id": prompt["id"], "prompt": prompt["prompt"]} for prompt in full]
+
+
+def test_unknown_field_is_rejected(client, session_id):
+    response = client.get(f"{API}/sessions/{session_id}/prompts?fields=id,secret")
+    assert response.status_code == 400
+
+
+def test_session_summary_view(client, create_session, append):
+    session_id = create_session()
+    append(session_id, "user-input", "q")
+    sessions = client.get(f"{API}/sessions?view=summary&limit=1000").json()
+    row = next(row for row in sessions if row["session_id"] == session_id)
+    assert set(row) == set(SESSION_SUMMARY_FIELDS)
+    assert row["event_count"] == 2
+    assert row["prompt_length"] == len("INIT\n<UserInput>q</UserInput>")
+
+
+def test_session_fields(client, create_session):
+    session_id = create_session()
+    sessions = client.get(f"{API}/sessions?fields=session_id,status&limit=1000").json()
+    row = next(row for row in sessions if row["session_id"] == session_id)
+    assert row == {"id": row["id"], "session_id": session_id, "status": "active"}
+
+
+def test_responses_vary_on_accept_encoding(client, session_id, append):
+    append(session_id, "user-input", "x" * 4000)
+    response = client.get(
+        f"{API}/sessions/{session_id}/prompts", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+
+    small = client.get(f"{API}/sessions/{session_id}/summary", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in small.headers
+    assert "Accept-Encoding" in small.headers["vary"]
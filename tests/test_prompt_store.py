@@ -0,0 +1,58 @@
+"""
+共享前缀的提示词片段存储与当前提示词缓存
+"""
+from api.prompt_routes import prompt_tracker
+from core.prompt_store import ChunkStore, PromptCache
+from tests.conftest import API
+
+
+def test_chunks_with_same_prefix_are_shared():
+    store = ChunkStore()
+    first = store.intern(store.intern(None, "INIT"), "\nq1")
+    second = store.intern(store.intern(None, "INIT"), "\nq1")
+    assert first is second
+    assert first.render() == "INIT\nq1"
+
+    built = store.build("INIT\nq1\nq2", [4, 7])
+    assert built.parent is first
+    assert store.stats()["unique_chars"] == len("INIT\nq1\nq2")
+
+
+def test_cache_extend_only_from_previous_version():
+    cache = PromptCache(10)
+    cache.put("s", 1, cache.store.build("INIT", [4]))
+
+    cache.extend("s", 2, 7, "\nq1")
+    assert cache.get("s", 2).render() == "INIT\nq1"
+
+    # 较早提交的版本不会覆盖较新的缓存
+    cache.extend("s", 1, 4, "INIT")
+    assert cache.get("s", 2) is not None
+
+    # 缺少中间版本时保留旧缓存，读取时按版本号未命中
+    cache.extend("s", 4, 13, "\nq3")
+    assert cache.get("s", 4) is None
+    assert cache.peek("s").render() == "INIT\nq1"
+
+
+def test_cache_evicts_least_recently_used():
+    cache = PromptCache(2)
+    for index, session_id in enumerate("abc"):
+        cache.put(session_id, index, cache.store.build(session_id, [1]))
+    assert cache.peek("a") is None
+    assert cache.stats()["sessions"] == 2
+
+
+def test_appends_use_cached_prompt(client, session_id, append):
+    client.get(f"{API}/sessions/{session_id}/current-prompt")
+    hits = prompt_tracker.prompt_cache.hits
+    append(session_id, "user-input", "a")
+    append(session_id, "user-input", "b")
+    assert prompt_tracker.prompt_cache.hits >= hits + 2
+
+    current = client.get(f"{API}/sessions/{session_id}/current-prompt").json()["current_prompt"]
+    assert current == "INIT\n<UserInput>a</UserInput>\n<UserInput>b</UserInput>"
+
+    # 丢弃缓存后从数据库重建的结果一致
+    prompt_tracker.prompt_cache.invalidate(session_id)
+    assert client.get(f"{API}/sessions/{session_id}/current-prompt").json()["current_prompt"] == current
@@ -0,0 +1,99 @@
+"""
+会话回放与历史日志批量导入
+"""
+import json
+import uuid
+from collections import Counter
+
+from core.blob_store import blob_ref
+from core.bulk_import import import_file, read_events
+from tests.conftest import API
+
+
+def _replay(client, session_id, **params):
+    response = client.get(f"{API}/sessions/{session_id}/replay", params=params)
+    assert response.status_code == 200, response.text
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_replay_streams_fragments(client, session_id, append):
+    append(session_id, "user-input", "a")
+    append(session_id, "llm-output", "<Thought>t</Thought>")
+    client.post(f"{API}/sessions/{session_id}/complete")
+
+    lines = _replay(client, session_id, parse=True)
+    assert [line["kind"] for line in lines] == ["initial", "event", "event", "end"]
+    assert lines[0]["fragment"] == "INIT"
+    assert "".join(line["fragment"] for line in lines[:-1]) == (
+        client.get(f"{API}/sessions/{session_id}/current-prompt").json()["current_prompt"]
+    )
+    assert lines[2]["segments"]
+    assert lines[-1]["events"] == 2
+    assert client.get(f"{API}/sessions/missing-session/replay").status_code == 404
+
+
+def test_replay_of_fork_child_starts_from_inherited_prompt(client, session_id, append):
+    append(session_id, "user-input", "a")
+    child_id = client.post(f"{API}/sessions/{session_id}/fork").json()["session_id"]
+    append(child_id, "user-input", "b")
+
+    lines = _replay(client, child_id)
+    assert lines[0]["inherited"] is True
+    assert [(line["fragment"], line["inherited"]) for line in lines[1:-1]] == [
+        ("\n<UserInput>a</UserInput>", True), ("\n<UserInput>b</UserInput>", False)
+    ]
+
+
+def _write_events(path, events, extra_lines=()):
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        for line in extra_lines:
+            f.write(line + "\n")
+
+
+def test_read_events_skips_invalid_lines(tmp_path):
+    path = tmp_path / "events.jsonl"
+    _write_events(path, [
+        {"session_id": "a", "type": "user_input", "content": "1"},
+        {"session_id": "b", "type": "user_input", "content": "2", "timestamp": 1700000000},
+        {"session_id": "a", "type": "llm_output", "content": "3"},
+    ], extra_lines=[
+        "not json",
+        json.dumps({"session_id": "a", "type": "bogus", "content": ""}),
+        json.dumps({"session_id": "a", "type": "user_input", "content": blob_ref("0" * 64)}),
+    ])
+    stats = Counter()
+    sessions = read_events(str(path), stats)
+    assert list(sessions) == ["a", "b"]
+    assert [event["content"] for event in sessions["a"]] == ["1", "3"]
+    assert sessions["b"][0]["timestamp"].year == 2023
+    assert stats["invalid_lines"] == 3
+
+
+def test_import_file_matches_online_appends(client, append, create_session, tmp_path):
+    imported = f"import-{uuid.uuid4().hex[:8]}"
+    path = tmp_path / "events.jsonl"
+    _write_events(path, [
+        {"session_id": imported, "type": "init", "content": "INIT", "timestamp": "2025-01-01T08:00:00Z"},
+        {"session_id": imported, "type": "user_input", "content": "a", "timestamp": "2025-01-01T08:00:01Z"},
+        {"session_id": imported, "type": "llm_output", "content": "<Thought>t</Thought>"},
+        {"session_id": imported, "type": "user_input", "content": "b"},
+    ])
+
+    stats = import_file(str(path), batch_sessions=10)
+    assert (stats["sessions"], stats["events"], stats["failed_sessions"]) == (1, 4, 0)
+    assert import_file(str(path), batch_sessions=10)["skipped_sessions"] == 1
+
+    online = create_session()
+    append(online, "user-input", "a")
+    append(online, "llm-output", "<Thought>t</Thought>")
+    append(online, "user-input", "b")
+
+    def current(session_id):
+        return client.get(f"{API}/sessions/{session_id}/current-prompt").json()["current_prompt"]
+
+    assert current(imported) == current(online)
+    assert client.get(f"{API}/sessions/{imported}/verify").json()["valid"] is True
+    full = client.get(f"{API}/sessions/{imported}/prompts", params={"view": "full"}).json()
+    assert [prompt["prompt"] for prompt in full][-1] == current(online)
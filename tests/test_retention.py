@@ -0,0 +1,66 @@
+"""
+过期会话的分批清理
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from api.prompt_routes import retention_manager
+from config.settings import settings
+from models.prompt_models import PromptModel, SearchTermModel
+from tests.conftest import API
+
+
+@pytest.fixture
+def retention(monkeypatch):
+    """开启1天的保留期限，清理时以两天之后为当前时间"""
+    monkeypatch.setattr(settings, "RETENTION_DAYS", 1)
+    monkeypatch.setattr(settings, "RETENTION_BATCH_SIZE", 2)
+    return lambda: retention_manager.purge(now=datetime.utcnow() + timedelta(days=2))
+
+
+def _status(client, session_id):
+    return client.get(f"{API}/sessions/{session_id}").status_code
+
+
+def test_purge_removes_expired_sessions(client, session_id, append, shard_db, retention):
+    append(session_id, "user-input", "待清理")
+    client.post(f"{API}/sessions/{session_id}/complete")
+
+    progress = retention()
+    assert progress["state"] == "completed"
+    assert progress["rows_deleted"]["prompts"] >= 2
+    assert _status(client, session_id) == 404
+    with shard_db(session_id) as db:
+        for model in (PromptModel, SearchTermModel):
+            assert db.query(model).filter(model.session_id == session_id).count() == 0
+    append(session_id, "user-input", "x", status_code=404)
+
+
+def test_active_sessions_are_kept(client, session_id, append, retention):
+    append(session_id, "user-input", "进行中")
+    retention()
+    assert _status(client, session_id) == 200
+
+
+def test_parent_with_fork_child_is_kept_until_child_is_purged(client, session_id, append, retention):
+    append(session_id, "user-input", "父会话")
+    child_id = client.post(f"{API}/sessions/{session_id}/fork").json()["session_id"]
+    client.post(f"{API}/sessions/{session_id}/complete")
+
+    retention()
+    assert _status(client, session_id) == 200
+    assert client.get(f"{API}/sessions/{child_id}/current-prompt").json()["current_prompt"].endswith(
+        "<UserInput>父会话</UserInput>"
+    )
+
+    client.post(f"{API}/sessions/{child_id}/complete")
+    retention()
+    assert _status(client, child_id) == 404
+    assert _status(client, session_id) == 404
+
+
+def test_purge_is_disabled_without_retention_days(client, session_id):
+    client.post(f"{API}/sessions/{session_id}/complete")
+    retention_manager.purge(now=datetime.utcnow() + timedelta(days=365))
+    assert _status(client, session_id) == 200
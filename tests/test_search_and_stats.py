@@ -0,0 +1,83 @@
+"""
+全文检索、工具调用统计、事件速率时间序列和系统统计
+"""
+import uuid
+
+from core.search_index import tokenize
+from tests.conftest import API
+
+
+def test_tokenize_splits_words_and_cjk():
+    assert tokenize("Hello quark_search 2024") == ["hello", "quark_search", "2024"]
+    assert tokenize("小猫咪") == ["小猫", "猫咪"]
+    assert sorted(tokenize("小猫咪", unigrams=True)) == sorted(["小猫", "猫咪", "小", "猫", "咪"])
+    assert tokenize("猫") == ["猫"]
+
+
+def test_search_finds_appended_fragments(client, session_id, append):
+    word = f"w{uuid.uuid4().hex[:8]}"
+    prompt_id = append(session_id, "user-input", f"please find {word}")["prompt_id"]
+    append(session_id, "llm-output", f"<Thought>{word} thinking</Thought>")
+
+    results = client.get(f"{API}/search", params={"q": word}).json()
+    assert {result["session_id"] for result in results} == {session_id}
+    assert len(results) == 2
+
+    user_inputs = client.get(f"{API}/search", params={"q": f"find {word}", "type": "UserInput"}).json()
+    assert [result["prompt_id"] for result in user_inputs] == [prompt_id]
+    assert client.get(f"{API}/search", params={"q": f"{word} missingterm"}).json() == []
+
+
+def test_search_single_cjk_character(client, session_id, append):
+    prompt_id = append(session_id, "user-input", "我家的小猫咪很可爱")["prompt_id"]
+    for query in ("猫", "小猫", "猫咪 可爱"):
+        results = client.get(f"{API}/search", params={"q": query, "session_id": session_id}).json()
+        assert [result["prompt_id"] for result in results] == [prompt_id], query
+
+
+def test_search_tool_arguments(client, session_id, append):
+    tool = f"tool_{uuid.uuid4().hex[:6]}"
+    append(session_id, "llm-output", (
+        f"<Action><ToolName>{tool}</ToolName><Description>d</Description></Action>"
+        f'<ActionInput><ToolName>{tool}</ToolName><Arguments>{{"city": "hangzhou"}}</Arguments></ActionInput>'
+    ))
+    results = client.get(f"{API}/search", params={"q": "hangzhou", "tool": tool}).json()
+    assert len(results) == 1
+    assert results[0]["tool_name"] == tool
+
+
+def test_tool_call_analytics(client, session_id, append):
+    tool = f"tool_{uuid.uuid4().hex[:6]}"
+    action = f"<Action><ToolName>{tool}</ToolName><Description>d</Description></Action>"
+    append(session_id, "llm-output", action + f"<ActionInput><ToolName>{tool}</ToolName><Arguments>{{}}</Arguments></ActionInput>")
+    append(session_id, "llm-output", action + f"<ActionInput><ToolName>{tool}</ToolName><Arguments>not json</Arguments></ActionInput>")
+    append(session_id, "llm-output", action)
+
+    analytics = client.get(f"{API}/analytics/tool-calls").json()
+    assert analytics["tools"][tool] == {
+        "calls": 3, "parse_failures": 1, "missing_arguments": 1, "parse_failure_rate": 1 / 3
+    }
+    assert "calls_per_session" in analytics
+
+    filtered = client.get(f"{API}/analytics/tool-calls", params={"tool": tool}).json()
+    assert set(filtered["tools"]) == {tool}
+    assert "calls_per_session" not in filtered
+
+
+def test_event_timeseries_counts_appends(client, session_id, append):
+    before = client.get(f"{API}/stats/timeseries", params={"step": "1h"}).json()
+    append(session_id, "user-input", "x")
+    after = client.get(f"{API}/stats/timeseries", params={"step": "1h"}).json()
+
+    def total(series, event_type):
+        return sum(point["events"][event_type] for point in series["points"])
+
+    assert total(after, "user_input") == total(before, "user_input") + 1
+    assert client.get(f"{API}/stats/timeseries", params={"step": "bogus"}).status_code == 400
+
+
+def test_stats(client, session_id):
+    stats = client.get(f"{API}/stats").json()
+    assert stats["sessions"]["total"] >= 1
+    assert stats["prompts"]["total"] >= stats["sessions"]["total"]
+    assert "prompt_cache" in stats
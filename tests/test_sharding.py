@@ -0,0 +1,46 @@
+"""
+一致性哈希分片路由与分片间互不重叠的自增ID
+"""
+from database.connection import SHARD_ID_SPAN
+from database.sharding import HashRing, shard_router
+from tests.conftest import API
+
+
+def test_hash_ring_is_deterministic_and_spreads_keys():
+    ring = HashRing(["a", "b", "c"], vnodes=64)
+    again = HashRing(["a", "b", "c"], vnodes=64)
+    keys = [f"session-{index}" for index in range(300)]
+    located = [ring.locate(key) for key in keys]
+    assert located == [again.locate(key) for key in keys]
+    assert set(located) == {0, 1, 2}
+
+
+def test_sessions_are_spread_over_shards(client, create_session):
+    session_ids = [create_session() for _ in range(16)]
+    assert shard_router.shard_count == 2
+    assert {shard_router.shard_index(session_id) for session_id in session_ids} == {0, 1}
+
+    listed = {session["session_id"] for session in client.get(f"{API}/sessions", params={"limit": 1000}).json()}
+    assert set(session_ids) <= listed
+
+
+def test_prompt_ids_are_unique_across_shards(client, create_session, append):
+    session_ids = [create_session() for _ in range(8)]
+    prompt_ids = {}
+    for session_id in session_ids:
+        prompt_id = append(session_id, "user-input", "x")["prompt_id"]
+        prompt_ids[prompt_id] = session_id
+        assert prompt_id // SHARD_ID_SPAN == shard_router.shard_index(session_id)
+    assert len(prompt_ids) == len(session_ids)
+
+
+def test_fork_child_is_colocated(client, session_id):
+    child_id = client.post(f"{API}/sessions/{session_id}/fork").json()["session_id"]
+    assert shard_router.shard_index(child_id) == shard_router.shard_index(session_id)
+
+    other_shard = next(
+        f"child-{index}" for index in range(100)
+        if shard_router.shard_index(f"child-{index}") != shard_router.shard_index(session_id)
+    )
+    response = client.post(f"{API}/sessions/{session_id}/fork", params={"new_session_id": other_shard})
+    assert response.status_code == 400
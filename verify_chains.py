@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+提示词链完整性校验（离线执行，直接读数据库）
+
+用法: python verify_chains.py [--workers 8] [--batch-sessions 200] [--session ID ...] [--report broken.jsonl]
+
+不指定 --session 时校验全部会话；发现断链时以状态码1退出，断链明细写入 --report 指定的文件
+"""
+import os
+import sys
+import logging
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.settings import settings
+from core.chain_verify import run_verify
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校验提示词链的完整性（长度、前缀和链式哈希）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行的工作进程数")
+    parser.add_argument("--batch-sessions", type=int, default=200, help="每个任务校验的会话数")
+    parser.add_argument("--session", action="append", dest="sessions", help="只校验指定会话（可重复）")
+    parser.add_argument("--report", help="断链明细输出文件（每行一个JSON）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL), format=settings.LOG_FORMAT)
+
+    totals = run_verify(args.workers, args.batch_sessions, args.sessions, args.report)
+
+    print()
+    print(f"校验完成: {totals['sessions']} 个会话、{totals['prompts']} 条记录，耗时 {totals['seconds']} 秒")
+    print(f"断链: {totals['broken']} 处，无哈希的旧记录: {totals['unhashed']} 条")
+    if totals["failed_batches"]:
+        print(f"有 {totals['failed_batches']} 批会话校验失败，请查看日志后重新运行")
+    if totals["broken"] or totals["failed_batches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()